@@ -0,0 +1,134 @@
+"""
+Load comparison of the sync (Flask) app and the async (ASGI) app against the local Fauna stand-in.
+
+Each app runs in its own process, pointed at `benchmarks.fauna_standin`. The sync app is served by a fixed pool of
+worker threads, like a threaded gunicorn worker; the async app runs under uvicorn in a single thread. A load generator
+then keeps `--concurrency` requests to GET /orders/<id> of one of the seeded orders in flight and reports throughput
+and latency for each.
+
+Requires the optional dependencies in requirements-async.txt. Run from the repository root:
+
+    python -m benchmarks.async_load --latency-ms 20 --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+
+import aiohttp
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_sync(port: int, threads: int):
+    """Serve the Flask app from a fixed pool of threads."""
+    from werkzeug.serving import BaseWSGIServer
+
+    from ecommerce_app.app import app
+
+    class PooledWSGIServer(BaseWSGIServer):
+        executor = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+def wait_for(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing is listening on port {port}')
+
+
+async def seeded_order(url: str) -> str:
+    """The id of one of the seeded customer's orders, see seed/orders.fql."""
+    async with aiohttp.ClientSession() as http:
+        async with http.get(f'{url}/customers/999/orders') as response:
+            response.raise_for_status()
+            return (await response.json())['data'][0]['id']
+
+
+async def generate_load(url: str, concurrency: int, requests: int) -> dict:
+    latencies = []
+    remaining = iter(range(requests))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as http:
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                async with http.get(url) as response:
+                    response.raise_for_status()
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    percentiles = quantiles(latencies, n=100)
+    return {'rps': len(latencies) / elapsed, 'p50': percentiles[49] * 1000, 'p95': percentiles[94] * 1000,
+            'p99': percentiles[98] * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of the Fauna stand-in.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Requests kept in flight by the load generator.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8, help='Worker threads for the sync app.')
+    parser.add_argument('--serve-sync', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_sync:
+        serve_sync(args.serve_sync, args.threads)
+        return
+
+    fauna_port, sync_port, async_port = free_port(), free_port(), free_port()
+    env = {**os.environ, 'FAUNA_ENDPOINT': f'http://127.0.0.1:{fauna_port}', 'FAUNA_SECRET': 'secret',
+           'FAUNA_POOL_MAX_CONNECTIONS': str(args.concurrency), 'FAUNA_POOL_MAX_KEEPALIVE': str(args.concurrency)}
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.fauna_standin', '--port', str(fauna_port),
+                          '--latency-ms', str(args.latency_ms)], env=env),
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.async_load', '--serve-sync', str(sync_port),
+                          '--threads', str(args.threads)], env=env),
+        subprocess.Popen([sys.executable, '-m', 'uvicorn', 'ecommerce_app.asgi:app', '--port', str(async_port),
+                          '--log-level', 'warning'], env=env),
+    ]
+    try:
+        for port in (fauna_port, sync_port, async_port):
+            wait_for(port)
+        order_id = asyncio.run(seeded_order(f'http://127.0.0.1:{sync_port}'))
+        print(f'Fauna stand-in latency {args.latency_ms}ms, concurrency {args.concurrency}, {args.requests} requests')
+        print(f"{'app':<28} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, port in ((f'sync ({args.threads} threads)', sync_port), ('async (1 event loop)', async_port)):
+            url = f'http://127.0.0.1:{port}/orders/{order_id}'
+            asyncio.run(generate_load(url, min(args.concurrency, 8), 50))  # warm up connections
+            result = asyncio.run(generate_load(url, args.concurrency, args.requests))
+            print(f"{name:<28} {result['rps']:>8.0f} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f}")
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
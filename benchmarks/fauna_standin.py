@@ -0,0 +1,642 @@
+"""
+A local stand-in for Fauna, for load tests that can't reach a real database.
+
+It serves the query endpoint (POST /query/1) over HTTP, with the same tagged JSON request and response formats as
+Fauna, so the app runs against it unchanged. It doesn't evaluate FQL. The app tags every query with the name of the
+function in `ecommerce_app/queries.py` that built it, and the stand-in answers each template from an in-memory copy
+of the collections in `schema/collections.fsl`. The copy is seeded from `seed/*.fql`, optionally padded with
+generated products. Each response is delayed by the injected latency, and carries query stats in Fauna's shape.
+
+    python -m benchmarks.fauna_standin --port 8443 --latency-ms 20 --jitter-ms 5 --extra-products 1000
+
+then run the app with FAUNA_ENDPOINT=http://127.0.0.1:8443 and any FAUNA_SECRET.
+"""
+import argparse
+import ast
+import asyncio
+import base64
+import json
+import random
+import re
+import zlib
+from datetime import datetime, timezone
+from itertools import count
+from pathlib import Path
+from typing import Any, Optional
+
+from fauna.encoding import FaunaDecoder, FaunaEncoder
+
+SEED_DIR = Path(__file__).resolve().parent.parent / 'seed'
+
+# validateOrderStatusTransition in schema/functions.fsl
+NEXT_STATUS = {'cart': 'processing', 'processing': 'shipped', 'shipped': 'delivered'}
+
+
+class Abort(Exception):
+    """A query error, raised by a template handler and returned to the client in Fauna's error format."""
+
+    def __init__(self, code: str, message: str, abort: Any = None, constraint_failures: Optional[list] = None,
+                 status: int = 400):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+        self.abort = abort
+        self.constraint_failures = constraint_failures
+
+
+def abort(message: str) -> Abort:
+    return Abort('abort', 'Query aborted.', abort=message)
+
+
+def not_found(collection: str, doc_id: Any) -> Abort:
+    return Abort('document_not_found', f'Collection `{collection}` does not contain document with id {doc_id}.')
+
+
+def unique(path: str) -> Abort:
+    return Abort('constraint_failure', 'Failed unique constraint.',
+                 constraint_failures=[{'message': 'Failed unique constraint', 'paths': [[path]]}])
+
+
+def read_seed(name: str) -> Any:
+    """
+    The data literal at the start of a seed file: the array that the rest of the file maps over. Keys may be
+    quoted or bare, as in FQL.
+    """
+    text = (SEED_DIR / name).read_text()
+    start = text.index('[')
+    depth = 0
+    for end, char in enumerate(text[start:], start):
+        depth += {'[': 1, ']': -1}.get(char, 0)
+        if depth == 0:
+            break
+    literal = re.sub(r'([{,]\s*)(\w+)\s*:', r"\1'\2':", text[start:end + 1])
+    return ast.literal_eval(literal)
+
+
+def top_level_keys(projection: str) -> list[str]:
+    """The keys of an FQL object literal such as `{id: product.id, category: (if ... {id: ...} else null)}`."""
+    keys, depth, token = [], 0, ''
+    for char in projection:
+        if char in '{([':
+            depth += 1
+        elif char in '})]':
+            depth -= 1
+        elif depth == 1 and char == ':' and token.strip().isidentifier():
+            keys.append(token.strip())
+        if depth == 1 and char in '{,':
+            token = ''
+        elif depth == 1:
+            token += char
+    return keys
+
+
+class Database:
+    """The collections in schema/collections.fsl, held in memory."""
+
+    def __init__(self, extra_products: int = 0):
+        self.ids = count(1000)
+        self.categories: dict[str, dict] = {}
+        self.products: dict[str, dict] = {}
+        self.customers: dict[str, dict] = {}
+        self.orders: dict[str, dict] = {}
+        self.items: dict[str, dict] = {}
+
+        for category in read_seed('categories.fql'):
+            self.insert(self.categories, {'name': category['name'],
+                                          'description': f"Bargain {category['name']}!"})
+        for customer in read_seed('customers.fql'):
+            self.customers[customer['id']] = dict(customer)
+        for product in read_seed('products.fql'):
+            self.insert(self.products, {**product, 'category': self.category_by_name(product['category'])['id']})
+        names = [category['name'] for category in self.categories.values()]
+        for i in range(extra_products):
+            self.insert(self.products, {
+                'name': f'Product {i}', 'description': f'Generated product {i}', 'price': 100 + i % 10000,
+                'stock': 1000000, 'category': self.category_by_name(names[i % len(names)])['id']})
+        # seed/orders.fql: one order in each status, each with one Drone, for the seeded customer.
+        customer = self.customer_by_email('fake@fauna.com')
+        drone = self.product_by_name('Drone')
+        for status in read_seed('orders.fql'):
+            order = self.insert(self.orders, {'customer': customer['id'], 'status': status,
+                                              'createdAt': datetime.now(timezone.utc), 'payment': {}})
+            self.insert(self.items, {'order': order['id'], 'product': drone['id'], 'quantity': 1})
+
+    def insert(self, collection: dict, doc: dict) -> dict:
+        doc = {'id': str(next(self.ids)), **doc}
+        collection[doc['id']] = doc
+        return doc
+
+    def category_by_name(self, name: str) -> Optional[dict]:
+        return next((c for c in self.categories.values() if c['name'] == name), None)
+
+    def product_by_name(self, name: str) -> Optional[dict]:
+        return next((p for p in self.products.values() if p['name'] == name), None)
+
+    def customer_by_email(self, email: str) -> Optional[dict]:
+        return next((c for c in self.customers.values() if c['email'] == email), None)
+
+    def cart(self, customer_id: str) -> Optional[dict]:
+        return next((o for o in self.orders.values() if o['customer'] == customer_id and o['status'] == 'cart'), None)
+
+    def order_items(self, order_id: str) -> list[dict]:
+        return [item for item in self.items.values() if item['order'] == order_id]
+
+    # The projections in ecommerce_app/models.
+
+    def product_response(self, product: Optional[dict]) -> Optional[dict]:
+        if product is None:
+            return None
+        category = self.categories.get(product['category'])
+        return {'id': product['id'], 'name': product['name'], 'description': product['description'],
+                'stock': product['stock'], 'price': product['price'],
+                'category': {'id': category['id'], 'name': category['name']} if category else None}
+
+    def product_row(self, product: dict) -> dict:
+        return {**self.product_response(product), 'category': self.categories[product['category']]['name']}
+
+    def order_response(self, order: dict) -> dict:
+        customer = self.customers[order['customer']]
+        items = []
+        for item in self.order_items(order['id']):
+            product = self.products[item['product']]
+            items.append({'product': {**self.product_response(product),
+                                      'category': self.categories[product['category']]},
+                          'quantity': item['quantity']})
+        return {
+            'id': order['id'], 'payment': order['payment'], 'status': order['status'],
+            'createdAt': order['createdAt'].isoformat().replace('+00:00', 'Z'),
+            'total': sum(item['product']['price'] * item['quantity'] for item in items),
+            'itemCount': sum(item['quantity'] for item in items),
+            'items': items,
+            'customer': {key: customer[key] for key in ('id', 'name', 'email', 'address')},
+        }
+
+    def order_summary(self, order: dict) -> dict:
+        response = self.order_response(order)
+        return {'id': order['id'], 'status': order['status'], 'createdAt': order['createdAt'],
+                'total': response['total'], 'itemCount': response['itemCount']}
+
+    def customer_response(self, customer: dict) -> dict:
+        cart = self.cart(customer['id'])
+        return {**{key: customer[key] for key in ('id', 'name', 'email', 'address')},
+                'cart': {'id': cart['id']} if cart else None}
+
+
+class Query:
+    """A decoded query: its FQL text, with the values it was called with in order, and its template tag."""
+
+    def __init__(self, encoded: dict, template: str):
+        self.template = template
+        self.text = ''
+        self.values = []
+        # The innermost object literal, which is the response projection of the query.
+        self.projection = None
+        self._walk(encoded)
+
+    def _walk(self, fragment: Any):
+        if 'value' in fragment:
+            self.values.append(FaunaDecoder.decode(fragment['value']))
+            return
+        for part in fragment['fql']:
+            if isinstance(part, str):
+                self.text += part
+                if part.startswith('{') and part.endswith('}'):
+                    self.projection = part
+            else:
+                self._walk(part)
+
+    def has(self, text: str) -> bool:
+        return text in self.text
+
+
+class Page:
+    def __init__(self, data: list, after: Optional[str]):
+        self.data = data
+        self.after = after
+
+
+def encode_token(state: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+
+def decode_token(token: str) -> dict:
+    return json.loads(base64.urlsafe_b64decode(token.encode()))
+
+
+class StandIn:
+    """Answers the app's query templates from a Database."""
+
+    def __init__(self, db: Database, contention_rate: float = 0, max_concurrency: int = 0):
+        self.db = db
+        # The share of checkouts that fail as if they contended with another transaction.
+        self.contention_rate = contention_rate
+        # Queries past this many in flight are throttled with a 429, as Fauna does past a database's limits. 0 is none.
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.reads = 0
+        self.writes = 0
+
+    def run(self, query: Query) -> Any:
+        handler = getattr(self, 'q_' + query.template, None)
+        if handler is None:
+            raise Abort('invalid_query', f'The stand-in has no template named {query.template!r}.')
+        return handler(query)
+
+    def read(self, doc: Optional[dict], collection: str = '', doc_id: Any = None) -> dict:
+        if doc is None:
+            raise not_found(collection, doc_id)
+        self.reads += 1
+        return doc
+
+    def sparse(self, query: Query, rows: Any) -> Any:
+        """Narrow rows to the keys of the query's projection, as a fields= projection would."""
+        if query.projection is None:
+            return rows
+        keys = top_level_keys(query.projection)
+        if isinstance(rows, list):
+            return [{key: row.get(key) for key in keys} for row in rows]
+        return {key: rows.get(key) for key in keys} if isinstance(rows, dict) else rows
+
+    def page(self, rows: list, offset: int, size: int, state: dict) -> Page:
+        self.reads += min(size, len(rows) - offset)
+        after = encode_token({**state, 'offset': offset + size}) if offset + size < len(rows) else None
+        return Page(rows[offset:offset + size], after)
+
+    # Templates in ecommerce_app/queries.py
+
+    def q_products_page(self, query: Query) -> Any:
+        if query.has('Set.paginate'):
+            state = decode_token(query.values[0])
+            page = self.products_page(state['category'], state['size'], state['offset'], state.get('keys'))
+            return {'data': page.data, 'after': page.after}
+        category_id = None
+        if query.has('byCategory'):
+            value = query.values[0]
+            category = self.db.categories.get(value) if query.has('Category.byId') else self.db.category_by_name(value)
+            category_id = category['id'] if category else '-'
+        keys = top_level_keys(query.projection) if query.projection else None
+        return self.products_page(category_id, query.values[-1], 0, keys)
+
+    def products_page(self, category_id: Optional[str], size: int, offset: int, keys: Optional[list]) -> Page:
+        products = [p for p in self.db.products.values() if category_id is None or p['category'] == category_id]
+        products.sort(key=lambda p: (p['category'], p['id']))
+        page = self.page(products, offset, size, {'category': category_id, 'size': size, 'keys': keys})
+        rows = [self.db.product_response(p) for p in page.data]
+        page.data = [{key: row[key] for key in keys} for row in rows] if keys else rows
+        return page
+
+    def q_products_by_price(self, query: Query) -> Any:
+        if query.has('Set.paginate'):
+            state = decode_token(query.values[0])
+            page = self.products_by_price(state, state['offset'])
+            return {'data': page.data, 'after': page.after}
+        category_id = None
+        if query.has('byCategorySortedByPrice'):
+            value = query.values[0]
+            category = self.db.categories.get(value) if query.has('Category.byId') else self.db.category_by_name(value)
+            category_id = category['id'] if category else '-'
+        price_range = query.values[-2]
+        keys = top_level_keys(query.projection) if query.projection else None
+        return self.products_by_price({'category': category_id, 'from': price_range.get('from'),
+                                       'to': price_range.get('to'), 'size': query.values[-1], 'keys': keys}, 0)
+
+    def products_by_price(self, state: dict, offset: int) -> Page:
+        low, high = state['from'], state['to']
+        products = [p for p in self.db.products.values()
+                    if (state['category'] is None or p['category'] == state['category'])
+                    and (low is None or p['price'] >= low) and (high is None or p['price'] <= high)]
+        products.sort(key=lambda p: (p['price'], p['name'], p['description'], p['stock'], p['id']))
+        page = self.page(products, offset, state['size'], state)
+        rows = [{key: p[key] for key in ('id', 'name', 'description', 'stock', 'price')} for p in page.data]
+        page.data = [{key: row[key] for key in state['keys']} for row in rows] if state['keys'] else rows
+        return page
+
+    def versioned(self, query: Query, response: Any) -> dict:
+        """The {version, data} result of a full query. The version changes whenever the full response does."""
+        return {'version': self.version(response), 'data': self.sparse(query, response)}
+
+    @staticmethod
+    def version(response: Any) -> list:
+        return [zlib.crc32(json.dumps(response, sort_keys=True, default=str).encode())]
+
+    def q_product(self, query: Query) -> Any:
+        product = self.read(self.db.products.get(query.values[0]), 'Product', query.values[0])
+        return self.versioned(query, self.db.product_response(product))
+
+    def q_product_timestamps(self, query: Query) -> Any:
+        product = self.read(self.db.products.get(query.values[0]), 'Product', query.values[0])
+        return self.version(self.db.product_response(product))
+
+    def resolve_category(self, query: Query, value: str) -> dict:
+        category = self.db.categories.get(value) if query.has('Category.byId') else self.db.category_by_name(value)
+        if category is None:
+            raise abort('Category does not exist.')
+        return category
+
+    def q_create_product(self, query: Query) -> Any:
+        fields, category_value = query.values
+        category = self.resolve_category(query, category_value)
+        if self.db.product_by_name(fields['name']):
+            raise unique('name')
+        self.writes += 1
+        product = self.db.insert(self.db.products, {
+            key: fields[key] for key in ('name', 'price', 'stock', 'description')})
+        product['category'] = category['id']
+        return self.db.product_response(product)
+
+    def q_update_product(self, query: Query) -> Any:
+        product = self.read(self.db.products.get(query.values[0]), 'Product', query.values[0])
+        if query.has('Category.by'):
+            product['category'] = self.resolve_category(query, query.values[1])['id']
+        self.writes += 1
+        product.update(query.values[-1])
+        return self.db.product_response(product)
+
+    def q_upsert_products(self, query: Query) -> Any:
+        results = []
+        for fields in query.values[0]:
+            category = self.db.category_by_name(fields['category'])
+            if category is None:
+                results.append({'error': 'Category does not exist.'})
+                continue
+            data = {**fields, 'category': category['id']}
+            existing = self.db.product_by_name(fields['name'])
+            self.writes += 1
+            if existing:
+                existing.update(data)
+                results.append({'id': existing['id'], 'created': False})
+            else:
+                results.append({'id': self.db.insert(self.db.products, data)['id'], 'created': True})
+        return results
+
+    def q_ping(self, query: Query) -> Any:
+        return 0
+
+    def q_product_rows_page(self, query: Query) -> Any:
+        if query.has('Set.paginate'):
+            state = decode_token(query.values[0])
+        else:
+            state = {'size': query.values[0], 'offset': 0}
+        products = sorted(self.db.products.values(), key=lambda p: p['id'])
+        page = self.page(products, state['offset'], state['size'], {'size': state['size']})
+        page.data = [self.db.product_row(p) for p in page.data]
+        return {'data': page.data, 'after': page.after} if query.has('Set.paginate') else page
+
+    def q_order(self, query: Query) -> Any:
+        order = self.read(self.db.orders.get(query.values[0]), 'Order', query.values[0])
+        self.reads += len(self.db.order_items(order['id'])) * 3
+        return self.versioned(query, self.db.order_response(order))
+
+    def q_order_timestamps(self, query: Query) -> Any:
+        order = self.read(self.db.orders.get(query.values[0]), 'Order', query.values[0])
+        self.reads += len(self.db.order_items(order['id'])) * 3
+        return self.version(self.db.order_response(order))
+
+    def q_update_order(self, query: Query) -> Any:
+        order = self.read(self.db.orders.get(query.values[0]), 'Order', query.values[0])
+        status, payment = query.values[1], query.values[3]
+        if status is not None and order['status'] in NEXT_STATUS and NEXT_STATUS[order['status']] != status:
+            raise abort('Invalid status transition.')
+        if order['status'] != 'cart' and payment is not None:
+            raise abort('Cannot update payment information after an order has been placed.')
+        self.writes += 1
+        order.update({key: value for key, value in (('status', status), ('payment', payment)) if value is not None})
+        return self.db.order_response(order)
+
+    def q_checkout(self, query: Query) -> Any:
+        order = self.read(self.db.orders.get(query.values[0]), 'Order', query.values[0])
+        payment = query.values[1]
+        if random.random() < self.contention_rate:
+            raise Abort('conflict', 'Transaction was aborted due to detection of concurrent modification.', status=409)
+        if order['status'] != 'cart':
+            raise abort('Invalid status transition.')
+        if order['payment'] is None and payment is None:
+            raise abort('Order must have a valid payment method.')
+        items = self.db.order_items(order['id'])
+        self.reads += len(items) * 2
+        for item in items:
+            if self.db.products[item['product']]['stock'] < item['quantity']:
+                raise abort('One of the selected products does not have the requested quantity in stock.')
+        if not items:
+            raise abort('Order must have at least one item.')
+        for item in items:
+            self.db.products[item['product']]['stock'] -= item['quantity']
+        self.writes += len(items) + 1
+        order.update({'status': 'processing', **({'payment': payment} if payment is not None else {})})
+        return self.db.order_response(order)
+
+    def q_create_customer(self, query: Query) -> Any:
+        data = query.values[0]
+        if self.db.customer_by_email(data['email']):
+            raise unique('email')
+        self.writes += 1
+        return self.db.customer_response(self.db.insert(self.db.customers, dict(data)))
+
+    def cart_for(self, customer_id: str) -> dict:
+        self.read(self.db.customers.get(customer_id), 'Customer', customer_id)
+        cart = self.db.cart(customer_id)
+        if cart is None:
+            self.writes += 1
+            cart = self.db.insert(self.db.orders, {'customer': customer_id, 'status': 'cart',
+                                                   'createdAt': datetime.now(timezone.utc), 'payment': {}})
+        return cart
+
+    def set_item(self, cart: dict, product_name: str, quantity: int) -> Optional[str]:
+        """createOrUpdateCartItem in schema/functions.fsl. Returns the reason the item can't be set, if any."""
+        product = self.db.product_by_name(product_name)
+        if product is None:
+            return 'Product does not exist.'
+        if quantity < 0:
+            return 'Quantity must be a non-negative integer.'
+        if product['stock'] < quantity:
+            return 'Product does not have the requested quantity in stock.'
+        self.writes += 1
+        item = next((i for i in self.db.order_items(cart['id']) if i['product'] == product['id']), None)
+        if item is None:
+            self.db.insert(self.db.items, {'order': cart['id'], 'product': product['id'], 'quantity': quantity})
+        else:
+            item['quantity'] = quantity
+        return None
+
+    def q_add_item_to_cart(self, query: Query) -> Any:
+        customer_id, product_name, quantity = query.values[:3]
+        cart = self.cart_for(customer_id)
+        error = self.set_item(cart, product_name, quantity)
+        if error:
+            raise abort(error)
+        return self.db.order_response(cart)
+
+    def q_add_items_to_cart(self, query: Query) -> Any:
+        customer_id, items = query.values[:2]
+        cart = self.cart_for(customer_id)
+        errors = []
+        for item in items:
+            error = self.set_item(cart, item['productName'], item['quantity'])
+            if error:
+                errors.append({'productName': item['productName'], 'error': error})
+        return {'cart': self.db.order_response(cart), 'errors': errors}
+
+    def q_get_or_create_cart(self, query: Query) -> Any:
+        return self.db.order_response(self.cart_for(query.values[0]))
+
+    def find_customer(self, query: Query) -> dict:
+        key, message = query.values[:2]
+        customer = self.db.customer_by_email(key) if query.has('byEmail') else self.db.customers.get(key)
+        if customer is None:
+            raise abort(message)
+        self.reads += 1
+        return customer
+
+    def q_customer(self, query: Query) -> Any:
+        return self.versioned(query, self.db.customer_response(self.find_customer(query)))
+
+    def q_customer_with_includes(self, query: Query) -> Any:
+        customer = self.find_customer(query)
+        keys = top_level_keys(query.text[query.text.index('\n{') + 1:])
+        response = self.db.customer_response(customer)
+        if 'cart' in keys:
+            cart = self.db.cart(customer['id'])
+            response['cart'] = self.embedded_order(cart) if cart else None
+        if 'orders' in keys:
+            with_items = 'items:' in query.text.split('Order.byCustomer', 1)[1]
+            orders = [o for o in self.db.orders.values() if o['customer'] == customer['id']]
+            orders.sort(key=lambda o: o['createdAt'], reverse=True)
+            size = query.values[-1]
+            page = self.page(orders, 0, size, {'customer': customer['id'], 'size': size})
+            response['orders'] = {'data': [self.embedded_order(o) if with_items else self.db.order_summary(o)
+                                           for o in page.data], 'after': page.after}
+        return {key: response[key] for key in keys}
+
+    def embedded_order(self, order: dict) -> dict:
+        self.reads += 1 + len(self.db.order_items(order['id'])) * 3
+        response = self.db.order_response(order)
+        del response['customer']
+        return response
+
+    def q_order_with_includes(self, query: Query) -> Any:
+        order = self.read(self.db.orders.get(query.values[0]), 'Order', query.values[0])
+        self.reads += len(self.db.order_items(order['id'])) * 3
+        keys = top_level_keys(query.text[query.text.index('\n{') + 1:])
+        response = self.db.order_response(order)
+        if 'customer' in keys and query.has('let customer = order.customer'):
+            self.reads += 2
+            response['customer'] = self.db.customer_response(self.db.customers[order['customer']])
+        return {key: response[key] for key in keys}
+
+    def q_customer_timestamps(self, query: Query) -> Any:
+        return self.version(self.db.customer_response(self.find_customer(query)))
+
+    def q_customer_order_summary(self, query: Query) -> Any:
+        customer = self.find_customer(query)
+        orders = [o for o in self.db.orders.values() if o['customer'] == customer['id']]
+        orders.sort(key=lambda o: o['createdAt'], reverse=True)
+        placed = [o for o in orders if o['status'] != 'cart']
+        # The OrderStats document, kept by updateOrderStats, is one read.
+        self.reads += 1
+        size = query.values[-1]
+        page = self.page(orders, 0, size, {'customer': customer['id'], 'size': size})
+        by_status = {status: sum(o['status'] == status for o in placed) for status in NEXT_STATUS.values()}
+        return {'orderCount': len(placed), 'ordersByStatus': by_status,
+                'lifetimeSpend': sum(self.db.order_summary(o)['total'] for o in placed),
+                'lastOrderAt': placed[0]['createdAt'] if placed else None,
+                'orders': {'data': [self.db.order_summary(o) for o in page.data], 'after': page.after}}
+
+    def q_customer_orders_page(self, query: Query) -> Any:
+        if query.has('Set.paginate'):
+            state = decode_token(query.values[0])
+        else:
+            state = {'customer': query.values[0], 'size': query.values[1], 'offset': 0}
+        orders = [o for o in self.db.orders.values() if o['customer'] == state['customer']]
+        page = self.page(orders, state['offset'], state['size'], {'customer': state['customer'],
+                                                                   'size': state['size']})
+        page.data = [self.db.order_summary(o) for o in page.data]
+        return {'data': page.data, 'after': page.after} if query.has('Set.paginate') else page
+
+
+def encode_result(data: Any) -> Any:
+    if isinstance(data, Page):
+        return {'@set': {'data': FaunaEncoder.encode(data.data), 'after': data.after}}
+    return FaunaEncoder.encode(data)
+
+
+def respond(standin: StandIn, body: bytes, template: str, query_time_ms: int) -> tuple[int, dict]:
+    standin.reads = standin.writes = 0
+    stats = {'compute_ops': 1, 'read_ops': 0, 'write_ops': 0, 'query_time_ms': query_time_ms,
+             'contention_retries': 0, 'storage_bytes_read': 0, 'storage_bytes_write': 0}
+    try:
+        if standin.max_concurrency and standin.in_flight > standin.max_concurrency:
+            raise Abort('limit_exceeded', 'Rate limit exceeded.', status=429)
+        query = Query(json.loads(body)['query'], template)
+        result = {'data': encode_result(standin.run(query)), 'static_type': 'Any'}
+        status = 200
+    except Abort as e:
+        error = {'code': e.code, 'message': e.message}
+        if e.abort is not None:
+            error['abort'] = FaunaEncoder.encode(e.abort)
+        if e.constraint_failures:
+            error['constraint_failures'] = e.constraint_failures
+        result, status = {'error': error}, e.status
+    stats.update(read_ops=standin.reads, write_ops=standin.writes, storage_bytes_read=standin.reads * 256,
+                 storage_bytes_write=standin.writes * 256)
+    result.update(summary='', txn_ts=int(datetime.now(timezone.utc).timestamp() * 1e6), schema_version=0,
+                  stats=stats)
+    if template:
+        result['query_tags'] = f'template={template}'
+    return status, result
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, standin: StandIn, latency: float,
+                 jitter: float):
+    try:
+        while True:
+            head = await reader.readuntil(b'\r\n\r\n')
+            headers = {}
+            for line in head.decode('latin-1').split('\r\n')[1:]:
+                if ': ' in line:
+                    name, value = line.split(': ', 1)
+                    headers[name.lower()] = value
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            tags = dict(tag.split('=', 1) for tag in headers.get('x-query-tags', '').split(',') if '=' in tag)
+            delay = max(0.0, latency + random.uniform(-jitter, jitter))
+            standin.in_flight += 1
+            try:
+                status, result = respond(standin, body, tags.get('template', ''), int(delay * 1000))
+                await asyncio.sleep(delay)
+            finally:
+                standin.in_flight -= 1
+            payload = json.dumps(result).encode()
+            reason = b'OK' if status == 200 else b'Bad Request'
+            writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                         % (status, reason, len(payload)) + payload)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int, standin: StandIn, latency: float, jitter: float):
+    server = await asyncio.start_server(lambda r, w: handle(r, w, standin, latency, jitter), '127.0.0.1', port,
+                                        backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency-ms', type=float, default=20, help='Injected latency of every query.')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Random +/- variation of the latency.')
+    parser.add_argument('--extra-products', type=int, default=0, help='Generated products added to the seed data.')
+    parser.add_argument('--contention-rate', type=float, default=0,
+                        help='Share of checkouts that fail with a contention error (409), to exercise retries.')
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help='Queries in flight past which the stand-in throttles (429), to exercise load shedding.')
+    args = parser.parse_args()
+    standin = StandIn(Database(args.extra_products), args.contention_rate, args.max_concurrency)
+    asyncio.run(serve(args.port, standin, args.latency_ms / 1000, args.jitter_ms / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""
+Load test of every route, against the local Fauna stand-in in `benchmarks.fauna_standin`.
+
+Starts the stand-in and the app (the Flask app on a pool of threads, or the ASGI app under uvicorn), then runs
+`--users` virtual users for `--duration` seconds. Each user repeatedly picks a scenario by weight:
+
+    browse    list products, follow the next page, filter by category and by price, view products
+    cart      get the cart, add one item, add several items at once
+    checkout  add an item and check out the cart
+    lookup    view the customer, their orders and one order
+    admin     create and update a product, import a few products and export the catalog (sync app only)
+
+Latency percentiles and throughput are reported per route, and written to benchmarks/results/<commit>.json. Pass
+`--compare` with an earlier results file to print the change per route. The run exits with status 1 if any route's
+p95 latency or throughput regressed by more than `--threshold` percent. Pass `--max-concurrency` to have the stand-in
+throttle like an overloaded database, and see which routes the app sheds (the 503s counted as errors).
+
+Requires the optional dependencies in requirements-async.txt. Run from the repository root:
+
+    python -m benchmarks.load --duration 20 --users 32 --latency-ms 20
+    python -m benchmarks.load --compare benchmarks/results/<earlier commit>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import quantiles
+from typing import Optional
+
+import aiohttp
+
+from benchmarks.async_load import free_port, wait_for
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+SCENARIOS = {'browse': 50, 'cart': 20, 'checkout': 8, 'lookup': 20, 'admin': 2}
+
+ADDRESS = {'street': '87856 Mendota Court', 'city': 'Washington', 'state': 'DC', 'postalCode': '20220',
+           'country': 'USA'}
+
+
+class Recorder:
+    """Latency samples per route, kept only once the warm-up is over."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def record(self, route: str, seconds: float, ok: bool):
+        if not self.recording:
+            return
+        self.latencies[route].append(seconds)
+        if not ok:
+            self.errors[route] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            cuts = quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+            routes[route] = {'count': len(samples), 'errors': self.errors[route], 'rps': len(samples) / elapsed,
+                             'p50': cuts[49] * 1000, 'p95': cuts[94] * 1000, 'p99': cuts[98] * 1000}
+        return routes
+
+
+class User:
+    """One virtual user, with its own customer."""
+
+    def __init__(self, http: aiohttp.ClientSession, base: str, recorder: Recorder, catalog: list[dict],
+                 number: int, catalog_routes: bool):
+        self.http = http
+        self.base = base
+        self.recorder = recorder
+        self.catalog = catalog
+        self.number = number
+        self.catalog_routes = catalog_routes
+        self.customer_id = None
+        self.orders = []
+
+    async def call(self, method: str, route: str, path: str, **kwargs) -> Optional[object]:
+        start = time.perf_counter()
+        async with self.http.request(method, self.base + path, **kwargs) as response:
+            body = await response.read()
+            # 4xx answers from the app (e.g. an item out of stock) are part of the workload, not failures.
+            self.recorder.record(f'{method} {route}', time.perf_counter() - start, response.status < 500)
+            is_json = response.content_type == 'application/json'
+            return json.loads(body) if is_json and response.status < 400 else None
+
+    def in_stock(self, count: int) -> list[dict]:
+        return random.sample([p for p in self.catalog if p['stock'] > 10], count)
+
+    async def setup(self):
+        customer = await self.call('POST', '/customers', '/customers', json={
+            'name': f'Load User {self.number}', 'email': f'load-{self.number}-{time.time_ns()}@example.com',
+            'address': ADDRESS})
+        self.customer_id = customer['id']
+
+    async def browse(self):
+        page = await self.call('GET', '/products', '/products', params={'pageSize': 20})
+        if page and page['next']:
+            await self.call('GET', '/products', '/products', params={'nextToken': page['next']})
+        await self.call('GET', '/products', '/products', params={'category': random.choice(['books', 'movies'])})
+        await self.call('GET', '/products?sort=price', '/products', params={
+            'sort': 'price', 'minPrice': random.randrange(0, 5000), 'maxPrice': 10000, 'pageSize': 20})
+        for product in random.sample(self.catalog, 2):
+            await self.call('GET', '/products/<product_id>', f"/products/{product['id']}")
+
+    async def cart(self):
+        await self.call('POST', '/customers/<customer_id>/cart', f'/customers/{self.customer_id}/cart')
+        product = self.in_stock(1)[0]
+        await self.call('POST', '/customers/<customer_id>/cart/item', f'/customers/{self.customer_id}/cart/item',
+                        json={'productName': product['name'], 'quantity': 1})
+        items = [{'productName': p['name'], 'quantity': random.randint(1, 3)} for p in self.in_stock(3)]
+        await self.call('POST', '/customers/<customer_id>/cart/items', f'/customers/{self.customer_id}/cart/items',
+                        json={'items': items})
+
+    async def checkout(self):
+        product = self.in_stock(1)[0]
+        cart = await self.call('POST', '/customers/<customer_id>/cart/item',
+                               f'/customers/{self.customer_id}/cart/item',
+                               json={'productName': product['name'], 'quantity': 1})
+        if cart:
+            await self.call('POST', '/orders/<order_id>/checkout', f"/orders/{cart['id']}/checkout",
+                            json={'payment': {'type': 'card'}})
+            self.orders.append(cart['id'])
+
+    async def lookup(self):
+        await self.call('GET', '/customers/<customer_id>', f'/customers/{self.customer_id}')
+        orders = await self.call('GET', '/customers/<customer_id>/orders', f'/customers/{self.customer_id}/orders')
+        order_ids = self.orders or [order['id'] for order in (orders or {}).get('data', [])]
+        if order_ids:
+            await self.call('GET', '/orders/<order_id>', f'/orders/{random.choice(order_ids)}')
+
+    async def admin(self):
+        name = f'Load Product {self.number}-{time.time_ns()}'
+        product = await self.call('POST', '/products', '/products', json={
+            'name': name, 'price': 1000, 'description': 'Created by the load test', 'stock': 100,
+            'category': 'books'})
+        if product:
+            await self.call('PATCH', '/products/<product_id>', f"/products/{product['id']}", json={'stock': 50})
+        if not self.catalog_routes:
+            return
+        rows = '\n'.join(json.dumps({'name': f'{name} {i}', 'price': 500, 'description': 'Imported by the load test',
+                                     'stock': 10, 'category': 'movies'}) for i in range(5))
+        await self.call('POST', '/products/import', '/products/import', data=rows,
+                        headers={'Content-Type': 'application/x-ndjson'})
+        await self.call('GET', '/products/export', '/products/export', params={'format': 'csv'})
+
+    async def run(self, until: float):
+        names, weights = list(SCENARIOS), list(SCENARIOS.values())
+        while time.monotonic() < until:
+            await getattr(self, random.choices(names, weights)[0])()
+
+
+async def load_catalog(http: aiohttp.ClientSession, base: str) -> list[dict]:
+    catalog, token = [], None
+    while True:
+        params = {'pageSize': 500, **({'nextToken': token} if token else {})}
+        async with http.get(base + '/products', params=params) as response:
+            page = await response.json()
+        catalog.extend(page['data'])
+        token = page['next']
+        if not token:
+            return catalog
+
+
+async def generate_load(base: str, users: int, duration: float, warmup: float, catalog_routes: bool) -> dict:
+    recorder = Recorder()
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=users)) as http:
+        catalog = await load_catalog(http, base)
+        clients = [User(http, base, recorder, catalog, number, catalog_routes) for number in range(users)]
+        await asyncio.gather(*(user.setup() for user in clients))
+        start = time.monotonic()
+        runs = asyncio.gather(*(user.run(start + warmup + duration) for user in clients))
+        await asyncio.sleep(warmup)
+        recorder.recording = True
+        recorded_from = time.perf_counter()
+        await runs
+        elapsed = time.perf_counter() - recorded_from
+    routes = recorder.summary(elapsed)
+    total = sum(route['count'] for route in routes.values())
+    return {'routes': routes, 'total': {'count': total, 'rps': total / elapsed}}
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results: dict, baseline: Optional[dict], threshold: float) -> bool:
+    """Print the results per route, and the change from the baseline if there is one. Returns True on a regression."""
+    regressed = False
+    print(f"{'route':<44} {'count':>6} {'err':>4} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          + (f" {'p95 change':>11} {'rps change':>11}" if baseline else ''))
+    for route, stats in results['routes'].items():
+        line = (f"{route:<44} {stats['count']:>6} {stats['errors']:>4} {stats['rps']:>7.1f} {stats['p50']:>8.1f} "
+                f"{stats['p95']:>8.1f} {stats['p99']:>8.1f}")
+        before = baseline['routes'].get(route) if baseline else None
+        if before:
+            p95_change = (stats['p95'] - before['p95']) / before['p95'] * 100
+            rps_change = (stats['rps'] - before['rps']) / before['rps'] * 100
+            flag = p95_change > threshold or rps_change < -threshold
+            regressed = regressed or flag
+            line += f" {p95_change:>+10.1f}% {rps_change:>+10.1f}%" + ('  REGRESSED' if flag else '')
+        print(line)
+    print(f"total requests {results['total']['count']}, {results['total']['rps']:.1f} rps")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', choices=('sync', 'asgi'), default='sync')
+    parser.add_argument('--threads', type=int, default=16, help='Worker threads for the sync app.')
+    parser.add_argument('--users', type=int, default=32, help='Concurrent virtual users.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of recorded load.')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before recording starts.')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of the Fauna stand-in.')
+    parser.add_argument('--jitter-ms', type=float, default=5)
+    parser.add_argument('--extra-products', type=int, default=1000, help='Generated products in the stand-in.')
+    parser.add_argument('--contention-rate', type=float, default=0,
+                        help='Share of checkouts the stand-in fails with a contention error, which the app retries.')
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help='Queries in flight past which the stand-in throttles with a 429. 0 never throttles.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the scenario mix.')
+    parser.add_argument('--output', type=Path, help='Results file. Defaults to benchmarks/results/<commit>.json.')
+    parser.add_argument('--compare', type=Path, help='An earlier results file to compare against.')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent change that counts as a regression.')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    fauna_port, app_port = free_port(), free_port()
+    env = {**os.environ, 'FAUNA_ENDPOINT': f'http://127.0.0.1:{fauna_port}', 'FAUNA_SECRET': 'secret',
+           'FAUNA_POOL_MAX_CONNECTIONS': str(args.users), 'FAUNA_POOL_MAX_KEEPALIVE': str(args.users)}
+    if args.app == 'sync':
+        app = [sys.executable, '-m', 'benchmarks.async_load', '--serve-sync', str(app_port),
+               '--threads', str(args.threads)]
+    else:
+        app = [sys.executable, '-m', 'uvicorn', 'ecommerce_app.asgi:app', '--port', str(app_port),
+               '--log-level', 'warning']
+    processes = [
+        subprocess.Popen([sys.executable, '-m', 'benchmarks.fauna_standin', '--port', str(fauna_port),
+                          '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+                          '--extra-products', str(args.extra_products),
+                          '--contention-rate', str(args.contention_rate),
+                          '--max-concurrency', str(args.max_concurrency)], env=env),
+        subprocess.Popen(app, env=env, stderr=subprocess.DEVNULL),
+    ]
+    try:
+        wait_for(fauna_port)
+        wait_for(app_port)
+        # The ASGI app doesn't serve the catalog import and export.
+        results = asyncio.run(generate_load(f'http://127.0.0.1:{app_port}', args.users, args.duration, args.warmup,
+                                            catalog_routes=args.app == 'sync'))
+    finally:
+        for process in processes:
+            process.terminate()
+
+    results.update(commit=git_commit(), date=datetime.now(timezone.utc).isoformat(), config={
+        key: getattr(args, key) for key in ('app', 'threads', 'users', 'duration', 'latency_ms', 'jitter_ms',
+                                            'extra_products', 'contention_rate', 'max_concurrency', 'seed')})
+    output = args.output or RESULTS_DIR / f"{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print(f"{args.app} app, {args.users} users, {args.duration:.0f}s, stand-in latency {args.latency_ms}ms "
+          f"+/- {args.jitter_ms}ms, commit {results['commit']}")
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    regressed = print_results(results, baseline, args.threshold)
+    print(f'results written to {output}')
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
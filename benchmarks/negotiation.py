@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the negotiated response formats and compressions in `ecommerce_app/negotiation.py`: the CPU time
+to encode and compress a body, against the bytes it saves over plain JSON.
+
+The payloads are a full order (GET /orders/<id>, every item embedding its product and category, and the customer)
+and a page of GET /products. Formats whose library isn't installed are skipped.
+
+Run from the repository root:
+
+    python -m benchmarks.negotiation
+"""
+import timeit
+from datetime import datetime, timezone
+
+from ecommerce_app import negotiation
+from ecommerce_app.negotiation import ENCODERS, compress
+from ecommerce_app.serialization import orjson
+
+CUSTOMER = {'id': '101', 'name': 'Alice Appleseed', 'email': 'alice.appleseed@example.com',
+            'address': {'street': '87856 Mendota Court', 'city': 'Washington', 'state': 'DC', 'postalCode': '20220',
+                        'country': 'USA'}}
+CATEGORY = {'id': '789', 'name': 'electronics', 'description': 'Bargain electronics!'}
+
+
+def product(number: int) -> dict:
+    return {'id': str(1000 + number), 'name': f'Product {number}', 'price': 100 + number, 'stock': 50,
+            'description': 'Fly and let people wonder if you are filming them!', 'category': CATEGORY}
+
+
+def order(items: int) -> dict:
+    return {'id': '123', 'payment': {'type': 'card'}, 'createdAt': datetime(2024, 1, 1, tzinfo=timezone.utc),
+            'status': 'processing', 'total': 12345, 'itemCount': items, 'customer': CUSTOMER,
+            'items': [{'product': product(i), 'quantity': 2} for i in range(items)]}
+
+
+PAYLOADS = {
+    'order, 5 items': order(5),
+    'order, 50 items': order(50),
+    'products, 20': {'data': [product(i) for i in range(20)], 'next': 'token'},
+    'products, 100': {'data': [product(i) for i in range(100)], 'next': 'token'},
+}
+FORMATS = [media for media in ENCODERS if media != 'application/x-msgpack']
+
+
+def microseconds(function, number: int) -> float:
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"json encoder: {'orjson' if orjson else 'json'}, codings: {', '.join(negotiation.CODINGS)}, "
+          f"gzip level {negotiation.GZIP_LEVEL}, zstd level {negotiation.ZSTD_LEVEL}")
+    print(f"{'payload':<17} {'format':<20} {'coding':<8} {'bytes':>8} {'saved':>7} {'encode us':>10} "
+          f"{'compress us':>12} {'total us':>9}")
+    for name, payload in PAYLOADS.items():
+        json_size = len(ENCODERS['application/json'](payload))
+        for media in FORMATS:
+            encoder = ENCODERS[media]
+            body = encoder(payload)
+            number = max(20, 200000 // len(body))
+            encode_us = microseconds(lambda: encoder(payload), number)
+            for coding in (None,) + negotiation.CODINGS:
+                compressed = compress(body, coding) if coding else body
+                compress_us = microseconds(lambda: compress(body, coding), number) if coding else 0.0
+                saved = 100 * (1 - len(compressed) / json_size)
+                print(f'{name:<17} {media:<20} {coding or "-":<8} {len(compressed):>8} {saved:>6.1f}% '
+                      f'{encode_us:>10.1f} {compress_us:>12.1f} {encode_us + compress_us:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Micro-benchmark of building and encoding the response projections, before and after they were precompiled.
+
+"Before" rebuilds the projections with nested fql() templates on every call, as the models used to. "After" pulls the
+compiled Query from the projection registry. Both wrap it in a request-shaped query and run the driver's encoder,
+which is the per-request work done before anything goes over the wire.
+
+Run from the repository root:
+
+    python -m benchmarks.projections
+"""
+import timeit
+import tracemalloc
+
+from fauna import fql
+from fauna.encoding import FaunaEncoder
+
+from ecommerce_app.models.customer import customer_response
+from ecommerce_app.models.order import order_response
+from ecommerce_app.models.product import product_response
+
+
+def legacy_product_response():
+    return fql("{id: product.id, name: product.name, description: product.description, stock: product.stock, price: product.price, category: ${category}}",
+               category=fql("if (product.category != null) {id: product.category?.id, name: product.category?.name} else null"))
+
+
+def legacy_customer_response():
+    return fql("{id: customer.id, name: customer?.name, email: customer?.email, address: customer?.address, cart: ${getCart}}",
+               getCart=fql('if (customer?.cart != null) {id: customer?.cart?.id} else null'))
+
+
+def legacy_order_response():
+    return fql("""
+        {
+            id: order?.id,
+            payment: order?.payment,
+            createdAt: order?.createdAt.toString(),
+            status: order?.status,
+            total: order?.total,
+            items: order?.items.toArray().map(item => {
+                product: {
+                    id: item.product?.id,
+                    name: item.product?.name,
+                    price: item.product?.price,
+                    description: item.product?.description,
+                    stock: item.product?.stock,
+                    category: {
+                        id: item.product?.category?.id,
+                        name: item.product?.category?.name,
+                        description: item.product?.category?.description
+                    }
+                },
+                quantity: item.quantity
+            }),
+            customer: {
+                id: order?.customer?.id,
+                name: order?.customer?.name,
+                email: order?.customer?.email,
+                address: order?.customer?.address
+            }
+        }
+    """)
+
+
+CASES = {
+    'product list page': (
+        lambda response: fql("Product.sortedByCategory().pageSize(${pageSize}).map(product => ${toProduct})",
+                             pageSize=10, toProduct=response()),
+        legacy_product_response, product_response),
+    'order by id': (
+        lambda response: fql("let order = Order.byId(${id})!\n${orderResponse}", id='123', orderResponse=response()),
+        legacy_order_response, order_response),
+    'customer by id': (
+        lambda response: fql('let customer = Customer.byId(${customerId})\n${customerResponse}',
+                             customerId='999', customerResponse=response()),
+        legacy_customer_response, customer_response),
+}
+
+
+def per_request(build, response):
+    return FaunaEncoder.encode(build(response))
+
+
+def microseconds(build, response, number: int) -> float:
+    return min(timeit.repeat(lambda: per_request(build, response), number=number, repeat=5)) / number * 1e6
+
+
+def allocated_bytes(build, response) -> int:
+    """Peak memory allocated while building and encoding one request."""
+    tracemalloc.start()
+    per_request(build, response)
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    per_request(build, response)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def main(number: int = 20000):
+    print(f"{'case':<20} {'before us':>10} {'after us':>10} {'before bytes':>13} {'after bytes':>12}")
+    for name, (build, legacy, compiled) in CASES.items():
+        print(f'{name:<20} {microseconds(build, legacy, number):>10.2f} {microseconds(build, compiled, number):>10.2f} '
+              f'{allocated_bytes(build, legacy):>13} {allocated_bytes(build, compiled):>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of serializing a page of list results, before and after rows were streamed straight to the response.
+
+"Before" builds a dataclass per row and serializes the whole page with `jsonify`, as `jsonify_page` used to. "After"
+writes the decoded rows with `page_chunks`. Both walk the response body chunk by chunk, as a WSGI server would, and
+the peak memory is what serializing one page allocates on top of the decoded page itself.
+
+Run from the repository root:
+
+    python -m benchmarks.serialization
+"""
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+
+from flask import Flask, jsonify
+
+from ecommerce_app.models.order import Order
+from ecommerce_app.models.product import Product
+from ecommerce_app.serialization import page_chunks, orjson
+
+PAGE_SIZES = (10, 100, 1000)
+
+PRODUCT = {'id': '456', 'name': 'Drone', 'description': 'Fly and let people wonder if you are filming them!',
+           'stock': 10, 'price': 9000, 'category': {'id': '789', 'name': 'electronics'}}
+ORDER = {'id': '123', 'status': 'processing', 'createdAt': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+
+CASES = {
+    'GET /products': (Product, PRODUCT),
+    'GET /customers/<id>/orders': (Order, ORDER),
+}
+
+app = Flask(__name__)
+
+
+def legacy_body(item_func, data: list) -> int:
+    response = jsonify({'data': [item_func(**doc) for doc in data], 'next': 'token'})
+    return sum(len(chunk) for chunk in response.response)
+
+
+def streamed_body(item_func, data: list) -> int:
+    return sum(len(chunk) for chunk in page_chunks(data, 'token'))
+
+
+def microseconds(body, item_func, data: list, number: int) -> float:
+    return min(timeit.repeat(lambda: body(item_func, data), number=number, repeat=5)) / number * 1e6
+
+
+def peak_bytes(body, item_func, data: list) -> int:
+    tracemalloc.start()
+    body(item_func, data)
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    body(item_func, data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+def main():
+    print(f"encoder: {'orjson' if orjson else 'json'}")
+    print(f"{'route':<28} {'rows':>5} {'before us':>10} {'after us':>10} {'before bytes':>13} {'after bytes':>12}")
+    with app.app_context():
+        for name, (item_func, row) in CASES.items():
+            for page_size in PAGE_SIZES:
+                data = [dict(row, id=str(i)) for i in range(page_size)]
+                number = max(10, 20000 // page_size)
+                print(f'{name:<28} {page_size:>5} '
+                      f'{microseconds(legacy_body, item_func, data, number):>10.1f} '
+                      f'{microseconds(streamed_body, item_func, data, number):>10.1f} '
+                      f'{peak_bytes(legacy_body, item_func, data):>13} {peak_bytes(streamed_body, item_func, data):>12}')
+
+
+if __name__ == '__main__':
+    main()
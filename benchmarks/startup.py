@@ -0,0 +1,110 @@
+"""
+Cold start benchmark: how long a new process takes to import the app and answer its first request, as a scale-to-zero
+container does when a request wakes it.
+
+Each run starts a fresh interpreter pointed at the local Fauna stand-in (`benchmarks.fauna_standin`). The interpreter
+imports `ecommerce_app.app`, idles for `--gap-ms` (the time a server takes to start listening and the first request to
+arrive), then sends GET /products through the test client. Runs alternate between the default settings and
+WARM_UP=true. The report gives the median and worst of `--runs` runs for each:
+
+    start      interpreter start to the app imported
+    import     the app's import alone, measured in the process
+    first      the first response, after the gap
+    second     a second response, for comparison with a warm process
+    total      interpreter start to the first response
+
+Run from the repository root:
+
+    python -m benchmarks.startup --runs 10
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from statistics import median
+
+# Run in each new process. Prints its timings as JSON.
+CHILD = '''
+import json, sys, time
+imported_at = time.perf_counter()
+from ecommerce_app.app import app
+imported = time.perf_counter()
+imported_wall = time.time()
+time.sleep(float(sys.argv[1]))
+client = app.test_client()
+sent = time.perf_counter()
+status = client.get('/products?pageSize=10').status_code
+first = time.perf_counter()
+answered_wall = time.time()
+client.get('/products?pageSize=10')
+second = time.perf_counter()
+print(json.dumps({'import': imported - imported_at, 'first': first - sent, 'second': second - first,
+                  'imported_wall': imported_wall, 'answered_wall': answered_wall, 'status': status}))
+'''
+
+MEASURES = ('start', 'import', 'first', 'second', 'total')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'Nothing is listening on port {port}.')
+
+
+def cold_start(env: dict, gap: float) -> dict:
+    spawned = time.time()
+    output = subprocess.run([sys.executable, '-c', CHILD, str(gap)], env=env, capture_output=True, text=True,
+                            check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    if result['status'] != 200:
+        raise RuntimeError(f"The first request failed with status {result['status']}.")
+    return {'start': result['imported_wall'] - spawned, 'import': result['import'], 'first': result['first'],
+            'second': result['second'], 'total': result['answered_wall'] - spawned - gap}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='Cold starts of each configuration.')
+    parser.add_argument('--gap-ms', type=float, default=50, help='Idle time between the import and the first request.')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Latency of the Fauna stand-in.')
+    args = parser.parse_args()
+
+    port = free_port()
+    standin = subprocess.Popen([sys.executable, '-m', 'benchmarks.fauna_standin', '--port', str(port),
+                                '--latency-ms', str(args.latency_ms)])
+    env = {**os.environ, 'FAUNA_ENDPOINT': f'http://127.0.0.1:{port}', 'FAUNA_SECRET': 'secret'}
+    configurations = {'default': {**env, 'WARM_UP': 'false'}, 'WARM_UP=true': {**env, 'WARM_UP': 'true'}}
+    results = {name: [] for name in configurations}
+    try:
+        wait_for(port)
+        for _ in range(args.runs):
+            for name, configuration in configurations.items():
+                results[name].append(cold_start(configuration, args.gap_ms / 1000))
+    finally:
+        standin.terminate()
+
+    print(f'{args.runs} cold starts each, stand-in latency {args.latency_ms}ms, {args.gap_ms}ms before the first '
+          f'request. Median / worst, in ms:')
+    print(f"{'':<14}" + ''.join(f'{measure:>16}' for measure in MEASURES))
+    for name, runs in results.items():
+        cells = [f'{median(run[m] for run in runs) * 1000:.1f} / {max(run[m] for run in runs) * 1000:.1f}'
+                 for m in MEASURES]
+        print(f'{name:<14}' + ''.join(f'{cell:>16}' for cell in cells))
+
+
+if __name__ == '__main__':
+    main()
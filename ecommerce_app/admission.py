@@ -0,0 +1,234 @@
+"""
+Admission control for the sync app: limits how many requests run at once, so that when Fauna slows down or throttles,
+requests are turned away quickly instead of piling up blocked on `client.query` until every route is slow.
+
+Every route has a priority class. Checkout, cart and order writes are `critical`, other customer and order routes
+and product writes are `standard`, and catalog browsing is `browse`. A class may only use its SHARE of the concurrency
+limit, so as the limit shrinks, browsing is turned away first and checkout last. Some routes also have their own cap,
+see ROUTE_LIMITS, and a request over it is rejected without waiting.
+
+A request that can't start right away waits in its class's queue, for at most its class's MAX_WAIT. Waiting requests
+start in priority order. A request is rejected straight away if its queue is full, or if the wait it can expect (its
+place in line, at the current rate requests finish) is longer than MAX_WAIT. A rejected request gets a 503 with a
+Retry-After header.
+
+The limit adapts to Fauna. It grows by one for each limit's worth of requests that finish with normal query latency.
+It shrinks by DECREASE when Fauna throttles a query past its retries (reported by the FaunaError handler), or when
+the recent query latency rises past LATENCY_TOLERANCE times its long-run average. It shrinks at most once per
+COOLDOWN seconds, so one burst of errors counts once.
+"""
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fauna.errors import FaunaError, ThrottlingError
+
+from ecommerce_app.config import env_bool, env_float, env_int
+from ecommerce_app.metrics import RequestMetrics
+
+ENABLED = env_bool('ADMISSION_CONTROL', True)
+INITIAL_LIMIT = env_int('ADMISSION_LIMIT', 32)
+MIN_LIMIT = env_int('ADMISSION_MIN_LIMIT', 4)
+MAX_LIMIT = env_int('ADMISSION_MAX_LIMIT', 256)
+# The most requests waiting to start. Each class may queue its SHARE of them.
+QUEUE_SIZE = env_int('ADMISSION_QUEUE', 64)
+DECREASE = env_float('ADMISSION_DECREASE', 0.7)
+COOLDOWN = env_float('ADMISSION_COOLDOWN', 1.0)
+LATENCY_TOLERANCE = env_float('ADMISSION_LATENCY_TOLERANCE', 2.0)
+
+# From highest priority to lowest.
+PRIORITIES = ('critical', 'standard', 'browse')
+SHARE = {'critical': 1.0, 'standard': 0.8, 'browse': 0.5}
+# Seconds a request may wait to start.
+MAX_WAIT = {
+    'critical': env_float('ADMISSION_MAX_WAIT_CRITICAL', 2.0),
+    'standard': env_float('ADMISSION_MAX_WAIT_STANDARD', 1.0),
+    'browse': env_float('ADMISSION_MAX_WAIT_BROWSE', 0.25),
+}
+
+# The class of each route, by endpoint. Other routes get the class of their blueprint.
+BLUEPRINT_PRIORITIES = {'products': 'browse', 'orders': 'standard', 'customers': 'standard'}
+ROUTE_PRIORITIES = {
+    'orders.post_order_checkout': 'critical',
+    'orders.patch_order': 'critical',
+    'customers.get_customer_cart': 'critical',
+    'customers.post_customer_cart_item': 'critical',
+    'customers.post_customer_cart_items': 'critical',
+    'products.post_products': 'standard',
+    'products.patch_product': 'standard',
+    'products.post_products_import': 'standard',
+}
+# Routes with their own cap on requests running at once. A catalog import or export runs many queries.
+ROUTE_LIMITS = {
+    'products.post_products_import': env_int('ADMISSION_IMPORT_LIMIT', 2),
+    'products.get_products_export': env_int('ADMISSION_EXPORT_LIMIT', 2),
+}
+# Routes that aren't limited: the event stream stays open for as long as the client listens.
+EXEMPT = frozenset(('products.get_product_events',))
+
+
+class Rejected(Exception):
+    """Raised when a request can't start in time. retry_after is the seconds to tell the client to wait."""
+
+    def __init__(self, priority: str, reason: str, retry_after: int):
+        super().__init__(f'Too busy to serve {priority} requests ({reason}), retry in {retry_after}s.')
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    """A request that was let in, to release when it finishes."""
+    route: str
+    priority: str
+    started: float
+
+
+def priority_of(endpoint: Optional[str], blueprint: Optional[str]) -> Optional[str]:
+    """The class of a route, or None if it isn't limited, like /metrics and the event stream."""
+    if endpoint is None or blueprint is None or endpoint in EXEMPT:
+        return None
+    return ROUTE_PRIORITIES.get(endpoint, BLUEPRINT_PRIORITIES.get(blueprint, 'standard'))
+
+
+def is_throttling(exc: FaunaError) -> bool:
+    return isinstance(exc, ThrottlingError) or exc.status_code in (429, 503)
+
+
+class AdmissionController:
+
+    def __init__(self, limit: int = INITIAL_LIMIT, min_limit: int = MIN_LIMIT, max_limit: int = MAX_LIMIT,
+                 queue_size: int = QUEUE_SIZE):
+        self._condition = threading.Condition()
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.running = 0
+        self.route_running: dict[str, int] = {}
+        self.waiting = {priority: 0 for priority in PRIORITIES}
+        # Averages of the seconds requests run, and of their Fauna query latency, recent and long-run.
+        self.service_time = 0.05
+        self.recent_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = float('-inf')
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.rejected: dict[tuple[str, str], int] = {}
+        self.decreases = 0
+
+    def _can_start(self, priority: str) -> bool:
+        if self.running >= max(1, int(self.limit * SHARE[priority])):
+            return False
+        # Leave a free slot to whoever of a higher class is waiting.
+        return not any(self.waiting[higher] for higher in PRIORITIES[:PRIORITIES.index(priority)])
+
+    def _route_full(self, route: str) -> bool:
+        return self.route_running.get(route, 0) >= ROUTE_LIMITS.get(route, math.inf)
+
+    def _expected_wait(self, priority: str) -> float:
+        """Roughly how long a request joining the back of the class's queue waits, at the rate requests finish."""
+        ahead = sum(self.waiting[higher] for higher in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        return (ahead + 1) * self.service_time / max(1.0, self.limit * SHARE[priority])
+
+    def _retry_after(self, priority: str) -> int:
+        cooling = self._last_decrease + COOLDOWN - time.monotonic()
+        return max(1, math.ceil(max(self._expected_wait(priority), cooling)))
+
+    def _reject(self, priority: str, reason: str) -> Rejected:
+        key = (priority, reason)
+        self.rejected[key] = self.rejected.get(key, 0) + 1
+        return Rejected(priority, reason, self._retry_after(priority))
+
+    def acquire(self, route: str, priority: str) -> Ticket:
+        """
+        Wait for the request to be let in.
+        :raises Rejected: If the route is at its cap, the class's queue is full, or the request can't start within
+                          its class's MAX_WAIT.
+        """
+        with self._condition:
+            # A request over its route's cap isn't queued, so it never holds up the requests of lower classes.
+            if self._route_full(route):
+                raise self._reject(priority, 'route_limit')
+            if not self._can_start(priority):
+                if self.waiting[priority] >= int(self.queue_size * SHARE[priority]):
+                    raise self._reject(priority, 'queue_full')
+                if self._expected_wait(priority) > MAX_WAIT[priority]:
+                    raise self._reject(priority, 'deadline')
+                deadline = time.monotonic() + MAX_WAIT[priority]
+                self.waiting[priority] += 1
+                try:
+                    while not self._can_start(priority):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject(priority, 'deadline')
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting[priority] -= 1
+                    # Whoever was waiting behind this request may be able to start now.
+                    self._condition.notify_all()
+                if self._route_full(route):
+                    raise self._reject(priority, 'route_limit')
+            self.running += 1
+            self.route_running[route] = self.route_running.get(route, 0) + 1
+            self.admitted[priority] += 1
+            return Ticket(route, priority, time.monotonic())
+
+    def release(self, ticket: Ticket, request_metrics: Optional[RequestMetrics] = None):
+        """Let the next request in, and adapt the limit to the Fauna query latency the request saw."""
+        with self._condition:
+            self.running -= 1
+            self.route_running[ticket.route] -= 1
+            self.service_time += 0.1 * (time.monotonic() - ticket.started - self.service_time)
+            if request_metrics is not None and request_metrics.queries:
+                self._observe_latency(request_metrics.wall_ms / request_metrics.queries / 1000)
+            self._condition.notify_all()
+
+    def _observe_latency(self, latency: float):
+        if self.baseline_latency is None:
+            self.recent_latency = self.baseline_latency = latency
+            return
+        self.recent_latency += 0.2 * (latency - self.recent_latency)
+        self.baseline_latency += 0.01 * (latency - self.baseline_latency)
+        if self.recent_latency > self.baseline_latency * LATENCY_TOLERANCE:
+            self._decrease()
+        else:
+            # Additive increase: one more slot for every limit's worth of requests.
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * DECREASE)
+        self.decreases += 1
+
+    def throttled(self):
+        """Fauna throttled a query past its retries: shrink the limit."""
+        with self._condition:
+            self._decrease()
+
+    def retry_after(self) -> int:
+        """Seconds to tell a client whose query was throttled to wait."""
+        with self._condition:
+            return self._retry_after(PRIORITIES[-1])
+
+    def stats(self) -> dict[str, Any]:
+        with self._condition:
+            return {
+                'limit': round(self.limit, 2),
+                'running': self.running,
+                'waiting': dict(self.waiting),
+                'admitted': dict(self.admitted),
+                'rejected': {f'{priority}:{reason}': count for (priority, reason), count in self.rejected.items()},
+                'decreases': self.decreases,
+                'recentLatencyMs': round(self.recent_latency * 1000, 1) if self.recent_latency is not None else None,
+                'baselineLatencyMs':
+                    round(self.baseline_latency * 1000, 1) if self.baseline_latency is not None else None,
+            }
+
+
+admission = AdmissionController()
@@ -1,34 +1,144 @@
 from fauna.errors import FaunaError
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
+from ecommerce_app import admission, change_feed, metrics, warmup
+from ecommerce_app.admission import Rejected
+from ecommerce_app.cache import category_cache, order_cache, product_cache
+from ecommerce_app.coalescing import flights, not_found_cache
+from ecommerce_app.errors import fauna_error_response
+from ecommerce_app.fauna_client import client
+from ecommerce_app.includes import InvalidIncludesError
+from ecommerce_app.models.projections import InvalidFieldsError
+from ecommerce_app.negotiation import NegotiatingJSONProvider, finish_response
+from ecommerce_app.pagination import InvalidPagesError, page_cache
 from ecommerce_app.routes import products
+from ecommerce_app.search import InvalidSearchError, product_search
 from ecommerce_app.routes import orders
 from ecommerce_app.routes import customers
 
 app = Flask(__name__)
+# jsonify answers in MessagePack or CBOR when the request's Accept header asks for it.
+app.json = NegotiatingJSONProvider(app)
 
 app.register_blueprint(products)
 app.register_blueprint(orders)
 app.register_blueprint(customers)
 
+caches = (product_cache, order_cache, category_cache, page_cache, not_found_cache)
+
+if change_feed.ENABLED:
+    change_feed.start()
+
+if warmup.ENABLED:
+    warmup.start(client)
+
+
+@app.before_request
+def start_request_metrics():
+    # Label the request's queries with its blueprint and route (the rule, not the URL, to keep the labels bounded).
+    metrics.start_request(request.blueprint, request.url_rule.rule if request.url_rule else None)
+
+
+@app.before_request
+def admit_request():
+    # Raises Rejected, answered with a 503, if the request can't start in time.
+    priority = admission.priority_of(request.endpoint, request.blueprint)
+    if admission.ENABLED and priority is not None:
+        g.admission_ticket = admission.admission.acquire(request.endpoint, priority)
+
+
+@app.teardown_request
+def release_request(exc):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission.admission.release(ticket, metrics.current_request())
+
+
+@app.after_request
+def finish_request_metrics(response: Response):
+    request_metrics = metrics.current_request()
+    metrics.finish_request(request_metrics)
+    if app.debug and request_metrics is not None:
+        response.headers.update(request_metrics.headers())
+    return response
+
+
+@app.after_request
+def compress_response(response: Response):
+    return finish_response(response, request.accept_encodings)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Query latency and Fauna query stats by blueprint, route and query template, in the Prometheus text format."""
+    counters = metrics.stats_counters(client.pool_stats.snapshot(), {cache.name: cache.stats() for cache in caches})
+    counters += metrics.coalescing_counters(flights.stats())
+    counters += metrics.admission_counters(admission.admission.stats())
+    return Response(metrics.render(counters), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/stats/pool', methods=['GET'])
+def get_pool_stats():
+    """Connection pool hit/miss and retry counts for the shared Fauna client, used to size the pool under load."""
+    return jsonify(client.pool_stats.snapshot())
+
+
+@app.route('/stats/cache', methods=['GET'])
+def get_cache_stats():
+    """Hit, miss, stale hit and eviction counts for each cache: products, orders, categories, pages and not found."""
+    return jsonify({cache.name: cache.stats() for cache in caches})
+
+
+@app.route('/stats/coalescing', methods=['GET'])
+def get_coalescing_stats():
+    """By kind of document, the reads that ran a query, and the reads that shared a query already in flight."""
+    return jsonify(flights.stats())
+
+
+@app.route('/stats/change-feed', methods=['GET'])
+def get_change_feed_stats():
+    """Events handled and reconnects by stream, and the SSE clients and products followed by this process."""
+    return jsonify(change_feed.stats())
+
+
+@app.route('/stats/search', methods=['GET'])
+def get_search_stats():
+    """The products and words in the search index, how often it was built, and the results cached."""
+    return jsonify(product_search.stats())
+
+
+@app.route('/stats/admission', methods=['GET'])
+def get_admission_stats():
+    """The concurrency limit, requests running and waiting, and requests admitted and rejected by priority class."""
+    return jsonify(admission.admission.stats())
+
+
+@app.route('/stats/warmup', methods=['GET'])
+def get_warmup_stats():
+    """Whether this process warmed up before its first request, the connections it opened, and how long it took."""
+    return jsonify(warmup.stats())
+
+
+@app.errorhandler(InvalidFieldsError)
+@app.errorhandler(InvalidPagesError)
+@app.errorhandler(InvalidIncludesError)
+@app.errorhandler(InvalidSearchError)
+def handle_invalid_fields(exc: ValueError):
+    return jsonify({'message': str(exc), 'status_code': 400}), 400
+
+
+@app.errorhandler(Rejected)
+def handle_rejected(exc: Rejected):
+    return jsonify({'message': str(exc), 'status_code': 503}), 503, {'Retry-After': str(exc.retry_after)}
+
+
 @app.errorhandler(FaunaError)
 def handle_fauna_exception(exc: FaunaError):
-    err_dict = {'http_status': exc.status_code, 'code': exc.code, 'message': exc.message}
-    if exc.code == 'document_not_found':
-        return jsonify({"message": f"Document not found at {request.path}", "status_code": 404}), 404
-    if hasattr(exc, 'summary'):
-        err_dict['summary'] = exc.summary
-    if exc.constraint_failures:
-        constraint_failures = []
-        for cf in exc.constraint_failures:
-            failure = {'message': cf.message, 'paths': cf.paths }
-            if cf.name:
-                failure['name'] = cf.name
-            constraint_failures.append(failure)
-        return jsonify(constraint_failures), 409
-    if exc.abort:
-        return jsonify({'message': exc.abort, 'status_code': exc.status_code}), exc.status_code
-
-    return jsonify(err_dict), exc.status_code
+    body, status = fauna_error_response(exc, request.path)
+    if admission.is_throttling(exc):
+        # Fauna is still throttling after the client's retries: let fewer requests in until it recovers.
+        admission.admission.throttled()
+        return jsonify(body), status, {'Retry-After': str(admission.admission.retry_after())}
+    return jsonify(body), status
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,299 @@
+"""
+An async (ASGI) entry point that serves the same products, orders and customers routes as `app.py`, except for the
+bulk catalog import and export in `catalog_controller.py` and the product events stream (GET /products/events), which
+needs the change feed that only the sync app runs. All three answer 404 here. Product search is answered from the same
+in-process index as the sync app (see `search.py`), which is loaded with the blocking client in a worker thread.
+
+The handlers await Fauna through `AsyncFaunaClient`, so one process can keep many queries in flight without a thread
+per request. The queries themselves come from `queries.py`, shared with the sync app. This entry point needs the
+optional dependencies in requirements-async.txt, and runs under any ASGI server:
+
+    FAUNA_SECRET=<secret> uvicorn ecommerce_app.asgi:app
+"""
+import asyncio
+from typing import Any, Callable
+
+from fauna.errors import AbortError, FaunaError
+from quart import Blueprint, Quart, Response, jsonify, request
+
+from ecommerce_app import conditional, metrics, queries, warmup
+from ecommerce_app.cache import product_cache
+from ecommerce_app.customer_controller import missing_customer_fields, parse_cart_items, query_options
+from ecommerce_app.errors import fauna_error_response
+from ecommerce_app.fauna_client import AsyncFaunaClient, ClientConfig
+from ecommerce_app.includes import CUSTOMER_INCLUDES, ORDER_INCLUDES, InvalidIncludesError, parse_includes, \
+    parse_orders_page_size
+from ecommerce_app.models.projections import InvalidFieldsError, parse_fields
+from ecommerce_app.order_controller import checked_out
+from ecommerce_app.pagination import InvalidPagesError, aread_pages, parse_pages, parse_prefetch
+from ecommerce_app.product_controller import REQUIRED_PRODUCT_FIELDS, extract_product_fields, new_product_fields, \
+    parse_price_filter, product_written, remember_category
+from ecommerce_app.search import InvalidSearchError, parse_search, product_search
+from ecommerce_app.serialization import page_chunks
+
+products = Blueprint('products', __name__)
+orders = Blueprint('orders', __name__)
+customers = Blueprint('customers', __name__)
+
+# Initialize the async Fauna client
+client = AsyncFaunaClient(ClientConfig.from_env())
+
+
+def page_response(data, after) -> Response:
+    return Response(page_chunks(data, after), mimetype='application/json')
+
+
+def etag_response(tag: str, body: Callable[[], Any]) -> Response:
+    """The same as conditional.etag_response, for Quart."""
+    response = Response('', status=304) if request.if_none_match.contains_weak(tag) else jsonify(body())
+    response.set_etag(tag, weak=True)
+    return response
+
+
+@products.route('/products', methods=['GET'])
+async def get_products():
+    nextToken = request.args.get('nextToken')
+    category = request.args.get('category')
+    pageSize = request.args.get('pageSize', default=10, type=int)
+    prices, message = parse_price_filter(
+        request.args.get('sort'), request.args.get('minPrice'), request.args.get('maxPrice'))
+    if message:
+        return jsonify({'message': message}), 400
+    if prices is not None:
+        fields = parse_fields('product_price_row', request.args.get('fields'))
+        data, after = await aread_pages(
+            client, queries.products_by_price(None, category, *prices, pageSize, fields), nextToken,
+            lambda token: queries.products_by_price(token, None, None, None, pageSize, fields),
+            parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')), fields)
+        return page_response(data, after), 200
+    fields = parse_fields('product_response', request.args.get('fields'))
+    data, after = await aread_pages(
+        client, queries.products_page(None, category, pageSize, fields), nextToken,
+        lambda token: queries.products_page(token, None, pageSize, fields),
+        parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')), fields)
+    if category and not nextToken and data:
+        remember_category(data[0])
+    return page_response(data, after), 200
+
+
+@products.route('/products/search', methods=['GET'])
+async def search_products():
+    query, limit = parse_search(request.args.get('q'), request.args.get('limit'))
+    if product_search.index is None:
+        # The first search reads every product to build the index, so it's kept off the event loop.
+        return jsonify({'data': await asyncio.to_thread(product_search.search, query, limit)}), 200
+    return jsonify({'data': product_search.search(query, limit)}), 200
+
+
+@products.route('/products/events', methods=['GET'])
+async def get_product_events():
+    # Routed explicitly, so it isn't read as a product with the id "events".
+    return jsonify({'message': 'Product events are only served by the sync app.', 'status_code': 404}), 404
+
+
+@products.route('/products/import', methods=['POST'])
+@products.route('/products/export', methods=['GET'])
+async def catalog_transfer():
+    # Routed explicitly, so an export isn't read as a product with the id "export".
+    return jsonify({'message': 'Catalog import and export are only served by the sync app.', 'status_code': 404}), 404
+
+
+@products.route('/products/<product_id>', methods=['GET'])
+async def get_product(product_id: str):
+    fields = parse_fields('product_response', request.args.get('fields'))
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return etag_response(conditional.etag(cached['version'], fields), lambda: cached['data'] if fields is None
+                             else {key: value for key, value in cached['data'].items() if key in fields})
+    if fields is None:
+        cached = conditional.versioned((await client.query(queries.product(product_id))).data)
+        product_cache.set(product_id, cached)
+        return etag_response(cached['version'], lambda: cached['data'])
+    tag, product = await conditional.aread_if_modified(
+        client, request.if_none_match, queries.product_timestamps(product_id), queries.product(product_id, fields),
+        fields)
+    return etag_response(tag, lambda: product)
+
+
+@products.route('/products', methods=['POST'])
+async def post_products():
+    data = await request.get_json()
+    fields = new_product_fields(data)
+    difference = REQUIRED_PRODUCT_FIELDS - set(fields.keys())
+    if difference:
+        return jsonify({'message': f'Missing required field(s) {difference}'}), 400
+    res = await client.query(queries.create_product(fields))
+    product_written(res.data)
+    return jsonify(res.data), 201
+
+
+@products.route('/products/<product_id>', methods=['PATCH'])
+async def patch_product(product_id: str):
+    data = await request.get_json()
+    fields = extract_product_fields(data)
+    category_name = data.get('category')
+    if not fields and not category_name:
+        return jsonify({'message': 'At least one field must be updated.'}), 400
+    success = await client.query(queries.update_product(product_id, fields, category_name))
+    product_written(success.data)
+    return jsonify(success.data), 200
+
+
+@orders.route('/orders/<order_id>', methods=['GET'])
+async def get_order(order_id: str):
+    fields = parse_fields('order_response', request.args.get('fields'))
+    includes = parse_includes(ORDER_INCLUDES, request.args.get('include'))
+    if includes is not None:
+        order = (await client.query(queries.order_with_includes(order_id, fields, includes))).data
+        return etag_response(conditional.version_of(order), lambda: order)
+    tag, order = await conditional.aread_if_modified(
+        client, request.if_none_match, queries.order_timestamps(order_id), queries.order(order_id, fields), fields)
+    return etag_response(tag, lambda: order)
+
+
+@orders.route('/orders/<order_id>', methods=['PATCH'])
+async def patch_order(order_id: str):
+    data = await request.get_json()
+    res = await client.query(queries.update_order(order_id, data.get('status'), data.get('payment', {})))
+    return jsonify(res.data), 200
+
+
+@orders.route('/orders/<order_id>/checkout', methods=['POST'])
+async def post_order_checkout(order_id: str):
+    data = await request.get_json(silent=True) or {}
+    res = await client.query(queries.checkout(order_id, data.get('payment')))
+    checked_out(res.data)
+    return jsonify(res.data), 200
+
+
+@customers.route('/customers', methods=['POST'])
+async def post_customers():
+    customer_data = await request.get_json()
+    difference = missing_customer_fields(customer_data)
+    if difference:
+        return jsonify({'message': f'Missing required field(s) {difference}'}), 400
+    success = await client.query(queries.create_customer(customer_data), query_options)
+    return jsonify(success.data), 201
+
+
+@customers.route('/customers/<customer_id>/cart', methods=['POST'])
+async def get_customer_cart(customer_id: str):
+    res = await client.query(queries.get_or_create_cart(customer_id), query_options)
+    return jsonify(res.data), 200
+
+
+@customers.route('/customers/<customer_id>/cart/item', methods=['POST'])
+async def post_customer_cart_item(customer_id: str):
+    data = await request.get_json()
+    product_name = data.get('productName')
+    quantity = data.get('quantity')
+    if not product_name or quantity is None:
+        return jsonify({'message': 'Missing product name or quantity.'}), 400
+    res = await client.query(queries.add_item_to_cart(customer_id, product_name, quantity), query_options)
+    return jsonify(res.data), 200
+
+
+@customers.route('/customers/<customer_id>/cart/items', methods=['POST'])
+async def post_customer_cart_items(customer_id: str):
+    items, message = parse_cart_items(await request.get_json(silent=True))
+    if message:
+        return jsonify({'message': message}), 400
+    res = await client.query(queries.add_items_to_cart(customer_id, items), query_options)
+    return jsonify(res.data), 200
+
+
+@customers.route('/customers/<customer_id>', methods=['GET'])
+async def get_customer(customer_id: str):
+    fields = parse_fields('customer_response', request.args.get('fields'))
+    key = request.args.get('key')
+    includes = parse_includes(CUSTOMER_INCLUDES, request.args.get('include'))
+    try:
+        if includes is not None:
+            page_size = parse_orders_page_size(request.args.get('ordersPageSize'))
+            customer = (await client.query(
+                queries.customer_with_includes(customer_id, key, fields, includes, page_size))).data
+            return etag_response(conditional.version_of(customer), lambda: customer)
+        tag, customer = await conditional.aread_if_modified(
+            client, request.if_none_match, queries.customer_timestamps(customer_id, key),
+            queries.customer(customer_id, key, fields), fields)
+        return etag_response(tag, lambda: customer)
+    except AbortError as err:
+        if err.abort == queries.CUSTOMER_NOT_FOUND:
+            return jsonify({"message": queries.CUSTOMER_NOT_FOUND, "status_code": 404}), 404
+        raise
+
+
+@customers.route('/customers/<customer_id>/orders/summary', methods=['GET'])
+async def get_customer_order_summary(customer_id: str):
+    page_size = parse_orders_page_size(request.args.get('ordersPageSize'))
+    try:
+        summary = (await client.query(queries.customer_order_summary(customer_id, page_size), query_options)).data
+    except AbortError as err:
+        if err.abort == queries.CUSTOMER_NOT_FOUND:
+            return jsonify({"message": queries.CUSTOMER_NOT_FOUND, "status_code": 404}), 404
+        raise
+    return etag_response(conditional.version_of(summary), lambda: summary)
+
+
+@customers.route('/customers/<customer_id>/orders', methods=['GET'])
+async def get_customer_orders(customer_id: str):
+    nextToken = request.args.get("nextToken")
+    pageSize = request.args.get('pageSize', default=10, type=int)
+    data, after = await aread_pages(
+        client, queries.customer_orders_page(customer_id, None, pageSize), nextToken,
+        lambda token: queries.customer_orders_page(customer_id, token, pageSize),
+        parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')))
+    return page_response(data, after)
+
+
+app = Quart(__name__)
+
+app.register_blueprint(products)
+app.register_blueprint(orders)
+app.register_blueprint(customers)
+
+
+@app.before_request
+async def start_request_metrics():
+    metrics.start_request(request.blueprint, request.url_rule.rule if request.url_rule else None)
+
+
+@app.after_request
+async def finish_request_metrics(response: Response):
+    request_metrics = metrics.current_request()
+    metrics.finish_request(request_metrics)
+    if app.debug and request_metrics is not None:
+        response.headers.update(request_metrics.headers())
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+async def get_metrics():
+    counters = metrics.stats_counters(client.pool_stats.snapshot(), {product_cache.name: product_cache.stats()})
+    return Response(metrics.render(counters), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_serving
+async def warm_up():
+    if warmup.ENABLED:
+        # In the background, so the server starts listening without waiting for Fauna.
+        app.add_background_task(warmup.awarm_up, client)
+
+
+@app.after_serving
+async def close_client():
+    await client.aclose()
+
+
+@app.errorhandler(InvalidFieldsError)
+@app.errorhandler(InvalidPagesError)
+@app.errorhandler(InvalidIncludesError)
+@app.errorhandler(InvalidSearchError)
+async def handle_invalid_fields(exc: ValueError):
+    return jsonify({'message': str(exc), 'status_code': 400}), 400
+
+
+@app.errorhandler(FaunaError)
+async def handle_fauna_exception(exc: FaunaError):
+    body, status = fauna_error_response(exc, request.path)
+    return jsonify(body), status
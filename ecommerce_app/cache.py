@@ -0,0 +1,195 @@
+"""
+Read-through caches for hot, rarely changing reads: products by id and category ids by name.
+
+A `ReadThroughCache` keeps the TTL and stale-while-revalidate logic, and stores entries in a pluggable
+`CacheBackend`. `MemoryBackend` is a size-bounded LRU local to the process, `KeyValueBackend` stores entries in any
+shared key/value store with a redis-style get/set/delete interface.
+"""
+import abc
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Hashable, Optional
+
+from ecommerce_app.config import env_float, env_int
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    # Wall-clock times (seconds since the epoch), so entries can be shared between processes.
+    expires_at: float
+    stale_until: float
+
+
+class CacheBackend(abc.ABC):
+
+    def __init__(self):
+        self.evictions = 0
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, entry: CacheEntry) -> None:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """An in-process LRU. Once max_size entries are held, the least recently used entry is evicted."""
+
+    def __init__(self, max_size: int = 1024):
+        super().__init__()
+        self.max_size = max_size
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class KeyValueBackend(CacheBackend):
+    """
+    Stores entries as JSON in a shared key/value store, such as a redis client or a local stand-in for one.
+    The store needs `get(key)`, `set(key, value, ex=seconds)` and `delete(key)`. Size-based eviction is left to
+    the store; entries are written with an expiry so the store drops them once they are no longer servable.
+    """
+
+    def __init__(self, store: Any, prefix: str = 'ecommerce:'):
+        super().__init__()
+        self.store = store
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        raw = self.store.get(self.prefix + key)
+        return CacheEntry(**json.loads(raw)) if raw is not None else None
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        ttl = max(1, int(entry.stale_until - time.time()) + 1)
+        self.store.set(self.prefix + key, json.dumps(asdict(entry)), ex=ttl)
+
+    def delete(self, key: str) -> None:
+        self.store.delete(self.prefix + key)
+
+
+class ReadThroughCache:
+    """
+    Serves values from the backend while they are fresh, and loads them on a miss.
+    If stale_ttl is set, an expired entry is still served for that many extra seconds while a background thread
+    reloads it.
+    """
+
+    def __init__(self, name: str, backend: CacheBackend, ttl: float, stale_ttl: float = 0,
+                 clock: Callable[[], float] = time.time):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value if it is fresh, without loading it on a miss."""
+        entry = self.backend.get(str(key))
+        if entry is not None and self.clock() < entry.expires_at:
+            self._count('hits')
+            return entry.value
+        self._count('misses')
+        return None
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        key = str(key)
+        entry = self.backend.get(key)
+        now = self.clock()
+        if entry is not None and now < entry.expires_at:
+            self._count('hits')
+            return entry.value
+        if entry is not None and now < entry.stale_until:
+            self._count('stale_hits')
+            self._refresh_in_background(key, loader)
+            return entry.value
+        self._count('misses')
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        now = self.clock()
+        self.backend.set(str(key), CacheEntry(value, now + self.ttl, now + self.ttl + self.stale_ttl))
+
+    def invalidate(self, key: Hashable) -> None:
+        self.backend.delete(str(key))
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'staleHits': self.stale_hits,
+                'evictions': self.backend.evictions}
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.set(key, loader())
+            except Exception:
+                # Keep serving the stale entry; the next request past stale_until will load it again.
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+# Products by id, as {version, data} where data has the same projection as product_response().
+product_cache = ReadThroughCache(
+    'products', MemoryBackend(env_int('PRODUCT_CACHE_SIZE', 10000)),
+    ttl=env_float('PRODUCT_CACHE_TTL', 30), stale_ttl=env_float('PRODUCT_CACHE_STALE_TTL', 0))
+
+# Full order responses by id, as {version, data}. Off by default (a TTL of 0), since an order changes with every
+# cart update. Enable it with the change feed (see change_feed.py), which invalidates orders as they're written.
+order_cache = ReadThroughCache(
+    'orders', MemoryBackend(env_int('ORDER_CACHE_SIZE', 10000)), ttl=env_float('ORDER_CACHE_TTL', 0))
+
+# Category ids by category name.
+category_cache = ReadThroughCache(
+    'categories', MemoryBackend(env_int('CATEGORY_CACHE_SIZE', 1000)),
+    ttl=env_float('CATEGORY_CACHE_TTL', 300), stale_ttl=env_float('CATEGORY_CACHE_STALE_TTL', 0))
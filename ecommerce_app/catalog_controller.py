@@ -0,0 +1,206 @@
+"""
+Bulk product import and export.
+
+An import streams NDJSON or CSV rows from the request body, validates each row like `create_product`, and creates or
+updates the products by name in bounded batches, with a few batches in flight at once. A batch that names a product
+still being written by another batch waits for it. An export walks every product page by page and writes each page as
+it arrives, so neither side holds the whole catalog in memory.
+"""
+import codecs
+import contextvars
+import csv
+import io
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, Optional
+
+from fauna.client import QueryOptions
+from fauna.errors import FaunaError
+from flask import Response, jsonify, request, stream_with_context
+
+from ecommerce_app import queries
+from ecommerce_app.cache import product_cache
+from ecommerce_app.config import env_int
+from ecommerce_app.fauna_client import client
+from ecommerce_app.product_controller import REQUIRED_PRODUCT_FIELDS, new_product_fields
+from ecommerce_app.search import product_search
+
+# Products per import transaction, and import transactions in flight at once.
+IMPORT_BATCH_SIZE = env_int('PRODUCT_IMPORT_BATCH_SIZE', 100)
+IMPORT_CONCURRENCY = env_int('PRODUCT_IMPORT_CONCURRENCY', 4)
+# Products per page read by an export.
+EXPORT_PAGE_SIZE = env_int('PRODUCT_EXPORT_PAGE_SIZE', 500)
+# An import reports at most this many failed rows, though it counts all of them.
+MAX_REPORTED_ERRORS = 100
+
+CSV_COLUMNS = ['id', 'name', 'description', 'price', 'stock', 'category']
+
+# The batch queries build product documents from untyped rows, so they're run with typechecking disabled.
+import_options = QueryOptions(typecheck=False)
+
+
+class ImportSummary:
+    """Counts of what an import did, and the first MAX_REPORTED_ERRORS rows that failed."""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, row: int, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'message': message})
+
+    def as_dict(self) -> dict[str, Any]:
+        return {'created': self.created, 'updated': self.updated, 'failed': self.failed, 'errors': self.errors}
+
+
+def read_rows(lines: Iterable[str], csv_format: bool) -> Iterator[tuple[int, Any]]:
+    """
+    Parse the rows of an import.
+    :param lines: The decoded lines of the request body.
+    :param csv_format: Parse CSV with a header row if True, otherwise one JSON object per line.
+    :return: (row number, row) pairs, where the row is None if it couldn't be parsed. Row numbers count from 1, and
+             don't count the CSV header.
+    """
+    if csv_format:
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row
+        return
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def validate_row(row: Any) -> tuple[Optional[dict[str, Any]], Optional[str]]:
+    """Return the product fields of an import row and None, or None and the reason the row is invalid."""
+    if not isinstance(row, dict):
+        return None, 'Row is not a product object.'
+    try:
+        fields = new_product_fields(row)
+    except (TypeError, ValueError) as e:
+        return None, f'Invalid field value: {e}'
+    difference = REQUIRED_PRODUCT_FIELDS - set(fields.keys())
+    if difference:
+        return None, f'Missing required field(s) {difference}'
+    return fields, None
+
+
+def batch_rows(rows: Iterator[tuple[int, Any]], summary: ImportSummary,
+               batch_size: int) -> Iterator[dict[str, tuple[int, dict[str, Any]]]]:
+    """
+    Group the valid rows into batches of at most batch_size products, keyed by name. Invalid rows are recorded in the
+    summary. If a name repeats within a batch the later row wins, since one transaction can't create a name twice.
+    """
+    batch = {}
+    for number, row in rows:
+        fields, message = validate_row(row)
+        if message:
+            summary.fail(number, message)
+            continue
+        previous = batch.pop(fields['name'], None)
+        if previous:
+            summary.fail(previous[0], f'Superseded by row {number} with the same name.')
+        batch[fields['name']] = (number, fields)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = {}
+    if batch:
+        yield batch
+
+
+def import_batch(batch: dict[str, tuple[int, dict[str, Any]]]) -> list[dict[str, Any]]:
+    success = client.query(queries.upsert_products([fields for _, fields in batch.values()]), import_options)
+    return success.data
+
+
+def record_batch(future: Future, batch: dict[str, tuple[int, dict[str, Any]]], summary: ImportSummary):
+    rows = list(batch.values())
+    try:
+        results = future.result()
+    except FaunaError as e:
+        # The whole transaction was rolled back, so every row in the batch failed.
+        for number, _ in rows:
+            summary.fail(number, e.message)
+        return
+    for (number, fields), result in zip(rows, results):
+        if result.get('error'):
+            summary.fail(number, result['error'])
+            continue
+        product_cache.invalidate(result['id'])
+        product_search.upsert({'id': result['id'], **fields})
+        if result['created']:
+            summary.created += 1
+        else:
+            summary.updated += 1
+
+
+def import_products():
+    # Decode the body line by line as it arrives, instead of reading it all first.
+    csv_format = request.mimetype == 'text/csv'
+    lines = codecs.iterdecode(request.stream, request.mimetype_params.get('charset', 'utf-8'))
+    summary = ImportSummary()
+
+    with ThreadPoolExecutor(IMPORT_CONCURRENCY) as executor:
+        pending = {}
+        for batch in batch_rows(read_rows(lines, csv_format), summary, IMPORT_BATCH_SIZE):
+            # Finish the batches in flight that write any of the same names first, so two transactions never write a
+            # product at once and the later row is the one that's kept.
+            overlapping = [future for future, in_flight in pending.items() if not in_flight.keys().isdisjoint(batch)]
+            for future in wait(overlapping).done:
+                record_batch(future, pending.pop(future), summary)
+            # Keep at most IMPORT_CONCURRENCY batches in flight, and keep reading rows while they run.
+            if len(pending) >= IMPORT_CONCURRENCY:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record_batch(future, pending.pop(future), summary)
+            # Run each batch in a copy of this context, so metrics label its query with this request's route.
+            pending[executor.submit(contextvars.copy_context().run, import_batch, batch)] = batch
+        for future in wait(pending).done:
+            record_batch(future, pending[future], summary)
+
+    return jsonify(summary.as_dict()), 200
+
+
+def fetch_rows_page(next_token: Optional[str]) -> tuple[list[dict[str, Any]], Optional[str]]:
+    success = client.query(queries.product_rows_page(next_token, EXPORT_PAGE_SIZE))
+    if next_token:
+        # Data is a dict not a page here.
+        return success.data['data'], success.data['after']
+    return success.data.data, success.data.after
+
+
+def format_rows(rows: list[dict[str, Any]], csv_format: bool) -> str:
+    if not csv_format:
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, CSV_COLUMNS, extrasaction='ignore').writerows(rows)
+    return buffer.getvalue()
+
+
+def export_products():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'message': 'format must be ndjson or csv.'}), 400
+    csv_format = export_format == 'csv'
+
+    def generate():
+        if csv_format:
+            yield ','.join(CSV_COLUMNS) + '\r\n'
+        with ThreadPoolExecutor(1) as executor:
+            context = contextvars.copy_context()
+            page = executor.submit(context.run, fetch_rows_page, None)
+            while page is not None:
+                rows, after = page.result()
+                # Fetch the next page while this one is written out.
+                page = executor.submit(context.run, fetch_rows_page, after) if after else None
+                yield format_rows(rows, csv_format)
+
+    mimetype = 'text/csv' if csv_format else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
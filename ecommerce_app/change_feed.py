@@ -0,0 +1,247 @@
+"""
+Cache invalidation and stock and price push, driven by Fauna event streams.
+
+With CHANGE_FEED=true, each worker process runs one background thread per collection that follows a Fauna event
+stream. Product events invalidate `product_cache`, keep `snapshot` (the last known stock and price of each product)
+up to date, and are fanned out to the Server-Sent Events clients of GET /products/events. Order events invalidate
+`order_cache`. A stream that drops is reopened from the cursor of the last event it handled, so no events are missed.
+
+Each SSE message's id is the Fauna cursor of its event. The last CHANGE_FEED_HISTORY messages are kept, so a client
+that reconnects with Last-Event-ID gets the messages it missed. If its id is no longer kept, or a stream couldn't be
+resumed, the client is sent a `reset` message, meaning it should read the products it follows again.
+"""
+import json
+import queue
+import random
+import threading
+from collections import deque
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from fauna import fql
+from fauna.client import Client, StreamOptions
+from fauna.errors import FaunaError, NetworkError
+from fauna.query import Query
+
+from ecommerce_app.cache import order_cache, product_cache
+from ecommerce_app.config import env_bool, env_float, env_int
+from ecommerce_app.search import product_search
+
+ENABLED = env_bool('CHANGE_FEED', False)
+# Messages kept for clients that reconnect, and the most a slow client may fall behind before it's sent a reset.
+HISTORY = env_int('CHANGE_FEED_HISTORY', 1000)
+MAX_PENDING = env_int('CHANGE_FEED_MAX_PENDING', 1000)
+# Seconds between keep-alive comments on an idle SSE connection.
+KEEPALIVE = env_float('CHANGE_FEED_KEEPALIVE', 15)
+# Reconnects back off with full jitter, up to this many seconds.
+MAX_BACKOFF = env_float('CHANGE_FEED_MAX_BACKOFF', 30)
+
+PRODUCT_EVENTS = fql('Product.all().eventSource()')
+ORDER_EVENTS = fql('Order.all().eventSource()')
+
+# The SSE message sent when a client may have missed messages.
+RESET = 'reset'
+
+
+class Subscription:
+    """The messages waiting to be sent to one SSE client."""
+
+    def __init__(self):
+        self.messages = queue.Queue(MAX_PENDING)
+        # Set when a message couldn't be queued because the client fell too far behind.
+        self.lost = False
+
+
+class Broadcaster:
+    """Fans messages out to every subscription, and keeps the last few so a client can resume after reconnecting."""
+
+    def __init__(self, history: int):
+        self._history: deque[tuple[str, dict]] = deque(maxlen=history)
+        self._subscriptions: set[Subscription] = set()
+        self._lock = threading.Lock()
+
+    def publish(self, message_id: str, message: dict):
+        with self._lock:
+            self._history.append((message_id, message))
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.messages.put_nowait((message_id, message))
+            except queue.Full:
+                subscription.lost = True
+
+    def reset(self):
+        """Tell every client it may have missed messages. No client can resume from before this."""
+        with self._lock:
+            self._history.clear()
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.lost = True
+
+    def subscribe(self, last_id: Optional[str] = None) -> tuple[Subscription, Optional[list[tuple[str, dict]]]]:
+        """
+        Start queueing messages for a client.
+        :param last_id: The id of the last message the client received, if it's reconnecting.
+        :return: The subscription, and the messages after last_id to send first. These are None if last_id is no
+                 longer kept, in which case the client may have missed messages.
+        """
+        subscription = Subscription()
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if last_id is None:
+                return subscription, []
+            ids = [message_id for message_id, _ in self._history]
+            if last_id not in ids:
+                return subscription, None
+            return subscription, list(self._history)[ids.index(last_id) + 1:]
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+
+class EventStream(threading.Thread):
+    """Follows a Fauna event source, passing each event to handle, and reopening the stream when it drops."""
+
+    def __init__(self, name: str, client: Client, source: Query, handle: Callable[[dict], None],
+                 on_gap: Callable[[], None]):
+        super().__init__(name=f'change-feed-{name}', daemon=True)
+        self.client = client
+        self.source = source
+        self.handle = handle
+        self.on_gap = on_gap
+        self.cursor = None
+        self.events = 0
+        self.reconnects = 0
+        self.last_error = None
+        self._event_source = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        attempt = 0
+        while not self._stopped.is_set():
+            try:
+                if self._event_source is None:
+                    self._event_source = self.client.query(self.source).data
+                with self.client.stream(self._event_source, StreamOptions(cursor=self.cursor)) as events:
+                    for event in events:
+                        attempt = 0
+                        self.handle(event)
+                        self.events += 1
+                        self.cursor = event.get('cursor')
+                        if self._stopped.is_set():
+                            return
+            except NetworkError as e:
+                self.last_error = str(e)
+            except FaunaError as e:
+                # The stream can't be resumed, e.g. the cursor is too old. Start again from now.
+                self.last_error = str(e)
+                self._event_source = self.cursor = None
+                self.on_gap()
+            attempt += 1
+            self.reconnects += 1
+            self._stopped.wait(random.uniform(0, min(MAX_BACKOFF, 0.1 * 2 ** attempt)))
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self) -> dict[str, Any]:
+        return {'events': self.events, 'reconnects': self.reconnects, 'cursor': self.cursor,
+                'lastError': self.last_error}
+
+
+broadcaster = Broadcaster(HISTORY)
+# The last known stock and price of each product this process has seen an event for, by product id.
+snapshot: dict[str, dict[str, int]] = {}
+_streams: list[EventStream] = []
+
+
+def on_product_event(event: dict):
+    product = event['data']
+    product_cache.invalidate(product.id)
+    previous = snapshot.get(product.id)
+    if event['type'] == 'remove':
+        snapshot.pop(product.id, None)
+        product_search.remove(product.id)
+        broadcaster.publish(event['cursor'], {'id': product.id, 'removed': True})
+        return
+    current = {'stock': product.get('stock'), 'price': product.get('price')}
+    product_search.upsert({'id': product.id, 'name': product.get('name'), 'description': product.get('description'),
+                           **current})
+    snapshot[product.id] = current
+    # Only the values that changed, or both if this process hasn't seen the product before.
+    delta = {key: value for key, value in current.items() if previous is None or previous.get(key) != value}
+    if delta:
+        broadcaster.publish(event['cursor'], {'id': product.id, **delta})
+
+
+def on_product_gap():
+    snapshot.clear()
+    product_search.expire()
+    broadcaster.reset()
+
+
+def on_order_event(event: dict):
+    order_cache.invalidate(event['data'].id)
+
+
+def start(client: Optional[Client] = None):
+    """Start following the Product and Order event streams. The client defaults to one with no read timeout."""
+    client = client or Client()
+    _streams.extend([
+        EventStream('products', client, PRODUCT_EVENTS, on_product_event, on_product_gap),
+        EventStream('orders', client, ORDER_EVENTS, on_order_event, lambda: None),
+    ])
+    for stream in _streams:
+        stream.start()
+
+
+def running() -> bool:
+    return any(stream.is_alive() for stream in _streams)
+
+
+def stats() -> dict[str, Any]:
+    return {'streams': {stream.name: stream.stats() for stream in _streams},
+            'subscribers': broadcaster.subscribers(), 'products': len(snapshot)}
+
+
+def format_message(message_id: Optional[str], event: str, data: Any) -> str:
+    lines = [f'event: {event}', f'data: {json.dumps(data)}']
+    if message_id is not None:
+        lines.insert(0, f'id: {message_id}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def sse_messages(subscription: Subscription, replay: Optional[list[tuple[str, dict]]],
+                 product_ids: Optional[Iterable[str]] = None) -> Iterator[str]:
+    """
+    The Server-Sent Events stream for one client: the messages to replay, then each new message as it's published.
+    :param subscription: The client's subscription, from broadcaster.subscribe.
+    :param replay: The messages the client missed, or None if they're unknown, in which case it's sent a reset first.
+    :param product_ids: Only send messages about these products, if given.
+    """
+    wanted = set(product_ids) if product_ids else None
+    # Clients wait this many milliseconds before reconnecting.
+    yield 'retry: 3000\n\n'
+    if replay is None:
+        yield format_message(None, RESET, {})
+    for message_id, message in replay or ():
+        if wanted is None or message['id'] in wanted:
+            yield format_message(message_id, 'product', message)
+    while True:
+        if subscription.lost:
+            # The client fell too far behind. It has to read its products again, then it can continue from here.
+            subscription.lost = False
+            with subscription.messages.mutex:
+                subscription.messages.queue.clear()
+            yield format_message(None, RESET, {})
+        try:
+            message_id, message = subscription.messages.get(timeout=KEEPALIVE)
+        except queue.Empty:
+            yield ': keepalive\n\n'
+            continue
+        if wanted is None or message['id'] in wanted:
+            yield format_message(message_id, 'product', message)
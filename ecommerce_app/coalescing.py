@@ -0,0 +1,93 @@
+"""
+Request coalescing (single-flight) and negative caching for reads of a single document.
+
+When many threads read the same document at once, e.g. a product during a flash sale, only the first runs the query.
+The others wait for it and share its result, or its error. Reads that end in a not-found error are remembered in
+`not_found_cache` for a few seconds, so repeated requests for a missing document (e.g. from a scraper) fail without
+a query.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable, TypeVar
+
+from fauna.errors import FaunaError
+
+from ecommerce_app import queries
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+from ecommerce_app.config import env_float, env_int
+
+T = TypeVar('T')
+
+# Documents known not to exist, keyed like the document argument of read_shared.
+not_found_cache = ReadThroughCache(
+    'not_found', MemoryBackend(env_int('NOT_FOUND_CACHE_SIZE', 10000)), ttl=env_float('NOT_FOUND_CACHE_TTL', 5))
+
+
+class SingleFlight:
+    """Runs one call at a time per key. Callers with the same key as a call in flight wait for its result."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        # Calls that ran, and calls that shared the result of one in flight, by the first element of their key.
+        self.runs: dict[str, int] = {}
+        self.collapsed: dict[str, int] = {}
+
+    def do(self, key: tuple, call: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            counts = self.runs if leader else self.collapsed
+            counts[key[0]] = counts.get(key[0], 0) + 1
+        if not leader:
+            return future.result()
+        try:
+            result = call()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {name: {'queries': self.runs.get(name, 0), 'collapsed': self.collapsed.get(name, 0)}
+                    for name in sorted(self.runs.keys() | self.collapsed.keys())}
+
+
+flights = SingleFlight()
+
+
+def is_not_found(error: FaunaError) -> bool:
+    return error.code == 'document_not_found' or error.abort == queries.CUSTOMER_NOT_FOUND
+
+
+def read_shared(document: tuple, read: Callable[[], T], part: Hashable = None) -> T:
+    """
+    Run a read of a document, sharing it with identical reads in flight on other threads.
+    :param document: The kind of document and the values that identify it, e.g. ('customer', 'email', email).
+    :param read: Runs the query.
+    :param part: What is read, if there are several reads of the document, e.g. the fields of a sparse read.
+    :return: The result of read.
+    :raises FaunaError: The error of read, or the not-found error of a recent read of the same document.
+    """
+    not_found = not_found_cache.get(document)
+    if not_found is not None:
+        # Drop the traceback of the earlier request, so it isn't extended by every request that raises it.
+        raise not_found.with_traceback(None)
+    try:
+        return flights.do(document + (part,), read)
+    except FaunaError as e:
+        if is_not_found(e):
+            not_found_cache.set(document, e)
+        raise
+
+
+def forget_not_found(document: tuple) -> None:
+    """Forget that a document didn't exist, once it's been created."""
+    not_found_cache.invalidate(document)
@@ -0,0 +1,84 @@
+"""
+Conditional GETs (ETag and If-None-Match) for a single product, order or customer.
+
+The ETag of a response is a digest of its version, the timestamps (`ts`) of every document its projection read, and
+of the fields it was narrowed to. When a request carries If-None-Match, the route first runs the `*_timestamps` probe
+in `queries.py`, which reads the same documents but projects nothing. If the client's ETag still matches, the route
+answers 304 Not Modified without running the full query or serializing a body.
+"""
+import hashlib
+import json
+from typing import Any, Callable, FrozenSet, Optional
+
+from fauna.query import Query
+from flask import Response, jsonify, request
+from werkzeug.datastructures import ETags
+
+from ecommerce_app.coalescing import read_shared
+
+
+def version_of(timestamps: Any) -> str:
+    """A short digest of the timestamps returned by a `*_timestamps` query, or the version of a full query."""
+    encoded = json.dumps(timestamps, default=str, separators=(',', ':'))
+    return hashlib.blake2b(encoded.encode(), digest_size=12).hexdigest()
+
+
+def etag(version: str, fields: Optional[FrozenSet[str]] = None) -> str:
+    """The ETag of a response with the given version, narrowed to fields if it was. Narrower responses differ."""
+    if fields is None:
+        return version
+    return hashlib.blake2b(f"{version}:{','.join(sorted(fields))}".encode(), digest_size=12).hexdigest()
+
+
+def versioned(result: dict) -> dict:
+    """Replace the timestamps in the {version, data} result of a full query with their digest."""
+    return {'version': version_of(result['version']), 'data': result['data']}
+
+
+def read_if_modified(client: Any, if_none_match: ETags, probe: Query, load: Query,
+                     fields: Optional[FrozenSet[str]] = None,
+                     document: Optional[tuple] = None) -> tuple[str, Optional[Any]]:
+    """
+    Read a document for a conditional GET.
+    :param client: The Fauna client to query with.
+    :param if_none_match: The ETags of the client's copies, if it sent any.
+    :param probe: The `*_timestamps` query for the document, only run if the client sent If-None-Match.
+    :param load: The full query for the document, which returns {version, data}.
+    :param fields: The fields the response is narrowed to, if any.
+    :param document: Identifies the document, to share both queries with identical reads in flight (see
+                     `coalescing.read_shared`). If None, they aren't shared.
+    :return: The ETag, and the data, which is None if the client's copy is current.
+    """
+    def query(fql: Query, part: Any) -> Any:
+        if document is None:
+            return client.query(fql).data
+        return read_shared(document, lambda: client.query(fql).data, part)
+
+    if if_none_match:
+        tag = etag(version_of(query(probe, 'timestamps')), fields)
+        if if_none_match.contains_weak(tag):
+            return tag, None
+    result = versioned(query(load, fields))
+    return etag(result['version'], fields), result['data']
+
+
+async def aread_if_modified(client: Any, if_none_match: ETags, probe: Query, load: Query,
+                            fields: Optional[FrozenSet[str]] = None) -> tuple[str, Optional[Any]]:
+    """The same as read_if_modified, with an async client."""
+    if if_none_match:
+        tag = etag(version_of((await client.query(probe)).data), fields)
+        if if_none_match.contains_weak(tag):
+            return tag, None
+    result = versioned((await client.query(load)).data)
+    return etag(result['version'], fields), result['data']
+
+
+def etag_response(tag: str, body: Callable[[], Any]) -> Response:
+    """
+    The JSON response of a conditional GET, with its ETag. If the request's If-None-Match has the ETag, answer 304
+    Not Modified instead, without calling body.
+    """
+    response = Response(status=304) if request.if_none_match.contains_weak(tag) else jsonify(body())
+    # Weak, since the same version may be sent with a different encoding or formatting.
+    response.set_etag(tag, weak=True)
+    return response
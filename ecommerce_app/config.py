@@ -0,0 +1,17 @@
+"""Helpers for reading the app's settings from environment variables."""
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes') if value else default
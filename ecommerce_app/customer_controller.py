@@ -1,32 +1,49 @@
 import dataclasses
+from typing import Any, Optional
 
 from flask import jsonify, request
-from fauna import fql
-from fauna.client import Client
-from fauna.errors import FaunaException
+from fauna.client import QueryOptions
 from fauna.encoding import QuerySuccess
-import urllib.parse
 
-from ecommerce_app.models.customer import Address, customer_response
-from ecommerce_app.models.order import order_response
+from ecommerce_app import queries
+from ecommerce_app.cache import order_cache
+from ecommerce_app.coalescing import forget_not_found
+from ecommerce_app.fauna_client import client
+from ecommerce_app.models.customer import Address
 
-# Initialize Fauna client
-client = Client(typecheck=False)
+# Customer queries are run with typechecking disabled.
+query_options = QueryOptions(typecheck=False)
 
+# The most items a single batch cart request may add or update.
+MAX_CART_ITEMS = 100
 
-def create_customer():
-    customer_data = request.get_json()
+
+def missing_customer_fields(customer_data: dict[str, Any]) -> Optional[set]:
+    """Return the required customer (or address) fields missing from a request body, or None if it's complete."""
     required = set(('name', 'email', 'address'))
     difference = required - set(customer_data.keys())
     if difference:
-        return jsonify({'message': f'Missing required field(s) {difference}'}), 400
+        return difference
     try:
         Address(**customer_data['address'])
     except TypeError:
-        diff = set([field.name for field in dataclasses.fields(Address)]) - set(customer_data['address'].keys())
-        return jsonify({'message': f'Missing required field(s) {diff}'})
-    success = client.query(fql('let customer = Customer.create(${newCustomer})\n${customerResponse}',
-                               newCustomer=customer_data, customerResponse=customer_response()))
+        return set([field.name for field in dataclasses.fields(Address)]) - set(customer_data['address'].keys())
+    return None
+
+
+def customer_document(customer_id: str, key: Optional[str]) -> tuple:
+    """Identifies a customer read for coalescing.read_shared. Reads by email and by id are told apart."""
+    return 'customer', 'email' if key == 'email' else 'id', customer_id
+
+
+def create_customer():
+    customer_data = request.get_json()
+    difference = missing_customer_fields(customer_data)
+    if difference:
+        return jsonify({'message': f'Missing required field(s) {difference}'}), 400
+    success = client.query(queries.create_customer(customer_data), query_options)
+    # A lookup by email may have just found no customer.
+    forget_not_found(customer_document(customer_data['email'], 'email'))
     return jsonify(success.data), 201
 
 
@@ -40,27 +57,55 @@ def add_item_to_cart(customer_id):
     if not product_name or quantity is None:
         return jsonify({'message': 'Missing product name or quantity.'}), 400
 
-    # Construct the FQL query to add or update the cart item
-    query = fql("let order = createOrUpdateCartItem(${customerId}, ${productName}, ${quantity})\n${orderResponse}",
-        customerId=customer_id, productName=product_name, quantity=quantity, orderResponse=order_response()
-    )
-
     # Execute the query
-    res: QuerySuccess = client.query(query)
+    res: QuerySuccess = client.query(queries.add_item_to_cart(customer_id, product_name, quantity), query_options)
+    # This process serves its own writes fresh, without waiting for the change feed.
+    order_cache.invalidate(res.data['id'])
 
     # Return the updated cart as JSON
     return jsonify(res.data), 200
 
 
-def get_or_create_cart(customer_id: str):
-    # Build the FQL query to get or create the cart for the customer
-    query = fql(" let order = getOrCreateCart(${customerId}) ${orderResponse}",
-        customerId=customer_id, orderResponse=order_response())
+def parse_cart_items(data: Any) -> tuple[Optional[list[dict[str, Any]]], Optional[str]]:
+    """
+    Validate the items of a batch cart request.
+    :param data: The request body, with an `items` list of {productName, quantity} objects.
+    :return: The items to apply and None, or None and an error message. If a product is listed more than once,
+             the last quantity wins, as it would with one request per item.
+    """
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, 'Request body must have a non-empty list of items.'
+    if len(items) > MAX_CART_ITEMS:
+        return None, f'At most {MAX_CART_ITEMS} items can be updated at once.'
+    quantities = {}
+    for index, item in enumerate(items):
+        product_name = item.get('productName') if isinstance(item, dict) else None
+        quantity = item.get('quantity') if isinstance(item, dict) else None
+        # JSON true and false are ints in Python.
+        if not product_name or isinstance(quantity, bool) or not isinstance(quantity, int):
+            return None, f'Missing product name or quantity for item {index}.'
+        quantities.pop(product_name, None)
+        quantities[product_name] = quantity
+    return [{'productName': name, 'quantity': quantity} for name, quantity in quantities.items()], None
+
+
+def add_items_to_cart(customer_id: str):
+    # Validate the whole batch before sending it to Fauna
+    items, message = parse_cart_items(request.get_json(silent=True))
+    if message:
+        return jsonify({'message': message}), 400
+
+    # Apply every item in one query. Items that can't be applied are reported in `errors`, the rest are applied.
+    res: QuerySuccess = client.query(queries.add_items_to_cart(customer_id, items), query_options)
+    order_cache.invalidate(res.data['cart']['id'])
+    return jsonify(res.data), 200
+
 
+def get_or_create_cart(customer_id: str):
     # Execute the query
-    res: QuerySuccess = client.query(query)
+    res: QuerySuccess = client.query(queries.get_or_create_cart(customer_id), query_options)
     cart = res.data
 
     # Return the cart as JSON
     return jsonify(cart), 200
-
@@ -0,0 +1,24 @@
+from typing import Any, Tuple
+
+from fauna.errors import FaunaError
+
+
+def fauna_error_response(exc: FaunaError, path: str) -> Tuple[Any, int]:
+    """Map a FaunaError to the JSON body and status code returned to the client, shared by the sync and async apps."""
+    err_dict = {'http_status': exc.status_code, 'code': exc.code, 'message': exc.message}
+    if exc.code == 'document_not_found':
+        return {"message": f"Document not found at {path}", "status_code": 404}, 404
+    if hasattr(exc, 'summary'):
+        err_dict['summary'] = exc.summary
+    if exc.constraint_failures:
+        constraint_failures = []
+        for cf in exc.constraint_failures:
+            failure = {'message': cf.message, 'paths': cf.paths }
+            if cf.name:
+                failure['name'] = cf.name
+            constraint_failures.append(failure)
+        return constraint_failures, 409
+    if exc.abort:
+        return {'message': exc.abort, 'status_code': exc.status_code}, exc.status_code
+
+    return err_dict, exc.status_code
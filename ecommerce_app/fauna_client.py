@@ -0,0 +1,387 @@
+"""
+The shared Fauna client used by every controller and blueprint.
+
+One client (and so one HTTP connection pool) is created per process. Pool size, keep-alive, the per-request timeout
+budget and retry behaviour are configured with environment variables, see `ClientConfig.from_env`. The client is built
+the first time it's used rather than on import, see `LazyFaunaClient`.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass, replace
+from datetime import timedelta
+from typing import Any, Callable, Optional
+
+import httpx
+from fauna.client import Client, Header, QueryOptions
+from fauna.client.headers import _Auth, _DriverEnvironment, _Header
+from fauna.client.utils import LastTxnTs, _Environment
+from fauna.encoding import FaunaDecoder, FaunaEncoder, QueryStats, QuerySuccess, QueryTags
+from fauna.errors import ClientError, ContendedTransactionError, FaunaError, FaunaException, NetworkError, \
+    ProtocolError, ServiceTimeoutError, ThrottlingError
+from fauna.http.httpx_client import HTTPXClient
+from fauna.query import Query
+
+from ecommerce_app import metrics
+from ecommerce_app.config import env_float, env_int
+
+# Status codes that mean Fauna is shedding load, and that are safe to retry after backing off.
+RETRYABLE_STATUS_CODES = (429, 503)
+# Errors that are safe to retry after backing off. A contended transaction (409) wasn't applied.
+RETRYABLE_ERRORS = (ThrottlingError, ServiceTimeoutError, ProtocolError, ContendedTransactionError)
+
+
+@dataclass
+class ClientConfig:
+    # Maximum number of open connections to Fauna, and how many of them may stay idle in the pool.
+    max_connections: int = 20
+    max_keepalive_connections: int = 20
+    # Seconds an idle connection is kept alive before it is closed.
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 5.0
+    # Total time in seconds one call to `FaunaClient.query` may take, including retries.
+    request_timeout: float = 10.0
+    max_attempts: int = 3
+    # Attempts for a write that contends with other transactions, e.g. many checkouts of the same product.
+    max_contention_attempts: int = 5
+    # Retries use exponential backoff with full jitter, starting at base_backoff and capped at max_backoff seconds.
+    base_backoff: float = 0.05
+    max_backoff: float = 1.0
+
+    @classmethod
+    def from_env(cls) -> 'ClientConfig':
+        defaults = cls()
+        return cls(
+            max_connections=env_int('FAUNA_POOL_MAX_CONNECTIONS', defaults.max_connections),
+            max_keepalive_connections=env_int('FAUNA_POOL_MAX_KEEPALIVE', defaults.max_keepalive_connections),
+            keepalive_expiry=env_float('FAUNA_POOL_KEEPALIVE_EXPIRY', defaults.keepalive_expiry),
+            connect_timeout=env_float('FAUNA_CONNECT_TIMEOUT', defaults.connect_timeout),
+            request_timeout=env_float('FAUNA_REQUEST_TIMEOUT', defaults.request_timeout),
+            max_attempts=env_int('FAUNA_MAX_ATTEMPTS', defaults.max_attempts),
+            max_contention_attempts=env_int('FAUNA_MAX_CONTENTION_ATTEMPTS', defaults.max_contention_attempts),
+            base_backoff=env_float('FAUNA_BASE_BACKOFF', defaults.base_backoff),
+            max_backoff=env_float('FAUNA_MAX_BACKOFF', defaults.max_backoff),
+        )
+
+
+class PoolStats:
+    """
+    Thread-safe counters for the connection pool. A hit is a request served on an already open connection, a miss is
+    a request that had to open (and handshake) a new one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.retries = 0
+
+    def record_request(self, opened_connection: bool):
+        with self._lock:
+            if opened_connection:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'retries': self.retries}
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """An HTTP transport that uses the httpcore trace hook to see whether each request opened a new connection."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        opened = []
+
+        def trace(event_name: str, info: dict):
+            if event_name == 'connection.connect_tcp.started':
+                opened.append(True)
+
+        request.extensions['trace'] = trace
+        try:
+            return super().handle_request(request)
+        finally:
+            self._stats.record_request(bool(opened))
+
+
+def _pool_limits(config: ClientConfig) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.max_connections,
+        max_keepalive_connections=config.max_keepalive_connections,
+        keepalive_expiry=config.keepalive_expiry,
+    )
+
+
+def _retry_reason(err: FaunaException) -> Optional[str]:
+    """Why a failed query may be retried, as labelled in metrics, or None if it shouldn't be."""
+    if isinstance(err, ContendedTransactionError):
+        return 'contention'
+    if getattr(err, 'status_code', None) in RETRYABLE_STATUS_CODES:
+        return 'throttled'
+    return None
+
+
+def _retry_delay(config: ClientConfig, err: FaunaException, attempt: int, deadline: float) -> Optional[float]:
+    """
+    How long to back off before retrying a failed query, or None if it shouldn't be retried: the error isn't a
+    429/503 or a contended transaction, config.max_attempts (or max_contention_attempts) is reached, or the next
+    attempt would overrun the request's timeout budget.
+    """
+    reason = _retry_reason(err)
+    max_attempts = config.max_contention_attempts if reason == 'contention' else config.max_attempts
+    if reason is None or attempt >= max_attempts:
+        return None
+    delay = random.uniform(0, min(config.max_backoff, config.base_backoff * 2 ** (attempt - 1)))
+    if time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def _with_budget(opts: Optional[QueryOptions], remaining: float) -> QueryOptions:
+    """Cap the query timeout sent to Fauna at whatever remains of the request's budget."""
+    budget = timedelta(seconds=max(remaining, 0.001))
+    if opts is None:
+        return QueryOptions(query_timeout=budget)
+    if opts.query_timeout is not None and opts.query_timeout < budget:
+        return opts
+    return replace(opts, query_timeout=budget)
+
+
+def _with_template_tag(opts: Optional[QueryOptions], fql: Query) -> Optional[QueryOptions]:
+    """Tag a query with the name of the queries.py function that built it, which shows up in Fauna's query logs."""
+    template = getattr(fql, 'template', None)
+    if template is None:
+        return opts
+    if opts is None:
+        return QueryOptions(query_tags={'template': template})
+    return replace(opts, query_tags={**(opts.query_tags or {}), 'template': template})
+
+
+class FaunaClient:
+    """
+    Wraps `fauna.client.Client` with a tuned connection pool, a timeout budget and retries on throttling and
+    contention.
+    """
+
+    def __init__(self, config: ClientConfig):
+        self.config = config
+        self.pool_stats = PoolStats()
+        transport = _CountingTransport(self.pool_stats, http1=True, http2=False, limits=_pool_limits(config))
+        http_client = httpx.Client(transport=transport, timeout=httpx.Timeout(
+            config.request_timeout, connect=config.connect_timeout))
+        # Retries are handled here rather than by the driver, so they count against the request's timeout budget.
+        self._client = Client(http_client=HTTPXClient(http_client), max_attempts=1)
+
+    def query(self, fql: Query, opts: Optional[QueryOptions] = None) -> QuerySuccess:
+        """
+        Run a query, retrying with jittered exponential backoff when Fauna responds with 429 or 503, or the transaction
+        contends with another. Retries stop once config.max_attempts (config.max_contention_attempts for contention) is
+        reached or the next attempt would overrun config.request_timeout.
+        Every query is recorded in `metrics`.
+        """
+        started = time.perf_counter()
+        try:
+            success = self._query_with_retries(fql, _with_template_tag(opts, fql))
+        except FaunaException as err:
+            metrics.record_query(fql, time.perf_counter() - started, error=err)
+            raise
+        metrics.record_query(fql, time.perf_counter() - started, success.stats)
+        return success
+
+    def _query_with_retries(self, fql: Query, opts: Optional[QueryOptions]) -> QuerySuccess:
+        deadline = time.monotonic() + self.config.request_timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self._client.query(fql, _with_budget(opts, deadline - time.monotonic()))
+            except RETRYABLE_ERRORS as err:
+                delay = _retry_delay(self.config, err, attempt, deadline)
+                if delay is None:
+                    raise
+                self.pool_stats.record_retry()
+                metrics.record_retry(fql, _retry_reason(err))
+                time.sleep(delay)
+
+
+class AsyncFaunaClient:
+    """
+    A non-blocking counterpart of FaunaClient, used by the async app in `asgi.py`.
+    The driver only ships a blocking transport, so this sends the driver's encoded query over an aiohttp session and
+    decodes the response with the driver's own decoder and error types. aiohttp is an optional dependency, see
+    requirements-async.txt.
+    """
+
+    def __init__(self, config: ClientConfig, endpoint: Optional[str] = None, secret: Optional[str] = None):
+        self.config = config
+        self.pool_stats = PoolStats()
+        self._endpoint = (endpoint or _Environment.EnvFaunaEndpoint()).rstrip('/')
+        self._auth = _Auth(secret if secret is not None else _Environment.EnvFaunaSecret())
+        self._last_txn_ts = LastTxnTs()
+        self._headers = {
+            _Header.AcceptEncoding: 'gzip',
+            _Header.ContentType: 'application/json;charset=utf-8',
+            _Header.Driver: 'python',
+            _Header.DriverEnv: str(_DriverEnvironment()),
+            _Header.Format: 'tagged',
+        }
+        # The session has to be created on the event loop that uses it, so it's opened by the first query.
+        self._session = None
+
+    def _open_session(self):
+        import aiohttp
+
+        async def on_reuse(session, context, params):
+            self.pool_stats.record_request(opened_connection=False)
+
+        async def on_create(session, context, params):
+            self.pool_stats.record_request(opened_connection=True)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        trace_config.on_connection_create_end.append(on_create)
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.config.max_connections,
+                                           keepalive_timeout=self.config.keepalive_expiry),
+            timeout=aiohttp.ClientTimeout(total=self.config.request_timeout, connect=self.config.connect_timeout),
+            trace_configs=[trace_config])
+
+    async def query(self, fql: Query, opts: Optional[QueryOptions] = None) -> QuerySuccess:
+        """Run a query without blocking the event loop. Retries and metrics behave as in `FaunaClient.query`."""
+        started = time.perf_counter()
+        try:
+            success = await self._query_with_retries(fql, _with_template_tag(opts, fql))
+        except FaunaException as err:
+            metrics.record_query(fql, time.perf_counter() - started, error=err)
+            raise
+        metrics.record_query(fql, time.perf_counter() - started, success.stats)
+        return success
+
+    async def _query_with_retries(self, fql: Query, opts: Optional[QueryOptions]) -> QuerySuccess:
+        deadline = time.monotonic() + self.config.request_timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self._query(fql, _with_budget(opts, deadline - time.monotonic()))
+            except RETRYABLE_ERRORS as err:
+                delay = _retry_delay(self.config, err, attempt, deadline)
+                if delay is None:
+                    raise
+                self.pool_stats.record_retry()
+                metrics.record_retry(fql, _retry_reason(err))
+                await asyncio.sleep(delay)
+
+    async def _query(self, fql: Query, opts: QueryOptions) -> QuerySuccess:
+        import aiohttp
+
+        try:
+            encoded = FaunaEncoder.encode(fql)
+        except Exception as e:
+            raise ClientError("Failed to encode Query") from e
+
+        headers = {**self._headers, _Header.Authorization: self._auth.bearer(), **self._last_txn_ts.request_header}
+        if opts.query_timeout is not None:
+            headers[Header.QueryTimeoutMs] = str(int(opts.query_timeout.total_seconds() * 1000))
+        if opts.typecheck is not None:
+            headers[Header.Typecheck] = str(opts.typecheck).lower()
+        if opts.linearized is not None:
+            headers[Header.Linearized] = str(opts.linearized).lower()
+        if opts.max_contention_retries is not None:
+            headers[Header.MaxContentionRetries] = str(opts.max_contention_retries)
+        if opts.traceparent is not None:
+            headers[Header.Traceparent] = opts.traceparent
+        if opts.query_tags:
+            headers[Header.Tags] = QueryTags.encode(opts.query_tags)
+        if opts.additional_headers is not None:
+            headers.update(opts.additional_headers)
+
+        if self._session is None:
+            self._session = self._open_session()
+        try:
+            async with self._session.post(self._endpoint + '/query/1', headers=headers,
+                                          data=json.dumps({'query': encoded, 'arguments': {}})) as response:
+                status_code = response.status
+                response_headers = response.headers
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise NetworkError("Exception re-raised from HTTP request") from e
+
+        try:
+            body = json.loads(text)
+        except ValueError:
+            raise ProtocolError(status_code, text)
+        if status_code > 399 and 'error' not in body or status_code <= 399 and 'data' not in body:
+            raise ProtocolError(status_code, text)
+
+        decoded = FaunaDecoder.decode(body)
+        if status_code > 399:
+            FaunaError.parse_error_and_throw(decoded, status_code)
+        if 'txn_ts' in decoded:
+            self._last_txn_ts.update_txn_time(int(body['txn_ts']))
+
+        return QuerySuccess(
+            data=decoded['data'],
+            query_tags=QueryTags.decode(decoded['query_tags']) if 'query_tags' in decoded else None,
+            static_type=decoded.get('static_type'),
+            stats=QueryStats(decoded['stats']) if 'stats' in decoded else None,
+            summary=decoded.get('summary'),
+            traceparent=response_headers.get('traceparent'),
+            txn_ts=decoded.get('txn_ts'),
+            schema_version=decoded.get('schema_version'),
+        )
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class LazyFaunaClient:
+    """
+    Stands in for a FaunaClient that is built the first time it's used. Building one reads its configuration from the
+    environment, creates the TLS context and imports the HTTP transport behind the pool, which is about a third of
+    the app's import time. Importing the app stays quick, and `ecommerce_app.warmup` can build the client and open its
+    connections before the first request instead of during it.
+    """
+
+    def __init__(self, build: Callable[[], FaunaClient]):
+        self._build = build
+        self._client: Optional[FaunaClient] = None
+        self._lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._client is not None
+
+    def get(self) -> FaunaClient:
+        """The client, built by whichever thread asks first."""
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._build()
+                client = self._client
+        return client
+
+    def query(self, fql: Query, opts: Optional[QueryOptions] = None) -> QuerySuccess:
+        return self.get().query(fql, opts)
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything else, e.g. pool_stats and config, is the built client's.
+        return getattr(self.get(), name)
+
+
+# The shared Fauna client
+client = LazyFaunaClient(lambda: FaunaClient(ClientConfig.from_env()))
@@ -0,0 +1,59 @@
+"""
+Embedding related documents in a read (the `include=` query parameter), so a client gets them in one request.
+
+`GET /customers/<id>?include=cart,orders,orders.items` returns the customer with its cart and its latest orders, and
+`GET /orders/<id>?include=customer` returns the order with its full customer. Each is one FQL query, built in
+`queries.py` from the same projections as the separate routes. An include path is at most MAX_INCLUDE_DEPTH levels
+deep, and only the paths in a route's allowed set are accepted. Embedded orders are limited to ordersPageSize (at
+most MAX_INCLUDED_ORDERS), and the rest are paged with GET /customers/<id>/orders.
+"""
+from typing import FrozenSet, Optional
+
+from ecommerce_app.config import env_int
+
+# The most levels of an include path, e.g. orders.items is 2.
+MAX_INCLUDE_DEPTH = 2
+# How many orders are embedded by default, and the most that can be asked for.
+INCLUDED_ORDERS = env_int('INCLUDED_ORDERS', 5)
+MAX_INCLUDED_ORDERS = env_int('MAX_INCLUDED_ORDERS', 20)
+
+# The include paths each route accepts.
+CUSTOMER_INCLUDES = frozenset(('cart', 'orders', 'orders.items'))
+ORDER_INCLUDES = frozenset(('customer',))
+
+
+class InvalidIncludesError(ValueError):
+    """Raised when include names a path the route doesn't accept, or ordersPageSize is out of range."""
+    pass
+
+
+def parse_includes(allowed: FrozenSet[str], value: Optional[str]) -> Optional[FrozenSet[str]]:
+    """
+    Parse a comma separated `include` query parameter.
+    :return: The include paths, with the parent of each nested path (orders.items includes orders), or None if no
+             includes were asked for.
+    :raises InvalidIncludesError: If a path is too deep or isn't in allowed.
+    """
+    if not value:
+        return None
+    includes = set()
+    for path in (path.strip() for path in value.split(',')):
+        if not path:
+            continue
+        parts = path.split('.')
+        if len(parts) > MAX_INCLUDE_DEPTH:
+            raise InvalidIncludesError(f'Include {path!r} is more than {MAX_INCLUDE_DEPTH} levels deep.')
+        if path not in allowed:
+            raise InvalidIncludesError(f'Unknown include {path!r}, valid includes are {sorted(allowed)}')
+        includes.update('.'.join(parts[:depth]) for depth in range(1, len(parts) + 1))
+    return frozenset(includes) or None
+
+
+def parse_orders_page_size(value: Optional[str]) -> int:
+    """Parse the ordersPageSize query parameter, the number of orders embedded by include=orders."""
+    if value is None:
+        return min(INCLUDED_ORDERS, MAX_INCLUDED_ORDERS)
+    if not value.isdigit() or not 1 <= int(value) <= MAX_INCLUDED_ORDERS:
+        raise InvalidIncludesError(f'ordersPageSize must be a number from 1 to {MAX_INCLUDED_ORDERS}.')
+    return int(value)
+
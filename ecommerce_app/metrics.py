@@ -0,0 +1,253 @@
+"""
+Per-query instrumentation.
+
+Every query run by the shared clients in `fauna_client.py` is recorded here with its client wall time and the stats
+Fauna returns with it (compute, read and write ops, server query time and storage bytes). Queries are labelled with the
+blueprint and route of the request that ran them, and the name of the FQL template in `queries.py` that built them.
+The histograms are served in the Prometheus text format on GET /metrics. In debug mode, each response also carries
+the totals for its own queries in X-Fauna-* headers.
+"""
+import contextvars
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+from fauna.encoding import QueryStats
+from fauna.query import Query
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+OPS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+
+# The template of a query that wasn't built by a function in queries.py.
+UNNAMED_TEMPLATE = 'unnamed'
+
+
+def _label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_label_value(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """A Prometheus-style histogram, with one set of buckets per combination of label values."""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                labels = _labels(self.label_names + ('le',), label_values + (str(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {values[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter, with one value per combination of label values."""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+@dataclass
+class RequestMetrics:
+    """The labels of the current request, and the totals of the queries it has run so far."""
+    blueprint: str
+    route: str
+    queries: int = 0
+    wall_ms: float = 0
+    query_time_ms: int = 0
+    compute_ops: int = 0
+    read_ops: int = 0
+    write_ops: int = 0
+    retries: int = 0
+    templates: list[str] = field(default_factory=list)
+
+    def headers(self) -> dict[str, str]:
+        return {
+            'X-Fauna-Queries': str(self.queries),
+            'X-Fauna-Wall-Ms': f'{self.wall_ms:.1f}',
+            'X-Fauna-Query-Time-Ms': str(self.query_time_ms),
+            'X-Fauna-Compute-Ops': str(self.compute_ops),
+            'X-Fauna-Read-Ops': str(self.read_ops),
+            'X-Fauna-Write-Ops': str(self.write_ops),
+            'X-Fauna-Retries': str(self.retries),
+            'X-Fauna-Templates': ','.join(self.templates),
+        }
+
+
+_current_request: contextvars.ContextVar[Optional[RequestMetrics]] = \
+    contextvars.ContextVar('request_metrics', default=None)
+
+QUERY_LABELS = ('blueprint', 'route', 'template')
+
+query_duration = Histogram('fauna_query_duration_seconds',
+                           'Client wall time of a query, including retries.', QUERY_LABELS, DURATION_BUCKETS)
+query_server_time = Histogram('fauna_query_server_time_seconds',
+                              'Query time reported by Fauna.', QUERY_LABELS, DURATION_BUCKETS)
+query_compute_ops = Histogram('fauna_query_compute_ops', 'Compute ops per query.', QUERY_LABELS, OPS_BUCKETS)
+query_read_ops = Histogram('fauna_query_read_ops', 'Read ops per query.', QUERY_LABELS, OPS_BUCKETS)
+query_write_ops = Histogram('fauna_query_write_ops', 'Write ops per query.', QUERY_LABELS, OPS_BUCKETS)
+query_bytes_read = Histogram('fauna_query_storage_bytes_read', 'Storage bytes read per query.',
+                             QUERY_LABELS, BYTES_BUCKETS)
+query_bytes_written = Histogram('fauna_query_storage_bytes_write', 'Storage bytes written per query.',
+                                QUERY_LABELS, BYTES_BUCKETS)
+query_errors = Counter('fauna_query_errors_total', 'Queries that failed, by error type.', QUERY_LABELS + ('error',))
+query_retries = Counter('fauna_query_retries_total',
+                        'Queries retried, because Fauna was throttling (429 or 503) or the transaction contended.',
+                        QUERY_LABELS + ('reason',))
+queries_per_request = Histogram('fauna_queries_per_request', 'Queries run to serve one request.',
+                                ('blueprint', 'route'), COUNT_BUCKETS)
+
+HISTOGRAMS = (query_duration, query_server_time, query_compute_ops, query_read_ops, query_write_ops,
+              query_bytes_read, query_bytes_written)
+
+
+def start_request(blueprint: Optional[str], route: Optional[str]) -> RequestMetrics:
+    """Label the queries run from here on in this context (request, thread or task) with a blueprint and route."""
+    request_metrics = RequestMetrics(blueprint or '', route or '')
+    _current_request.set(request_metrics)
+    return request_metrics
+
+
+def current_request() -> Optional[RequestMetrics]:
+    return _current_request.get()
+
+
+def finish_request(request_metrics: Optional[RequestMetrics]):
+    if request_metrics is not None:
+        queries_per_request.observe((request_metrics.blueprint, request_metrics.route), request_metrics.queries)
+
+
+def record_query(query: Query, wall_seconds: float, stats: Optional[QueryStats] = None,
+                 error: Optional[Exception] = None):
+    """Record one query, with its stats if it succeeded or its error if it didn't."""
+    template = getattr(query, 'template', UNNAMED_TEMPLATE)
+    request_metrics = _current_request.get()
+    labels = (request_metrics.blueprint, request_metrics.route, template) if request_metrics else ('', '', template)
+    query_duration.observe(labels, wall_seconds)
+    if error is not None:
+        query_errors.inc(labels + (type(error).__name__,))
+    if stats is not None:
+        query_server_time.observe(labels, stats.query_time_ms / 1000)
+        query_compute_ops.observe(labels, stats.compute_ops)
+        query_read_ops.observe(labels, stats.read_ops)
+        query_write_ops.observe(labels, stats.write_ops)
+        query_bytes_read.observe(labels, stats.storage_bytes_read)
+        query_bytes_written.observe(labels, stats.storage_bytes_write)
+    if request_metrics is not None:
+        request_metrics.queries += 1
+        request_metrics.wall_ms += wall_seconds * 1000
+        request_metrics.templates.append(template)
+        if stats is not None:
+            request_metrics.query_time_ms += stats.query_time_ms
+            request_metrics.compute_ops += stats.compute_ops
+            request_metrics.read_ops += stats.read_ops
+            request_metrics.write_ops += stats.write_ops
+
+
+def record_retry(query: Query, reason: str):
+    """Record that a query is being retried, e.g. after a throttling or contention error."""
+    template = getattr(query, 'template', UNNAMED_TEMPLATE)
+    request_metrics = _current_request.get()
+    labels = (request_metrics.blueprint, request_metrics.route, template) if request_metrics else ('', '', template)
+    query_retries.inc(labels + (reason,))
+    if request_metrics is not None:
+        request_metrics.retries += 1
+
+
+def stats_counters(pool_stats: dict, cache_stats: dict[str, dict]) -> list[Counter]:
+    """The connection pool and cache counts served on /stats/pool and /stats/cache, as counters."""
+    pool = Counter('fauna_pool_requests_total', 'Requests to Fauna, by whether they reused a pooled connection.',
+                   ('result',))
+    pool.inc(('hit',), pool_stats['hits'])
+    pool.inc(('miss',), pool_stats['misses'])
+    cache = Counter('cache_requests_total', 'Cache lookups, by cache and result.', ('cache', 'result'))
+    evictions = Counter('cache_evictions_total', 'Entries evicted to make room, by cache.', ('cache',))
+    for name, stats in cache_stats.items():
+        for result in ('hits', 'misses', 'staleHits'):
+            cache.inc((name, result), stats[result])
+        evictions.inc((name,), stats['evictions'])
+    return [pool, cache, evictions]
+
+
+def coalescing_counters(flight_stats: dict[str, dict]) -> list[Counter]:
+    """The single-flight counts served on /stats/coalescing, as counters."""
+    reads = Counter('fauna_coalesced_reads_total',
+                    'Reads of one document, by whether they ran a query or shared one already in flight.',
+                    ('document', 'result'))
+    for document, stats in flight_stats.items():
+        reads.inc((document, 'query'), stats['queries'])
+        reads.inc((document, 'collapsed'), stats['collapsed'])
+    return [reads]
+
+
+def admission_counters(admission_stats: dict[str, Any]) -> list[Counter]:
+    """The admission counts served on /stats/admission, as counters."""
+    admitted = Counter('admission_requests_admitted_total', 'Requests let in, by priority class.', ('priority',))
+    for priority, count in admission_stats['admitted'].items():
+        admitted.inc((priority,), count)
+    rejected = Counter('admission_requests_rejected_total',
+                       'Requests turned away with a 503, by priority class and why.', ('priority', 'reason'))
+    for key, count in admission_stats['rejected'].items():
+        rejected.inc(tuple(key.split(':')), count)
+    decreases = Counter('admission_limit_decreases_total',
+                        'Times the concurrency limit shrank, after throttling or a rise in query latency.', ())
+    decreases.inc((), admission_stats['decreases'])
+    return [admitted, rejected, decreases]
+
+
+def render(extra: Iterable[Counter] = ()) -> str:
+    """All the query metrics, and any extra counters, in the Prometheus text format."""
+    lines = []
+    for metric in HISTOGRAMS + (query_errors, query_retries, queries_per_request) + tuple(extra):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,10 +1,11 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import FrozenSet, Optional
 
-from fauna import Document, fql
+from fauna import fql
 from fauna.query import Query
 
 from ecommerce_app.models.order import Order
+from ecommerce_app.models.projections import projection, register
 
 
 @dataclass
@@ -25,6 +26,18 @@ class Customer:
     cart: Optional[Order]
 
 
-def customer_response() -> Query:
-    return fql("{id: customer.id, name: customer?.name, email: customer?.email, address: customer?.address, cart: ${getCart}}",
-               getCart=fql('if (customer?.cart != null) {id: customer?.cart?.id} else null'))
+register('customer_response', {
+    'id': 'customer.id',
+    'name': 'customer?.name',
+    'email': 'customer?.email',
+    'address': 'customer?.address',
+    'cart': '(if (customer?.cart != null) {id: customer?.cart?.id} else null)',
+})
+
+
+def customer_response(fields: Optional[FrozenSet[str]] = None) -> Query:
+    return projection('customer_response', fields)
+
+
+# What customer_response reads: the customer's timestamp, and the id of its cart, which is a computed field.
+CUSTOMER_TIMESTAMPS = fql('[customer.ts, customer?.cart?.id]')
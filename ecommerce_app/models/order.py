@@ -1,10 +1,13 @@
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+from typing import FrozenSet, Optional
 
 from fauna import fql
 from fauna.query import Query
 
+from ecommerce_app.models.projections import projection, register
+
 
 class Status(Enum):
     CART = "cart"
@@ -25,37 +28,67 @@ class Order:
     createdAt: datetime
 
 
-def order_summary() -> Query:
-    return fql("{id: order.id, status: order.status, createdAt: order.createdAt}")
-
-def order_response() -> Query:
-    return fql("""
-        {
-            id: order?.id,
-            payment: order?.payment,
-            createdAt: order?.createdAt.toString(),
-            status: order?.status,
-            total: order?.total,
-            items: order?.items.toArray().map(item => {
-                product: {
-                    id: item.product?.id,
-                    name: item.product?.name,
-                    price: item.product?.price,
-                    description: item.product?.description,
-                    stock: item.product?.stock,
-                    category: {
-                        id: item.product?.category?.id,
-                        name: item.product?.category?.name,
-                        description: item.product?.category?.description
-                    }
-                },
-                quantity: item.quantity
-            }),
-            customer: {
-                id: order?.customer?.id,
-                name: order?.customer?.name,
-                email: order?.customer?.email,
-                address: order?.customer?.address
+register('order_summary', {
+    'id': 'order.id',
+    'status': 'order.status',
+    'createdAt': 'order.createdAt',
+    # Stored on the order, so listing orders doesn't read their items.
+    'total': 'order.total',
+    'itemCount': 'order.itemCount',
+})
+
+register('order_response', {
+    'id': 'order?.id',
+    'payment': 'order?.payment',
+    'createdAt': 'order?.createdAt.toString()',
+    'status': 'order?.status',
+    'total': 'order?.total',
+    'itemCount': 'order?.itemCount',
+    'items': """order?.items.toArray().map(item => {
+        product: {
+            id: item.product?.id,
+            name: item.product?.name,
+            price: item.product?.price,
+            description: item.product?.description,
+            stock: item.product?.stock,
+            category: {
+                id: item.product?.category?.id,
+                name: item.product?.category?.name,
+                description: item.product?.category?.description
             }
-        }
-    """)
+        },
+        quantity: item.quantity
+    })""",
+    'customer': """{
+        id: order?.customer?.id,
+        name: order?.customer?.name,
+        email: order?.customer?.email,
+        address: order?.customer?.address
+    }""",
+})
+
+
+# A customer's OrderStats, as zeros if they haven't placed an order. Bound to `stats`, which may be null.
+register('order_stats_response', {
+    'orderCount': '(stats?.processing ?? 0) + (stats?.shipped ?? 0) + (stats?.delivered ?? 0)',
+    'ordersByStatus': '{ processing: stats?.processing ?? 0, shipped: stats?.shipped ?? 0, '
+                      'delivered: stats?.delivered ?? 0 }',
+    'lifetimeSpend': 'stats?.spend ?? 0',
+    'lastOrderAt': 'stats?.lastOrderAt',
+})
+
+
+def order_summary(fields: Optional[FrozenSet[str]] = None) -> Query:
+    return projection('order_summary', fields)
+
+
+def order_response(fields: Optional[FrozenSet[str]] = None) -> Query:
+    return projection('order_response', fields)
+
+
+# The timestamps of the documents order_response reads. The item ids are included, so removing an item changes them.
+ORDER_TIMESTAMPS = fql('''[
+    order.ts,
+    order.customer?.ts,
+    order.items.toArray().map(item => [item.id, item.ts, item.product?.ts, item.product?.category?.ts])
+]''')
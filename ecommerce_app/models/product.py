@@ -1,9 +1,11 @@
 from dataclasses import dataclass
+from typing import FrozenSet, Optional
 
 from fauna import fql
 from fauna.query import Query
 
 from ecommerce_app.models.category import Category
+from ecommerce_app.models.projections import projection, register
 
 
 @dataclass
@@ -16,6 +18,50 @@ class Product:
     category: Category
 
 
-def product_response() -> Query:
-    return fql("{id: product.id, name: product.name, description: product.description, stock: product.stock, price: product.price, category: ${category}}",
-               category=fql("if (product.category != null) {id: product.category?.id, name: product.category?.name} else null"))
+register('product_response', {
+    'id': 'product.id',
+    'name': 'product.name',
+    'description': 'product.description',
+    'stock': 'product.stock',
+    'price': 'product.price',
+    # Wrapped in parentheses so the if/else parses as one expression when inlined in the projection.
+    'category': '(if (product.category != null) {id: product.category?.id, name: product.category?.name} else null)',
+})
+
+
+def product_response(fields: Optional[FrozenSet[str]] = None) -> Query:
+    return projection('product_response', fields)
+
+
+# A product listed by price. Every field is a value of the price indexes (see schema/collections.fsl), so Fauna
+# answers from the index entries without reading the products. The category would need a read, so it's left out.
+register('product_price_row', {
+    'id': 'product.id',
+    'name': 'product.name',
+    'description': 'product.description',
+    'stock': 'product.stock',
+    'price': 'product.price',
+})
+
+
+def product_price_row(fields: Optional[FrozenSet[str]] = None) -> Query:
+    return projection('product_price_row', fields)
+
+
+# The timestamps of the documents product_response reads. Its response only changes when one of these does.
+PRODUCT_TIMESTAMPS = fql('[product.ts, product.category?.ts]')
+
+
+# One row of a catalog export. The category is flattened to its name, so an exported file can be imported again.
+register('product_row', {
+    'id': 'product.id',
+    'name': 'product.name',
+    'description': 'product.description',
+    'price': 'product.price',
+    'stock': 'product.stock',
+    'category': 'product.category?.name',
+})
+
+
+def product_row() -> Query:
+    return projection('product_row')
@@ -0,0 +1,83 @@
+"""
+A registry of the FQL projections that shape API responses.
+
+Each model registers its projection as a mapping of response field to FQL expression. The registry compiles it once
+into a single literal `Query`, with nested templates such as the category sub-query inlined, so requests reuse the same
+Query object and the driver encodes it as one string rather than re-building and re-encoding nested fragments.
+
+A projection can also be narrowed to a subset of its fields (the `fields=` query parameter), so Fauna only reads and
+returns what the client asked for. Each distinct field set is compiled once.
+"""
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from fauna import fql
+from fauna.query.query_builder import LiteralFragment, Query
+
+_fields: Dict[str, Dict[str, str]] = {}
+_compiled: Dict[Tuple[str, Optional[FrozenSet[str]]], Query] = {}
+
+
+class InvalidFieldsError(ValueError):
+    """Raised when a field selection names fields the projection doesn't have."""
+    pass
+
+
+def register(name: str, fields: Dict[str, str]) -> None:
+    """Register (or replace) the projection `name`. Field order is kept in the generated FQL object."""
+    _fields[name] = dict(fields)
+    for key in [key for key in _compiled if key[0] == name]:
+        del _compiled[key]
+
+
+def compile_fields(fields: Dict[str, str]) -> Query:
+    return Query([LiteralFragment('{' + ', '.join(f'{key}: {expr}' for key, expr in fields.items()) + '}')])
+
+
+def parse_fields(name: str, value: Optional[str]) -> Optional[FrozenSet[str]]:
+    """
+    Parse a comma separated `fields` query parameter for the projection `name`.
+    :return: The selected fields, or None when no selection was made.
+    :raises InvalidFieldsError: If a field isn't part of the projection.
+    """
+    if not value:
+        return None
+    fields = frozenset(field.strip() for field in value.split(',') if field.strip())
+    unknown = fields - _fields[name].keys()
+    if unknown or not fields:
+        raise InvalidFieldsError(f'Unknown field(s) {set(unknown)}, valid fields are {list(_fields[name])}')
+    return fields
+
+
+def field_names(name: str) -> list[str]:
+    """The fields of the projection `name`, in order."""
+    return list(_fields[name])
+
+
+def projection(name: str, fields: Optional[Iterable[str]] = None) -> Query:
+    """Return the compiled projection registered as `name`, narrowed to `fields` if given."""
+    key = (name, frozenset(fields) if fields is not None else None)
+    query = _compiled.get(key)
+    if query is None:
+        registered = _fields[name]
+        if key[1] is not None:
+            registered = {field: expr for field, expr in registered.items() if field in key[1]}
+        query = _compiled[key] = compile_fields(registered)
+    return query
+
+
+def expand(name: str, fields: Optional[Iterable[str]], embedded: Dict[str, Query]) -> Query:
+    """
+    The projection `name`, narrowed to `fields` if given, with more fields whose values are FQL, such as the
+    projection of a related document. An embedded field replaces the projection's field of the same name. These vary
+    with the request, so they aren't compiled ahead.
+    """
+    registered = {field: expr for field, expr in _fields[name].items()
+                  if (fields is None or field in fields) and field not in embedded}
+    entries = [f'{field}: {expr}' for field, expr in registered.items()] + [f'{key}: ${{{key}}}' for key in embedded]
+    return fql('{' + ', '.join(entries) + '}', **embedded)
+
+
+def preload() -> None:
+    """Compile every registered projection ahead of the first request."""
+    for name in _fields:
+        projection(name)
@@ -0,0 +1,177 @@
+"""
+Content negotiation: the format of a response body from the request's Accept header, and its compression from
+Accept-Encoding.
+
+JSON is the default. Internal services can ask for `application/msgpack` or `application/cbor`, which are smaller and
+quicker to decode. Timestamps are written as the format's own timestamp type. Other values JSON has no type for are
+written as they are in the JSON responses. Each format is only offered when its library (msgpack or cbor2) is
+installed, and the library is imported by the first response in its format, or by `preload`. `jsonify` answers in the
+negotiated format through `NegotiatingJSONProvider`, and pages through `page_response`.
+
+Bodies of at least COMPRESS_MIN_SIZE bytes are compressed with zstd when the client accepts it and zstandard is
+installed, or else with gzip. Smaller bodies aren't worth the CPU. Each thread keeps a zstd compressor and reuses it,
+so a response doesn't pay to set one up. Pages are streamed, so they're compressed as they're written.
+"""
+import dataclasses
+import importlib
+import threading
+import zlib
+from importlib.util import find_spec
+from itertools import chain
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from flask import Response, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import Accept, MIMEAccept
+
+from ecommerce_app.config import env_bool, env_int
+from ecommerce_app.serialization import dumps, json_default, page_chunks
+
+try:
+    import zstandard
+except ImportError:  # compress with gzip only if zstandard isn't installed
+    zstandard = None
+
+COMPRESSION = env_bool('COMPRESSION', True)
+COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 1024)
+GZIP_LEVEL = env_int('GZIP_LEVEL', 6)
+ZSTD_LEVEL = env_int('ZSTD_LEVEL', 3)
+
+JSON, MSGPACK, CBOR = 'application/json', 'application/msgpack', 'application/cbor'
+
+# The binary format libraries that are installed. They aren't imported until they're needed: loading cbor2's extension
+# alone takes about 20ms, on every start of a process that may never be asked for CBOR.
+BINARY_LIBRARIES = tuple(name for name in ('msgpack', 'cbor2') if find_spec(name) is not None)
+
+
+def _binary_default(value: Any) -> Any:
+    # Dataclasses as jsonify writes them, everything else as the JSON page responses do.
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    return json_default(value)
+
+
+def _msgpack(value: Any) -> bytes:
+    import msgpack
+    return msgpack.packb(value, default=_binary_default, datetime=True)
+
+
+def _cbor(value: Any) -> bytes:
+    import cbor2
+    return cbor2.dumps(value, default=lambda encoder, value: encoder.encode(_binary_default(value)))
+
+
+# The encoders of the formats offered, JSON first so it's chosen when the client accepts any of them equally.
+ENCODERS: dict[str, Callable[[Any], bytes]] = {JSON: dumps}
+if 'msgpack' in BINARY_LIBRARIES:
+    ENCODERS.update({MSGPACK: _msgpack, 'application/x-msgpack': _msgpack})
+if 'cbor2' in BINARY_LIBRARIES:
+    ENCODERS[CBOR] = _cbor
+
+CODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+_local = threading.local()
+
+
+def preload():
+    """Import the installed binary format libraries ahead of the first request for one of their formats."""
+    for name in BINARY_LIBRARIES:
+        importlib.import_module(name)
+
+
+def media_type(accept: MIMEAccept) -> str:
+    """The format to answer in: the one the client prefers of those offered, or JSON."""
+    return accept.best_match(ENCODERS) or JSON
+
+
+def encode(media: str, value: Any) -> bytes:
+    return ENCODERS[media](value)
+
+
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, except that `jsonify` answers in the format the request's Accept header asks for."""
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        media = media_type(request.accept_mimetypes) if has_request_context() else JSON
+        if media == JSON:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(encode(media, self._prepare_response_obj(args, kwargs)), mimetype=media)
+
+
+def page_response(data: list, after: Optional[str]) -> Response:
+    """A page of results as {data, next}: streamed as JSON, or in the format the request's Accept header asks for."""
+    media = media_type(request.accept_mimetypes)
+    if media == JSON:
+        return Response(page_chunks(data, after), mimetype=JSON)
+    return Response(encode(media, {'data': data, 'next': after}), mimetype=media)
+
+
+def content_coding(accept_encodings: Accept) -> Optional[str]:
+    """The compression to use: zstd if the client accepts it and it's installed, then gzip, or None."""
+    return accept_encodings.best_match(CODINGS) if COMPRESSION else None
+
+
+def _zstd_compressor() -> 'zstandard.ZstdCompressor':
+    compressor = getattr(_local, 'zstd', None)
+    if compressor is None:
+        compressor = _local.zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor
+
+
+def compress(body: bytes, coding: str) -> bytes:
+    if coding == 'zstd':
+        return _zstd_compressor().compress(body)
+    return zlib.compress(body, GZIP_LEVEL, wbits=31)
+
+
+def compress_chunks(chunks: Iterable[bytes], coding: str) -> Iterator[bytes]:
+    # A stream may be left unfinished if the client goes away, so it gets its own compressor, not the thread's.
+    if coding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def finish_response(response: Response, accept_encodings: Accept) -> Response:
+    """
+    Add the Vary headers of a response in a negotiated format, and compress its body if it's big enough.
+    :param response: The response, which is left alone unless it's a body in one of the formats in ENCODERS.
+    :param accept_encodings: The request's Accept-Encoding header.
+    :return: The response.
+    """
+    if response.mimetype not in ENCODERS or response.status_code in (204, 304) or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers:
+        return response
+    if len(ENCODERS) > 1:
+        response.vary.add('Accept')
+    if COMPRESSION:
+        response.vary.add('Accept-Encoding')
+    coding = content_coding(accept_encodings)
+    if coding is None:
+        return response
+    if response.is_streamed:
+        # Read the stream until it's big enough to compress. A short one is sent as it is.
+        chunks = iter(response.response)
+        head, size = [], 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= COMPRESS_MIN_SIZE:
+                break
+        else:
+            response.set_data(b''.join(head))
+            return response
+        response.response = compress_chunks(chain(head, chunks), coding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(body, coding))
+    response.headers['Content-Encoding'] = coding
+    return response
@@ -1,20 +1,37 @@
 from flask import jsonify, request
-from fauna import fql
-from fauna.client import Client
 from fauna.encoding import QuerySuccess
 
-from ecommerce_app.models.order import order_response
+from ecommerce_app import conditional, queries
+from ecommerce_app.cache import order_cache, product_cache
+from ecommerce_app.coalescing import read_shared
+from ecommerce_app.fauna_client import client
+from ecommerce_app.includes import ORDER_INCLUDES, parse_includes
+from ecommerce_app.models.projections import parse_fields
 
-# Initialize Fauna client
-client = Client()
 
 def get_order_by_id(order_id):
-    query = fql("let order = Order.byId(${id})!\n${orderResponse}", id=order_id, orderResponse=order_response())
+    # Only project the fields the client asked for, e.g. ?fields=id,status,total skips the items and customer.
+    fields = parse_fields('order_response', request.args.get('fields'))
 
-    # Execute the query
-    success: QuerySuccess = client.query(query)
-    # Return the order as JSON
-    return jsonify(success.data), 200
+    includes = parse_includes(ORDER_INCLUDES, request.args.get('include'))
+    if includes is not None:
+        order = read_shared(('order', order_id), lambda: client.query(
+            queries.order_with_includes(order_id, fields, includes)).data, (fields, includes))
+        # The embedded documents have no version probe, so the ETag is a digest of the response.
+        return conditional.etag_response(conditional.version_of(order), lambda: order)
+
+    # Full orders are cached if ORDER_CACHE_TTL is set, and invalidated by the change feed as they're written.
+    cached = order_cache.get(order_id) if fields is None else None
+    if cached is not None:
+        return conditional.etag_response(cached['version'], lambda: cached['data'])
+
+    # Skip the full query if the client's copy (If-None-Match) is still current.
+    tag, order = conditional.read_if_modified(client, request.if_none_match, queries.order_timestamps(order_id),
+                                              queries.order(order_id, fields), fields, ('order', order_id))
+    if order is not None and fields is None:
+        order_cache.set(order_id, {'version': tag, 'data': order})
+    # Return the order as JSON, or 304 Not Modified
+    return conditional.etag_response(tag, lambda: order)
 
 
 def update_order(order_id):
@@ -23,29 +40,26 @@ def update_order(order_id):
     status = data.get('status')
     payment = data.get('payment', {})
 
-    # Construct the FQL query to update the order
-    query = fql(
-        '''
-        let order = Order.byId(${id})!
-        // Validate the order status transition if a status is provided
-        if (${status} != null) {
-            validateOrderStatusTransition(order.status, ${status})
-        }
-        // If the order status is not "cart" and a payment is provided, throw an error
-        if (order.status != "cart" && ${payment} != null) {
-            abort("Cannot update payment information after an order has been placed.")
-        }
-        // Update the order with the new status and payment information
-        order.update({
-            status: ${status},
-            payment: ${payment}
-        })
-        ${orderResponse}
-        ''',
-        id=order_id, status=status, payment=payment, orderResponse=order_response()
-    )
-
     # Execute the query
-    res: QuerySuccess = client.query(query)
+    res: QuerySuccess = client.query(queries.update_order(order_id, status, payment))
+    order_cache.invalidate(order_id)
     # Return the updated order as JSON
-    return jsonify(res.data), 200
\ No newline at end of file
+    return jsonify(res.data), 200
+
+
+def checked_out(order: dict) -> None:
+    """Keep the caches in step with an order that was just checked out, and the stock it took."""
+    order_cache.invalidate(order['id'])
+    for item in order['items']:
+        product_cache.invalidate(item['product']['id'])
+
+
+def checkout_order(order_id: str):
+    # The payment is optional if the cart already has one
+    data = request.get_json(silent=True) or {}
+
+    # One transaction checks and takes the stock, and reads the order back. The client retries it if it contends
+    # with other checkouts of the same products.
+    res: QuerySuccess = client.query(queries.checkout(order_id, data.get('payment')))
+    checked_out(res.data)
+    return jsonify(res.data), 200
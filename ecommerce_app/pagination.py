@@ -0,0 +1,121 @@
+"""
+Reading several pages per request, and prefetching the next page of a nextToken walk.
+
+With `pages=N` a list route follows the cursor N times and returns the rows of every page, so a client walking the
+whole set makes N times fewer requests. With `prefetch=true` the route also starts reading the page after the one it
+returns. That page is held for a few seconds in `page_cache`, keyed by its nextToken and the fields it was projected
+to, so the client's next request for the same fields is answered without waiting on Fauna.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, FrozenSet, Optional
+
+from fauna import Page
+from fauna.encoding import QuerySuccess
+from fauna.query import Query
+
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+from ecommerce_app.config import env_float, env_int
+
+# The most pages one request may ask for.
+MAX_PAGES = env_int('MAX_PAGES_PER_REQUEST', 10)
+
+page_cache = ReadThroughCache(
+    'pages', MemoryBackend(env_int('PAGE_PREFETCH_CACHE_SIZE', 1000)), ttl=env_float('PAGE_PREFETCH_TTL', 30))
+
+_prefetcher = ThreadPoolExecutor(env_int('PAGE_PREFETCH_THREADS', 4), thread_name_prefix='page-prefetch')
+
+PageQuery = Callable[[str], Query]
+
+
+class InvalidPagesError(ValueError):
+    pass
+
+
+def parse_pages(value: Optional[str]) -> int:
+    """Parse the pages query parameter, which defaults to one page. Raises InvalidPagesError if it's out of range."""
+    if value is None:
+        return 1
+    if not value.isdigit() or not 1 <= int(value) <= MAX_PAGES:
+        raise InvalidPagesError(f'pages must be a number from 1 to {MAX_PAGES}.')
+    return int(value)
+
+
+def parse_prefetch(value: Optional[str]) -> bool:
+    return value in ('true', '1')
+
+
+def page_of(success: QuerySuccess) -> tuple[list, Optional[str]]:
+    """The rows and next token of a page. The first page is a Page, pages read with Set.paginate are dicts."""
+    if isinstance(success.data, Page):
+        return success.data.data, success.data.after
+    return success.data['data'], success.data.get('after')
+
+
+def cache_key(token: str, fields: Optional[FrozenSet[str]]) -> tuple[str, Optional[tuple[str, ...]]]:
+    """The page_cache key of a page: a prefetched page only answers a request for the same fields."""
+    return token, tuple(sorted(fields)) if fields is not None else None
+
+
+def read_pages(client: Any, first_page: Query, next_token: Optional[str], page_query: PageQuery, pages: int = 1,
+               prefetch: bool = False, fields: Optional[FrozenSet[str]] = None) -> tuple[list, Optional[str]]:
+    """
+    Read one or more consecutive pages.
+    :param client: The Fauna client to query with.
+    :param first_page: The query for the first page, used when there's no next_token.
+    :param next_token: The token of the page to start from, if any.
+    :param page_query: Builds the query for the page after a token.
+    :param pages: How many pages to read, stopping early at the last page.
+    :param prefetch: Start reading the page after the last one returned, for the client's next request.
+    :param fields: The fields the pages are projected to, if the request gave any.
+    :return: The rows of every page read, and the token of the page after them.
+    """
+    def read(token: str) -> tuple[list, Optional[str]]:
+        prefetched = page_cache.get(cache_key(token, fields))
+        if prefetched is not None:
+            page_cache.invalidate(cache_key(token, fields))
+            if prefetched.exception() is None:
+                return prefetched.result()
+        # Not prefetched, or the prefetch failed. Read it now, so any error surfaces in this request.
+        return page_of(client.query(page_query(token)))
+
+    data, after = read(next_token) if next_token else page_of(client.query(first_page))
+    for _ in range(pages - 1):
+        if not after:
+            break
+        more, after = read(after)
+        data.extend(more)
+    if prefetch and after and page_cache.get(cache_key(after, fields)) is None:
+        # Run it in a copy of this context, so its query is labelled with this request's route in metrics.
+        page_cache.set(cache_key(after, fields), _prefetcher.submit(contextvars.copy_context().run,
+                                                 lambda token: page_of(client.query(page_query(token))), after))
+    return data, after
+
+
+async def aread_pages(client: Any, first_page: Query, next_token: Optional[str], page_query: PageQuery,
+                      pages: int = 1, prefetch: bool = False,
+                      fields: Optional[FrozenSet[str]] = None) -> tuple[list, Optional[str]]:
+    """The same as read_pages, with an async client. Prefetched pages are read by a task on the running loop."""
+    async def query_page(token: str) -> tuple[list, Optional[str]]:
+        return page_of(await client.query(page_query(token)))
+
+    async def read(token: str) -> tuple[list, Optional[str]]:
+        prefetched = page_cache.get(cache_key(token, fields))
+        if prefetched is not None:
+            page_cache.invalidate(cache_key(token, fields))
+            try:
+                return await prefetched
+            except Exception:
+                pass  # read it again below, so the error surfaces in this request
+        return await query_page(token)
+
+    data, after = await read(next_token) if next_token else page_of(await client.query(first_page))
+    for _ in range(pages - 1):
+        if not after:
+            break
+        more, after = await read(after)
+        data.extend(more)
+    if prefetch and after and page_cache.get(cache_key(after, fields)) is None:
+        page_cache.set(cache_key(after, fields), asyncio.ensure_future(query_page(after)))
+    return data, after
@@ -1,50 +1,86 @@
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 
 from flask import jsonify, request
-from fauna import fql
-from fauna.client import Client
 from fauna.encoding import QuerySuccess
 
-from ecommerce_app.models.product import product_response
+from ecommerce_app import queries
+from ecommerce_app.cache import category_cache, product_cache
+from ecommerce_app.fauna_client import client
+from ecommerce_app.search import product_search
+
+REQUIRED_PRODUCT_FIELDS = {'name', 'price', 'description', 'stock', 'category'}
 
-# Initialize Fauna client
-client = Client()
 
 def extract_field(key: str, fields: dict[str, Any], data: dict[str, Any], func: Callable = str) -> None:
     if key in data:
         fields[key] = func(data.get(key))
 
 
-def create_product():
-    # Extract fields from the request body.
-    data = request.get_json()
+def extract_product_fields(data: dict[str, Any]) -> dict[str, Any]:
+    """Extract and convert the updatable product fields (everything but the category) from a request body."""
     fields = {}
     extract_field('name', fields, data)
     extract_field('price', fields, data, int)
     extract_field('description', fields, data)
     extract_field('stock', fields, data, int)
+    return fields
+
+
+def new_product_fields(data: dict[str, Any]) -> dict[str, Any]:
+    """Extract and convert the fields of a new product, including its category name, from a request body."""
+    fields = extract_product_fields(data)
     extract_field('category', fields, data)
+    return fields
+
+
+def parse_price_filter(sort: Optional[str], min_price: Optional[str],
+                       max_price: Optional[str]) -> tuple[Optional[tuple[Optional[int], Optional[int]]], Optional[str]]:
+    """
+    Parse the sort, minPrice and maxPrice query parameters of GET /products.
+    :return: The (minPrice, maxPrice) range to list by price, either of which may be None, and None. Or None and None
+             to list by category, or None and an error message. A price bound implies sort=price.
+    """
+    if sort not in (None, 'price'):
+        return None, f'Unknown sort {sort!r}, the only sort is price.'
+    if sort is None and min_price is None and max_price is None:
+        return None, None
+    prices = []
+    for name, value in (('minPrice', min_price), ('maxPrice', max_price)):
+        if value is not None and not value.isdigit():
+            return None, f'{name} must be a whole number of cents.'
+        prices.append(int(value) if value is not None else None)
+    if None not in prices and prices[0] > prices[1]:
+        return None, 'minPrice must not be more than maxPrice.'
+    return (prices[0], prices[1]), None
+
+
+def remember_category(product: Optional[dict]) -> None:
+    """Cache the id of the category embedded in a product_response()."""
+    category = product.get('category') if product else None
+    if category and category.get('id') and category.get('name'):
+        category_cache.set(category['name'], category['id'])
+
+
+def product_written(product: dict) -> None:
+    """Keep the caches in step with a product that was just created or updated."""
+    product_cache.invalidate(product['id'])
+    remember_category(product)
+    product_search.upsert(product)
+
+
+def create_product():
+    # Extract fields from the request body.
+    data = request.get_json()
+    fields = new_product_fields(data)
 
     # Basic validation: Ensure all required fields are present
-    required = set(('name', 'price', 'description', 'stock', 'category'))
-    difference = required - set(fields.keys())
+    difference = REQUIRED_PRODUCT_FIELDS - set(fields.keys())
     if difference:
         return jsonify({'message': f'Missing required field(s) {difference}'}), 400
 
-
-    # Build the FQL query with parameter substitution
-    query = fql(
-        '''
-        let fields = ${fields}
-        let category = Category.byName(fields.category).first()
-        if (category == null) abort("Category does not exist.")
-        let product = Product.create({name: fields.name, price: fields.price, category: category, stock: fields.stock, description: fields.description})
-        ${toProduct}
-        ''',
-        fields=fields, toProduct=product_response()
-    )
     # Execute the query
-    res: QuerySuccess = client.query(query)
+    res: QuerySuccess = client.query(queries.create_product(fields))
+    product_written(res.data)
     # Return the product, stripping out any unnecessary fields
     return jsonify(res.data), 201
 
@@ -52,32 +88,13 @@ def create_product():
 def update_product(product_id):
     # Extract fields from the request body
     data = request.get_json()
-    fields = {}
-    extract_field('name', fields, data)
-    extract_field('price', fields, data, int)
-    extract_field('description', fields, data)
-    extract_field('stock', fields, data, int)
+    fields = extract_product_fields(data)
     category_name = data.get('category')
 
     if not fields and not category_name:
         return jsonify({'message': 'At least one field must be updated.'}), 400
 
-    # Construct the query to update the product in Fauna.
-    # There are potentially two `product.update` statements, but it's performant since it all runs in
-    # one query and is executed as a single transaction server-side.
-    update_category = fql('''
-        let cat = Category.byName(${categoryName}).first()
-        if (cat == null) abort("Category does not exist.")
-        product.update({category: cat})''', categoryName=category_name) if category_name else fql('')
-    query = fql(
-        '''
-        let product = Product.byId(${id})!
-        ${category}
-        product.update(${fields})
-        ${toProduct}
-        ''',
-        id=product_id, fields=fields, toProduct=product_response(), category=update_category)
-
     # Execute the query
-    success: QuerySuccess = client.query(query)
-    return jsonify(success.data), 200
\ No newline at end of file
+    success: QuerySuccess = client.query(queries.update_product(product_id, fields, category_name))
+    product_written(success.data)
+    return jsonify(success.data), 200
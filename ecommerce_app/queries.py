@@ -0,0 +1,417 @@
+"""
+The FQL queries behind each route.
+
+The controllers and blueprints (and the async app in `asgi.py`) build their queries here, then run them with their
+own client. Keeping the query construction separate from I/O lets the sync and async apps share it. Each query is
+named after the function that built it, which is how metrics tell the query templates apart.
+
+The queries for a single product, order or customer return `{version, data}`, where version is the timestamps of
+every document the response was read from. Their `*_timestamps` counterparts read only the version, so a conditional
+GET can check whether the client's copy is current without projecting the response (see `conditional.py`).
+"""
+import functools
+from typing import Any, Callable, FrozenSet, Optional
+
+from fauna import fql
+from fauna.query import Query
+
+from ecommerce_app.cache import category_cache
+from ecommerce_app.models.customer import CUSTOMER_TIMESTAMPS, customer_response
+from ecommerce_app.models.order import ORDER_TIMESTAMPS, order_response, order_summary
+from ecommerce_app.models.product import PRODUCT_TIMESTAMPS, product_price_row, product_response, product_row
+from ecommerce_app.models.projections import expand, field_names
+
+CUSTOMER_NOT_FOUND = 'Customer not found.'
+
+
+def template(build: Callable[..., Query]) -> Callable[..., Query]:
+    """Name the queries a function builds after the function, so metrics can tell the templates apart."""
+    @functools.wraps(build)
+    def build_named(*args, **kwargs) -> Query:
+        query = build(*args, **kwargs)
+        query.template = build.__name__
+        return query
+    return build_named
+
+
+def category(name: str) -> Query:
+    """
+    FQL for the category with the given name. Once the category's id is cached it is read by id,
+    which skips the Category.byName index read.
+    """
+    category_id = category_cache.get(name)
+    if category_id is not None:
+        return fql('Category.byId(${id})', id=category_id)
+    return fql('Category.byName(${name}).first()', name=name)
+
+
+@template
+def products_page(next_token: Optional[str], category_name: Optional[str], page_size: int,
+                  fields: Optional[FrozenSet[str]] = None) -> Query:
+    if next_token:
+        return fql("Set.paginate(${nextToken}).map(product => ${toProduct})",
+                   nextToken=next_token, toProduct=product_response(fields))
+    elif category_name:
+        return fql("Product.byCategory(${category}).pageSize(${pageSize}).map(product => ${toProduct})",
+                   category=category(category_name), pageSize=page_size, toProduct=product_response(fields))
+    else:
+        return fql("Product.sortedByCategory().pageSize(${pageSize}).map(product => ${toProduct})",
+                   pageSize=page_size, toProduct=product_response(fields))
+
+
+@template
+def products_by_price(next_token: Optional[str], category_name: Optional[str], min_price: Optional[int],
+                      max_price: Optional[int], page_size: int, fields: Optional[FrozenSet[str]] = None) -> Query:
+    """
+    A page of products, cheapest first, with a price from min_price to max_price (inclusive) if they're given. Each
+    page is a range read of a covered index, projected to product_price_row, so no product is read.
+    """
+    if next_token:
+        # The cursor remembers the range and projection of the first page.
+        return fql('Set.paginate(${nextToken})', nextToken=next_token)
+    price_range = {key: value for key, value in (('from', min_price), ('to', max_price)) if value is not None}
+    if category_name:
+        products = fql('Product.byCategorySortedByPrice(${category}, ${range})',
+                       category=category(category_name), range=price_range)
+    else:
+        products = fql('Product.sortedByPriceLowToHigh(${range})', range=price_range)
+    return fql('${products}.pageSize(${pageSize}).map(product => ${toProduct})',
+               products=products, pageSize=page_size, toProduct=product_price_row(fields))
+
+
+@template
+def product(product_id: str, fields: Optional[FrozenSet[str]] = None) -> Query:
+    return fql("let product = Product.byId(${productId})!\n{version: ${version}, data: ${toProduct}}",
+               productId=product_id, version=PRODUCT_TIMESTAMPS, toProduct=product_response(fields))
+
+
+@template
+def product_timestamps(product_id: str) -> Query:
+    return fql("let product = Product.byId(${productId})!\n${version}",
+               productId=product_id, version=PRODUCT_TIMESTAMPS)
+
+
+@template
+def create_product(fields: dict[str, Any]) -> Query:
+    # Build the FQL query with parameter substitution
+    return fql(
+        '''
+        let fields = ${fields}
+        let category = ${category}
+        if (category == null) abort("Category does not exist.")
+        let product = Product.create({name: fields.name, price: fields.price, category: category, stock: fields.stock, description: fields.description})
+        ${toProduct}
+        ''',
+        fields=fields, category=category(fields['category']), toProduct=product_response()
+    )
+
+
+@template
+def update_product(product_id: str, fields: dict[str, Any], category_name: Optional[str]) -> Query:
+    # Construct the query to update the product in Fauna.
+    # There are potentially two `product.update` statements, but it's performant since it all runs in
+    # one query and is executed as a single transaction server-side.
+    update_category = fql('''
+        let cat = ${category}
+        if (cat == null) abort("Category does not exist.")
+        product.update({category: cat})''', category=category(category_name)) if category_name else fql('')
+    return fql(
+        '''
+        let product = Product.byId(${id})!
+        ${category}
+        product.update(${fields})
+        ${toProduct}
+        ''',
+        id=product_id, fields=fields, toProduct=product_response(), category=update_category)
+
+
+@template
+def upsert_products(products: list[dict[str, Any]]) -> Query:
+    """
+    Create or update, by name, each of a batch of products in one transaction. Returns one result per product, in
+    order: {id, created} if it was written, or {error} if its category doesn't exist.
+    """
+    return fql(
+        '''
+        let products = ${products}
+        // Look up each category in the batch once, rather than once per product.
+        let categories = Object.fromEntries(products.map(p => p.category).distinct().map(name => [name, Category.byName(name).first()]))
+        products.map(p => {
+            let category = categories[p.category]
+            if (category == null) {
+                { error: "Category does not exist." }
+            } else {
+                let data = {name: p.name, price: p.price, category: category, stock: p.stock, description: p.description}
+                // There is a unique constraint on [.name] so this will return at most one result.
+                let existing = Product.byName(p.name).first()
+                if (existing == null) {
+                    { id: Product.create(data).id, created: true }
+                } else {
+                    { id: existing!.update(data).id, created: false }
+                }
+            }
+        })
+        ''',
+        products=products)
+
+
+@template
+def product_rows_page(next_token: Optional[str], page_size: int) -> Query:
+    if next_token:
+        # The cursor remembers the projection of the first page.
+        return fql('Set.paginate(${nextToken})', nextToken=next_token)
+    return fql('Product.all().pageSize(${pageSize}).map(product => ${toRow})', pageSize=page_size, toRow=product_row())
+
+
+@template
+def order(order_id: str, fields: Optional[FrozenSet[str]] = None) -> Query:
+    return fql("let order = Order.byId(${id})!\n{version: ${version}, data: ${orderResponse}}",
+               id=order_id, version=ORDER_TIMESTAMPS, orderResponse=order_response(fields))
+
+
+@template
+def order_timestamps(order_id: str) -> Query:
+    return fql("let order = Order.byId(${id})!\n${version}", id=order_id, version=ORDER_TIMESTAMPS)
+
+
+def embedded_order() -> Query:
+    """An order, bound to `order`, as embedded in its customer: order_response without the customer."""
+    return order_response(frozenset(field_names('order_response')) - {'customer'})
+
+
+@template
+def order_with_includes(order_id: str, fields: Optional[FrozenSet[str]], includes: FrozenSet[str]) -> Query:
+    """The order, with the documents in includes (see includes.py) in place of their summaries."""
+    embedded = {}
+    if 'customer' in includes:
+        embedded['customer'] = fql(
+            '(if (order.customer != null) {\n  let customer = order.customer\n  ${customer}\n} else null)',
+            customer=customer_response())
+    return fql('let order = Order.byId(${id})!\n${orderResponse}',
+               id=order_id, orderResponse=expand('order_response', fields, embedded))
+
+
+@template
+def update_order(order_id: str, status: Optional[str], payment: Optional[dict]) -> Query:
+    return fql(
+        '''
+        let order = Order.byId(${id})!
+        // Validate the order status transition if a status is provided
+        if (${status} != null) {
+            validateOrderStatusTransition(order.status, ${status})
+        }
+        // If the order status is not "cart" and a payment is provided, throw an error
+        if (order.status != "cart" && ${payment} != null) {
+            abort("Cannot update payment information after an order has been placed.")
+        }
+        let previousStatus = order.status
+        // Update the order with the new status and payment information
+        let updated = order.update({
+            status: ${status},
+            payment: ${payment}
+        })
+        // Move the order to its new status in the customer's order stats
+        updateOrderStats(updated, previousStatus)
+        ${orderResponse}
+        ''',
+        id=order_id, status=status, payment=payment, orderResponse=order_response()
+    )
+
+
+@template
+def checkout(order_id: str, payment: Optional[dict]) -> Query:
+    # The checkout UDF validates and decrements stock and moves the order to processing. The response is read in the
+    # same transaction, so it shows the order as checked out.
+    return fql('let order = checkout(${id}, "processing", ${payment})\n${orderResponse}',
+               id=order_id, payment=payment, orderResponse=order_response())
+
+
+@template
+def create_customer(customer_data: dict[str, Any]) -> Query:
+    return fql('let customer = Customer.create(${newCustomer})\n${customerResponse}',
+               newCustomer=customer_data, customerResponse=customer_response())
+
+
+@template
+def add_item_to_cart(customer_id: str, product_name: str, quantity: int) -> Query:
+    # Construct the FQL query to add or update the cart item
+    return fql("let order = createOrUpdateCartItem(${customerId}, ${productName}, ${quantity})\n${orderResponse}",
+               customerId=customer_id, productName=product_name, quantity=quantity, orderResponse=order_response())
+
+
+@template
+def add_items_to_cart(customer_id: str, items: list[dict[str, Any]]) -> Query:
+    # One UDF call applies every item, so the customer and cart are read once for the whole batch.
+    return fql(
+        '''
+        let result = createOrUpdateCartItems(${customerId}, ${items})
+        let order = result.cart
+        {cart: ${orderResponse}, errors: result.errors}
+        ''',
+        customerId=customer_id, items=items, orderResponse=order_response())
+
+
+@template
+def get_or_create_cart(customer_id: str) -> Query:
+    # Build the FQL query to get or create the cart for the customer
+    return fql(" let order = getOrCreateCart(${customerId}) ${orderResponse}",
+               customerId=customer_id, orderResponse=order_response())
+
+
+def find_customer(customer_id: str, key: Optional[str]) -> Query:
+    """
+    Bind `customer` to the customer with the given id, or email if key is 'email'. Aborts with CUSTOMER_NOT_FOUND if
+    there is none.
+    """
+    customerQuery = fql('let customer = Customer.byId(${customerId})', customerId=customer_id)
+    if key == 'email':
+        customerQuery = fql('let customer = Customer.byEmail(${email}).first()', email=customer_id)
+    return fql('${getCustomer}\n${checkNotNull}', getCustomer=customerQuery,
+               checkNotNull=fql("if (customer == null) abort(${abortMsg})", abortMsg=CUSTOMER_NOT_FOUND))
+
+
+@template
+def customer(customer_id: str, key: Optional[str], fields: Optional[FrozenSet[str]] = None) -> Query:
+    """The customer with the given id, or email if key is 'email'. Aborts with CUSTOMER_NOT_FOUND if there is none."""
+    return fql('${findCustomer}\n{version: ${version}, data: ${customerResponse}}',
+               findCustomer=find_customer(customer_id, key), version=CUSTOMER_TIMESTAMPS,
+               customerResponse=customer_response(fields))
+
+
+@template
+def customer_with_includes(customer_id: str, key: Optional[str], fields: Optional[FrozenSet[str]],
+                           includes: FrozenSet[str], orders_page_size: int) -> Query:
+    """
+    The customer, with the documents in includes (see includes.py): its cart in place of the cart id, and a page of
+    its latest orders as {data, after}, each a summary, or with its items if includes has orders.items.
+    """
+    embedded = {}
+    if 'cart' in includes:
+        embedded['cart'] = fql(
+            '(if (customer?.cart != null) {\n  let order = customer?.cart\n  ${order}\n} else null)',
+            order=embedded_order())
+    if 'orders' in includes:
+        embedded['orders'] = fql('Order.byCustomer(customer).map(order => ${order}).paginate(${pageSize})',
+                                 order=embedded_order() if 'orders.items' in includes else order_summary(),
+                                 pageSize=orders_page_size)
+    return fql('${findCustomer}\n${customerResponse}', findCustomer=find_customer(customer_id, key),
+               customerResponse=expand('customer_response', fields, embedded))
+
+
+@template
+def customer_timestamps(customer_id: str, key: Optional[str]) -> Query:
+    return fql('${findCustomer}\n${version}', findCustomer=find_customer(customer_id, key), version=CUSTOMER_TIMESTAMPS)
+
+
+@template
+def customer_orders_page(customer_id: str, next_token: Optional[str], page_size: int) -> Query:
+    if next_token:
+        return fql("Set.paginate(${nextToken}).map(order => ${toOrder})",
+                   nextToken=next_token, toOrder=order_summary())
+    return fql("Order.byCustomer(Customer.byId(${customerId})).pageSize(${pageSize}).map(order => ${orderSummary})",
+               pageSize=page_size, orderSummary=order_summary(), customerId=customer_id)
+
+
+@template
+def customer_order_summary(customer_id: str, page_size: int) -> Query:
+    """
+    The customer's order stats (see OrderStats in schema/collections.fsl), with a page of its latest orders as
+    {data, after}. Later pages are read with customer_orders_page. Aborts with CUSTOMER_NOT_FOUND if there is none.
+    """
+    orders = fql('Order.byCustomer(customer).map(order => ${orderSummary}).paginate(${pageSize})',
+                 orderSummary=order_summary(), pageSize=page_size)
+    return fql('${findCustomer}\nlet stats: Any = customer!.orderStats\n${summary}',
+               findCustomer=find_customer(customer_id, None),
+               summary=expand('order_stats_response', None, {'orders': orders}))
+
+
+@template
+def customer_ids_page(next_token: Optional[str], page_size: int) -> Query:
+    if next_token:
+        return fql('Set.paginate(${nextToken})', nextToken=next_token)
+    return fql('Customer.all().map(customer => customer.id).paginate(${pageSize})', pageSize=page_size)
+
+
+@template
+def order_stats_page(customer_id: str, next_token: Optional[str], page_size: int) -> Query:
+    """
+    The OrderStats fields of a page of the customer's orders, as {stats, version, after}. version identifies the
+    customer's stored OrderStats as they are now (null if there are none), for save_order_stats.
+    """
+    page = fql('Set.paginate(${nextToken})', nextToken=next_token) if next_token \
+        else fql('Order.byCustomer(customer).paginate(${pageSize})', pageSize=page_size)
+    return fql(
+        '''
+        let customer = Customer.byId(${customerId})!
+        let page: Any = ${page}
+        {
+            stats: orderStats(page.data),
+            version: OrderStats.byCustomer(customer).first()?.ts?.toMicros(),
+            after: page.after
+        }
+        ''',
+        customerId=customer_id, page=page)
+
+
+@template
+def save_order_stats(customer_id: str, stats: dict[str, Any], version: Optional[int]) -> Query:
+    """
+    Store the customer's OrderStats, unless they changed since version was read: an order changed status meanwhile,
+    so stats may already be out of date. Returns whether they were stored.
+    """
+    return fql(
+        '''
+        let customer = Customer.byId(${customerId})!
+        let current: Any = OrderStats.byCustomer(customer).first()
+        if (current?.ts?.toMicros() != ${version}) {
+            false
+        } else {
+            if (current == null) {
+                OrderStats.create(Object.assign({ customer: customer }, ${stats}))
+            } else {
+                current.update(${stats})
+            }
+            true
+        }
+        ''',
+        customerId=customer_id, stats=stats, version=version)
+
+
+@template
+def reconcile_order_totals(next_token: Optional[str], page_size: int, fix: bool, backfill: bool = False) -> Query:
+    """
+    Compare the stored total and itemCount of a page of orders with orderTotals(), which recomputes them from the
+    items at today's prices, and if fix is set, store the recomputed values. Only carts are compared, since a placed
+    order's total is fixed at checkout. With backfill, the orders compared are instead those still at the 0 the
+    migration started them at, whatever their status. Returns {checked, drifted, after}, where drifted lists the
+    orders whose stored values were wrong as {id, stored, expected}.
+    """
+    orders = fql('Order.all().where(.itemCount == 0 && .total == 0)') if backfill \
+        else fql('Order.all().where(.status == "cart")')
+    page = fql('Set.paginate(${nextToken})', nextToken=next_token) if next_token \
+        else fql('${orders}.paginate(${pageSize})', orders=orders, pageSize=page_size)
+    return fql(
+        '''
+        let page: Any = ${page}
+        let drifted = page.data.map(order => {
+            let order: Any = order
+            let stored = { total: order.total, itemCount: order.itemCount }
+            let expected = orderTotals(order)
+            if (stored == expected) {
+                null
+            } else {
+                if (${fix}) {
+                    order.update(expected)
+                }
+                { id: order.id, stored: stored, expected: expected }
+            }
+        })
+        { checked: page.data.length, drifted: drifted.where(result => result != null), after: page.after }
+        ''',
+        page=page, fix=fix)
+
+
+@template
+def ping() -> Query:
+    """The cheapest query there is, sent to open connections to Fauna before the first request (see `warmup.py`)."""
+    return fql('0')
@@ -1,29 +1,36 @@
-from typing import Callable
+from typing import Optional
 
-from fauna import fql
-from fauna.client import Client
 from fauna.encoding import QuerySuccess
 from fauna.errors import AbortError
-from flask import Blueprint, jsonify, request, Response
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 
-from ecommerce_app.customer_controller import add_item_to_cart, get_or_create_cart, create_customer
-from ecommerce_app.models.customer import Customer, customer_response
-from ecommerce_app.models.order import Order, order_summary
-from ecommerce_app.models.product import Product, product_response
-from ecommerce_app.order_controller import get_order_by_id, update_order
-from ecommerce_app.product_controller import create_product, update_product
+from ecommerce_app import change_feed, conditional, queries
+from ecommerce_app.cache import product_cache
+from ecommerce_app.coalescing import read_shared
+from ecommerce_app.catalog_controller import export_products, import_products
+from ecommerce_app.fauna_client import client
+from ecommerce_app.includes import CUSTOMER_INCLUDES, parse_includes, parse_orders_page_size
+from ecommerce_app.customer_controller import add_item_to_cart, add_items_to_cart, get_or_create_cart, \
+    create_customer, customer_document, query_options
+from ecommerce_app.models.customer import Customer
+from ecommerce_app.models.projections import parse_fields
+from ecommerce_app.negotiation import page_response
+from ecommerce_app.order_controller import checkout_order, get_order_by_id, update_order
+from ecommerce_app.pagination import parse_pages, parse_prefetch, read_pages
+from ecommerce_app.product_controller import create_product, parse_price_filter, remember_category, update_product
+from ecommerce_app.search import parse_search, product_search
 
 products = Blueprint('products', __name__)
 orders = Blueprint('orders', __name__)
 customers = Blueprint('customers', __name__)
 
 
-# Initialize Fauna client
-client = Client()
-
-
-def jsonify_page(data: list, after: str, item_func: Callable) -> Response:
-    return jsonify({'data': [item_func(**doc) for doc in data], 'next': after})
+def jsonify_page(data: list, after: Optional[str]) -> Response:
+    """
+    Serialize a page of results. The rows are already shaped by their projection, so they're streamed to the response
+    as decoded, a chunk at a time. A request that accepts MessagePack or CBOR gets the page in that format instead.
+    """
+    return page_response(data, after)
 
 
 @products.route('/products', methods=['GET'])
@@ -31,39 +38,95 @@ def get_products():
     """
     By default, paginate over all products, the category query parameter allows you to return products by category.
     The nextToken query parameter returns subsequent pages of results.
+    The fields query parameter (e.g. ?fields=id,name,price) limits each product to the given fields.
+    The pages query parameter returns that many pages at once, and prefetch=true reads the next page in the background.
+    With sort=price, products are listed cheapest first, optionally from minPrice to maxPrice. They're read from the
+    covered price indexes, so they don't include their category.
     :return: A list of products, and (optionally) the next page token.
     """
     nextToken = request.args.get('nextToken')
     category = request.args.get('category')
     pageSize = request.args.get('pageSize', default=10, type=int)
-    if nextToken:
-        success: QuerySuccess = client.query(fql(
-            "Set.paginate(${nextToken}).map(product => ${toProduct}",
-            nextToken=nextToken, toProduct=product_response()))
-        # Data is a dict not a page here.
-        return jsonify_page(success.data['data'], success.data['after'], Product), 200
-    elif category:
-        categoryQuery = fql("Category.byName(${category}).first()", category=category)
-        success: QuerySuccess = client.query(fql(
-            "Product.byCategory(${category}).pageSize(${pageSize}).map(product => ${toProduct})",
-            category=categoryQuery,
-            pageSize=pageSize, toProduct=product_response()))
-        return jsonify_page(success.data.data, success.data.after, Product), 200
-    else:
-        success: QuerySuccess = client.query(fql(
-            "Product.sortedByCategory().pageSize(${pageSize}).map(product => ${toProduct})",
-            pageSize=pageSize, toProduct=product_response()))
-        return jsonify_page(success.data.data, success.data.after, Product), 200
+    prices, message = parse_price_filter(
+        request.args.get('sort'), request.args.get('minPrice'), request.args.get('maxPrice'))
+    if message:
+        return jsonify({'message': message}), 400
+    if prices is not None:
+        fields = parse_fields('product_price_row', request.args.get('fields'))
+        data, after = read_pages(
+            client, queries.products_by_price(None, category, *prices, pageSize, fields), nextToken,
+            lambda token: queries.products_by_price(token, None, None, None, pageSize, fields),
+            parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')), fields)
+        return jsonify_page(data, after), 200
+    fields = parse_fields('product_response', request.args.get('fields'))
+    data, after = read_pages(
+        client, queries.products_page(None, category, pageSize, fields), nextToken,
+        lambda token: queries.products_page(token, None, pageSize, fields),
+        parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')), fields)
+    if category and not nextToken and data:
+        remember_category(data[0])
+    return jsonify_page(data, after), 200
+
+
+@products.route('/products/search', methods=['GET'])
+def search_products():
+    """
+    Search product names and descriptions for typeahead. Each word of q matches the start of a word, every word has to
+    match, and the best matches come first. Answered from this process's search index, without a query to Fauna once
+    the index is loaded.
+    """
+    query, limit = parse_search(request.args.get('q'), request.args.get('limit'))
+    return jsonify({'data': product_search.search(query, limit)}), 200
 
 # Use 'identity' rather than 'id', because 'id' is a reserved keyword in Python.
 
 @products.route('/products/<product_id>', methods=['GET'])
 def get_product(product_id: str):
-    """Get the product with the given identity."""
-    success: QuerySuccess = client.query(fql(
-        "let product = Product.byId(${productId})\n${toProduct}",
-        productId=product_id, toProduct=product_response()))
-    return jsonify(success.data)
+    """
+    Get the product with the given identity. Products are served from product_cache while fresh.
+    The fields query parameter limits the response to the given fields.
+    The response has an ETag, and a request with a matching If-None-Match header is answered with 304 Not Modified.
+    Concurrent reads of the same product share one query, and a product that doesn't exist is remembered briefly.
+    """
+    fields = parse_fields('product_response', request.args.get('fields'))
+
+    def load_product():
+        success: QuerySuccess = read_shared(('product', product_id), lambda: client.query(queries.product(product_id)))
+        return conditional.versioned(success.data)
+
+    if fields is None:
+        cached = product_cache.get_or_load(product_id, load_product)
+        return conditional.etag_response(cached['version'], lambda: cached['data'])
+    # Only full products are cached. A cached product can still answer a sparse request without a query.
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return conditional.etag_response(conditional.etag(cached['version'], fields), lambda: {
+            key: value for key, value in cached['data'].items() if key in fields})
+    tag, product = conditional.read_if_modified(client, request.if_none_match, queries.product_timestamps(product_id),
+                                                queries.product(product_id, fields), fields, ('product', product_id))
+    return conditional.etag_response(tag, lambda: product)
+
+
+@products.route('/products/events', methods=['GET'])
+def get_product_events():
+    """
+    Push changes to the stock and price of products as Server-Sent Events, while the change feed is running.
+    The ids query parameter (e.g. ?ids=1,2) limits the events to the given products. A client that reconnects with a
+    Last-Event-ID header is sent the events it missed, or a `reset` event if they're no longer kept.
+    """
+    if not change_feed.running():
+        return jsonify({'message': 'The change feed is not enabled.', 'status_code': 503}), 503
+    ids = request.args.get('ids')
+    subscription, replay = change_feed.broadcaster.subscribe(request.headers.get('Last-Event-ID'))
+
+    def events():
+        try:
+            yield from change_feed.sse_messages(subscription, replay, ids.split(',') if ids else None)
+        finally:
+            change_feed.broadcaster.unsubscribe(subscription)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @products.route('/products', methods=['POST'])
@@ -75,6 +138,22 @@ def post_products():
     return create_product()
 
 
+@products.route('/products/import', methods=['POST'])
+def post_products_import():
+    """
+    Create or update, by name, the products streamed in the request body. Send NDJSON (one product per line) or, with
+    a text/csv content type, CSV with a header row. Each row has the same fields as POST /products.
+    :return: The number of products created, updated and failed, and the first failed rows with the reason for each.
+    """
+    return import_products()
+
+
+@products.route('/products/export', methods=['GET'])
+def get_products_export():
+    """Stream every product as NDJSON, or as CSV with "?format=csv", in a form that can be imported again."""
+    return export_products()
+
+
 @products.route('/products/<order_id>', methods=['PATCH'])
 def patch_product(order_id):
     """Update the product with the given ID."""
@@ -83,7 +162,10 @@ def patch_product(order_id):
 
 @orders.route('/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
-    """Get the order with the given identity."""
+    """
+    Get the order with the given identity. Answers 304 Not Modified if If-None-Match has its current ETag.
+    With include=customer, the order has its full customer, including the customer's cart.
+    """
     return get_order_by_id(order_id)
 
 
@@ -94,6 +176,16 @@ def patch_order(order_id: str):
     """
     return update_order(order_id)
 
+
+@orders.route('/orders/<order_id>/checkout', methods=['POST'])
+def post_order_checkout(order_id: str):
+    """
+    Check out a cart: check every item is in stock, take the stock, and move the order to processing, in one
+    transaction. The body may have a payment, which is required if the cart doesn't have one.
+    :return: The order, as processing.
+    """
+    return checkout_order(order_id)
+
 @customers.route('/customers', methods=['POST'])
 def post_customers():
     return create_customer()
@@ -111,44 +203,72 @@ def post_customer_cart_item(customer_id: str):
     return add_item_to_cart(customer_id)
 
 
+@customers.route('/customers/<customer_id>/cart/items', methods=['POST'])
+def post_customer_cart_items(customer_id: str):
+    """
+    Add or update many items in the customers cart with one query.
+    :param customer_id: The ID of the customer.
+    :return: The updated cart, and the items that couldn't be applied with the reason for each.
+    """
+    return add_items_to_cart(customer_id)
+
+
 @customers.route('/customers/<customer_id>', methods=['GET'])
 def get_customer(customer_id: str):
     """
     Get a customer by ID, or email
     :param customer_id:  The ID, or email of the customer. If using email, set the query parameter "?key=email".
-    :return:    The customer details.
+    :return:    The customer details, limited to the fields in the fields query parameter if it's set. Answers 304
+                Not Modified if the If-None-Match header has the customer's current ETag. The include query
+                parameter (cart, orders, orders.items) embeds the cart and the latest ordersPageSize orders.
     """
     key = request.args.get('key')
-    abort_message = 'Customer not found.'
-    customerQuery = fql('let customer = Customer.byId(${customerId})', customerId=customer_id)
-    if key == 'email':
-        customerQuery = fql('let customer = Customer.byEmail(${email}).first()', email=customer_id)
+    fields = parse_fields('customer_response', request.args.get('fields'))
+    includes = parse_includes(CUSTOMER_INCLUDES, request.args.get('include'))
+    try:
+        if includes is not None:
+            page_size = parse_orders_page_size(request.args.get('ordersPageSize'))
+            customer = read_shared(customer_document(customer_id, key), lambda: client.query(
+                queries.customer_with_includes(customer_id, key, fields, includes, page_size)).data,
+                (fields, includes, page_size))
+            # The embedded documents have no version probe, so the ETag is a digest of the response.
+            return conditional.etag_response(conditional.version_of(customer), lambda: customer)
+        tag, customer = conditional.read_if_modified(
+            client, request.if_none_match, queries.customer_timestamps(customer_id, key),
+            queries.customer(customer_id, key, fields), fields, customer_document(customer_id, key))
+        return conditional.etag_response(tag, lambda: Customer(**customer) if fields is None else customer)
+    except AbortError as err:
+        if err.abort == queries.CUSTOMER_NOT_FOUND:
+            return jsonify({"message": queries.CUSTOMER_NOT_FOUND, "status_code": 404}), 404
+        raise
+
+
+@customers.route('/customers/<customer_id>/orders/summary', methods=['GET'])
+def get_customer_order_summary(customer_id: str):
+    """
+    A customer's order history in one read: orders placed by status, lifetime spend and when they last ordered, from
+    the stats kept up to date as orders change status, and the latest ordersPageSize orders.
+    :param customer_id: The ID of the customer.
+    :return: {orderCount, ordersByStatus, lifetimeSpend, lastOrderAt, orders: {data, after}}. Follow orders.after with
+             GET /customers/<id>/orders?nextToken=. Answers 304 Not Modified if If-None-Match has its ETag.
+    """
+    page_size = parse_orders_page_size(request.args.get('ordersPageSize'))
     try:
-        success: QuerySuccess = client.query(fql(
-            '${getCustomer}\n${checkNotNull}\n${customerResponse}',
-            getCustomer=customerQuery, customerResponse=customer_response(),
-            checkNotNull=fql("if (customer == null) abort(${abortMsg})", abortMsg=abort_message)))
-        return jsonify(Customer(**success.data))
+        summary = client.query(queries.customer_order_summary(customer_id, page_size), query_options).data
     except AbortError as err:
-        if err.abort == abort_message:
-            return jsonify({"message": abort_message, "status_code": 404}), 404
+        if err.abort == queries.CUSTOMER_NOT_FOUND:
+            return jsonify({"message": queries.CUSTOMER_NOT_FOUND, "status_code": 404}), 404
+        raise
+    return conditional.etag_response(conditional.version_of(summary), lambda: summary)
 
 
 @customers.route('/customers/<customer_id>/orders', methods=['GET'])
 def get_customer_orders(customer_id: str):
-    """List all the orders for a customer."""
+    """List all the orders for a customer. Supports the same pages and prefetch query parameters as GET /products."""
     nextToken = request.args.get("nextToken")
     pageSize = request.args.get('pageSize', default=10, type=int)
-    if nextToken:
-        success: QuerySuccess = client.query(fql(
-            "Set.paginate(${nextToken}).map(order => ${toOrder})",
-            nextToken=nextToken, toOrder=order_summary()))
-        # Data is a dict not a page here.
-        return jsonify_page(success.data['data'], success.data['after'], Order)
-    else:
-        success: QuerySuccess = client.query(fql(
-            "Order.byCustomer(Customer.byId(${customerId})).pageSize(${pageSize}).map(order => ${orderSummary})",
-            pageSize=pageSize, orderSummary=order_summary(), customerId=customer_id))
-        return jsonify_page(success.data.data, success.data.after, Order)
-
-
+    data, after = read_pages(
+        client, queries.customer_orders_page(customer_id, None, pageSize), nextToken,
+        lambda token: queries.customer_orders_page(customer_id, token, pageSize),
+        parse_pages(request.args.get('pages')), parse_prefetch(request.args.get('prefetch')))
+    return jsonify_page(data, after)
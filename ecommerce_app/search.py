@@ -0,0 +1,324 @@
+"""
+Product search and typeahead (GET /products/search?q=), from an in-process index of product names and descriptions.
+
+The index is built from a snapshot of every product, read a page at a time with `queries.product_rows_page`, the
+first time it's searched. Products written through the app (create, update, import, and checkout's stock changes
+via the change feed) are applied to it as they're written. A full rebuild runs in the background once the snapshot
+is SEARCH_REFRESH seconds old, to pick up writes made elsewhere.
+
+Each word of the query matches the words of a product that start with it, so "dro ca" finds "Drone camera". Every
+word has to match. Words shorter than MIN_WORD_LENGTH are left out, since one letter is the prefix of a large share
+of a catalog's words. Products are ranked by how well they match: a whole word in the name beats a prefix of one, which
+beats a word in the description, and a name that starts with the query beats any of those.
+
+The layout is meant for catalogs of hundreds of thousands of products. Products are held in parallel lists, indexed
+by slot. Each word maps to an array of 4-byte slots, and the words are kept sorted, so the words with a prefix are
+one bisect away. Repeated queries, as typeahead sends, are answered from a small cache of ranked results, which
+only a write to a name or description clears.
+
+Searches don't take a lock, so a slow one holds up neither other searches nor writes. A write only appends to the
+index or sets one item of it, and it replaces the sorted lists of words with new ones rather than inserting into them,
+so a search sees each of them either before or after the write.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Iterable, Optional
+
+from ecommerce_app import queries
+from ecommerce_app.config import env_float, env_int
+from ecommerce_app.fauna_client import client
+from ecommerce_app.pagination import page_of
+
+# Seconds before the snapshot is rebuilt in the background. 0 never rebuilds it.
+REFRESH = env_float('SEARCH_REFRESH', 300)
+LOAD_PAGE_SIZE = env_int('SEARCH_LOAD_PAGE_SIZE', 1000)
+RESULT_CACHE_SIZE = env_int('SEARCH_RESULT_CACHE_SIZE', 1024)
+MAX_RESULTS = 50
+# The most query words, and the fewest letters in one, so one query can't do unbounded work.
+MAX_QUERY_WORDS = 8
+MIN_WORD_LENGTH = 2
+# Words added since the index was built, before they're merged into the sorted vocabulary.
+MAX_ADDED_WORDS = 4096
+
+# Match quality of one query word: a whole word of the name, a prefix of one, or a word of the description.
+NAME_WORD, NAME_PREFIX, DESCRIPTION = 3, 2, 1
+# Added when the name starts with the whole query.
+NAME_STARTS = 5
+
+WORD = re.compile(r'\w+')
+
+
+class InvalidSearchError(ValueError):
+    """Raised when q has no words long enough to search for, or limit is out of range."""
+    pass
+
+
+def words(text: Optional[str]) -> list[str]:
+    return WORD.findall(text.lower()) if text else []
+
+
+def query_words(query: str) -> list[str]:
+    return [word for word in words(query) if len(word) >= MIN_WORD_LENGTH][:MAX_QUERY_WORDS]
+
+
+class SearchIndex:
+    """The words of every product's name and description, and the fields returned for each product."""
+
+    def __init__(self, products: Iterable[dict[str, Any]] = ()):
+        self.ids: list[str] = []
+        self.names: list[str] = []
+        self.prices: list[Optional[int]] = []
+        self.stocks: list[Optional[int]] = []
+        # A hash of each description, to tell a price or stock change from an edit of the words.
+        self.descriptions = array('q')
+        # Slots whose product was since removed or rewritten.
+        self.alive = bytearray()
+        self.slots: dict[str, int] = {}
+        self.name_postings: dict[str, array] = {}
+        self.description_postings: dict[str, array] = {}
+        self.vocabulary: list[str] = []
+        # Words new since the vocabulary was sorted, sorted too. Kept apart so a write copies this short list only.
+        self.added: list[str] = []
+        self.removed = 0
+        for product in products:
+            self._add(product)
+        self.vocabulary = sorted(self.name_postings.keys() | self.description_postings.keys())
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _add(self, product: dict[str, Any]) -> list[str]:
+        """Add a product in a new slot. Returns the words that are new to the vocabulary."""
+        slot = len(self.ids)
+        self.ids.append(product['id'])
+        self.names.append(product['name'])
+        self.prices.append(product.get('price'))
+        self.stocks.append(product.get('stock'))
+        self.descriptions.append(hash(product.get('description')))
+        self.alive.append(1)
+        self.slots[product['id']] = slot
+        new = []
+        for postings, text in ((self.name_postings, product['name']),
+                               (self.description_postings, product.get('description'))):
+            for word in set(words(text)):
+                if word not in postings:
+                    postings[word] = array('I')
+                    new.append(word)
+                postings[word].append(slot)
+        return new
+
+    def upsert(self, product: dict[str, Any]):
+        slot = self.slots.get(product['id'])
+        if slot is not None and product['name'] == self.names[slot] \
+                and hash(product.get('description')) == self.descriptions[slot]:
+            # Only the price or stock changed, so the words stay where they are.
+            self.prices[slot] = product.get('price', self.prices[slot])
+            self.stocks[slot] = product.get('stock', self.stocks[slot])
+            return
+        self.remove(product['id'])
+        new = self._add(product)
+        if new:
+            # New lists, so a search bisecting the old ones meanwhile isn't thrown off.
+            added = sorted(self.added + new)
+            if len(added) > MAX_ADDED_WORDS:
+                # Two sorted runs, which sorted() merges in one pass.
+                self.vocabulary, added = sorted(self.vocabulary + added), []
+            self.added = added
+
+    def remove(self, product_id: str):
+        slot = self.slots.pop(product_id, None)
+        if slot is not None:
+            self.alive[slot] = 0
+            self.removed += 1
+
+    def _scores(self, word: str, names_only: bool) -> dict[int, int]:
+        """The best match quality of a query word for each product it matches."""
+        matches = []
+        for vocabulary in (self.vocabulary, self.added):
+            start = bisect.bisect_left(vocabulary, word)
+            matches += vocabulary[start:bisect.bisect_left(vocabulary, word + '\U0010ffff', start)]
+        # Each update overwrites the scores of the one before with better ones.
+        scores: dict[int, int] = {}
+        if not names_only:
+            for candidate in matches:
+                scores.update(dict.fromkeys(self.description_postings.get(candidate, ()), DESCRIPTION))
+        for candidate in matches:
+            if candidate != word:
+                scores.update(dict.fromkeys(self.name_postings.get(candidate, ()), NAME_PREFIX))
+        scores.update(dict.fromkeys(self.name_postings.get(word, ()), NAME_WORD))
+        return scores
+
+    def search(self, query: str, limit: int) -> list[int]:
+        """The slots of the best matches for the query, best first."""
+        searched = query_words(query)
+        if not searched:
+            return []
+        if len(searched) == 1:
+            # Any match in a name beats every match in a description, so those are only read if there aren't enough.
+            totals = self._live(self._scores(searched[0], names_only=True))
+            if len(totals) < limit:
+                totals = self._live(self._scores(searched[0], names_only=False))
+        else:
+            # Start from the word with the fewest matches, and only keep products every other word matches too.
+            per_word = sorted((self._scores(word, names_only=False) for word in searched), key=len)
+            totals = self._live(per_word[0])
+            for scores in per_word[1:]:
+                totals = {slot: total + scores[slot] for slot, total in totals.items() if slot in scores}
+        if not totals:
+            return []
+        prefix = ' '.join(searched)
+        names = self.names
+        return heapq.nsmallest(limit, totals, key=lambda slot: (
+            -(totals[slot] + (NAME_STARTS if names[slot].lower().startswith(prefix) else 0)),
+            len(names[slot]), names[slot]))
+
+    def _live(self, scores: dict[int, int]) -> dict[int, int]:
+        if self.removed:
+            return {slot: score for slot, score in scores.items() if self.alive[slot]}
+        return scores
+
+    def result(self, slot: int) -> dict[str, Any]:
+        return {'id': self.ids[slot], 'name': self.names[slot], 'price': self.prices[slot], 'stock': self.stocks[slot]}
+
+
+class ProductSearch:
+    """Loads the index on first use, applies writes to it, rebuilds it when it's old, and caches recent results."""
+
+    def __init__(self, load: Callable[[], Iterable[dict[str, Any]]], refresh: float):
+        self._load = load
+        self.refresh = refresh
+        self.index: Optional[SearchIndex] = None
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._rebuilding = False
+        # Writes made while a rebuild reads the snapshot, to apply to the new index.
+        self._pending: list[tuple[str, Any]] = []
+        # The ranked slots of recent queries. They're kept across price and stock changes, read when returned.
+        self._results: OrderedDict[tuple[str, int], list[int]] = OrderedDict()
+        # Counts the times the cached results were cleared, so a search that overlapped one doesn't cache its result.
+        self._generation = 0
+        self.rebuilds = 0
+
+    def search(self, query: str, limit: int) -> list[dict[str, Any]]:
+        """The best matches for the query, best first, with their current price and stock."""
+        if self.index is None:
+            self._build()
+        elif self.refresh > 0 and time.monotonic() - self.loaded_at > self.refresh:
+            self._rebuild_in_background()
+        key = (query.lower(), limit)
+        with self._lock:
+            index, generation = self.index, self._generation
+            slots = self._results.get(key)
+            if slots is not None:
+                self._results.move_to_end(key)
+        if slots is None:
+            # Scanned outside the lock, so writes and other searches go on meanwhile.
+            slots = index.search(query, limit)
+            with self._lock:
+                if generation == self._generation:
+                    self._results[key] = slots
+                    if len(self._results) > RESULT_CACHE_SIZE:
+                        self._results.popitem(last=False)
+        return [index.result(slot) for slot in slots]
+
+    def upsert(self, product: dict[str, Any]):
+        self._write('upsert', product)
+
+    def remove(self, product_id: str):
+        self._write('remove', product_id)
+
+    def expire(self):
+        """Rebuild the index in the background, e.g. after missing some product events."""
+        if self.index is not None:
+            self._rebuild_in_background()
+
+    def _write(self, operation: str, argument: Any):
+        with self._lock:
+            if self.index is None:
+                return
+            if self._rebuilding:
+                self._pending.append((operation, argument))
+            slots = len(self.index.ids), self.index.removed
+            getattr(self.index, operation)(argument)
+            if (len(self.index.ids), self.index.removed) != slots:
+                # The product was added, moved or removed. A price or stock change leaves the ranking as it was.
+                self._results.clear()
+                self._generation += 1
+            compact = self.index.removed > max(1000, len(self.index))
+        if compact:
+            # Most slots are dead, e.g. after many renames, so read a compact index.
+            self._rebuild_in_background()
+
+    def _build(self):
+        # Only one thread reads the snapshot. The others wait for it.
+        with self._load_lock:
+            if self.index is None:
+                self._swap(SearchIndex(self._load()))
+
+    def _swap(self, index: SearchIndex):
+        with self._lock:
+            for operation, argument in self._pending:
+                getattr(index, operation)(argument)
+            self._pending.clear()
+            self._rebuilding = False
+            self.index = index
+            self.loaded_at = time.monotonic()
+            self._results.clear()
+            self._generation += 1
+            self.rebuilds += 1
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def rebuild():
+            try:
+                self._swap(SearchIndex(self._load()))
+            except Exception:
+                # Keep searching the old index; the next search past the refresh interval tries again.
+                with self._lock:
+                    self._rebuilding = False
+                    self._pending.clear()
+                    self.loaded_at = time.monotonic()
+
+        threading.Thread(target=rebuild, daemon=True).start()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            index = self.index
+            return {'products': len(index) if index else 0,
+                    'words': len(index.vocabulary) + len(index.added) if index else 0,
+                    'rebuilds': self.rebuilds, 'cachedResults': len(self._results)}
+
+
+def parse_search(query: Optional[str], limit: Optional[str]) -> tuple[str, int]:
+    """Parse the q and limit query parameters. Raises InvalidSearchError if q is empty or limit is out of range."""
+    if not query or not query_words(query):
+        raise InvalidSearchError(f'q must have a word of at least {MIN_WORD_LENGTH} letters or digits.')
+    if limit is None:
+        return query, 10
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_RESULTS:
+        raise InvalidSearchError(f'limit must be a number from 1 to {MAX_RESULTS}.')
+    return query, int(limit)
+
+
+def load_products() -> Iterable[dict[str, Any]]:
+    """Every product, read a page at a time."""
+    success = client.query(queries.product_rows_page(None, LOAD_PAGE_SIZE))
+    while True:
+        rows, after = page_of(success)
+        yield from rows
+        if not after:
+            return
+        success = client.query(queries.product_rows_page(after, LOAD_PAGE_SIZE))
+
+
+product_search = ProductSearch(load_products, REFRESH)
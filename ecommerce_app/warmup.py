@@ -0,0 +1,92 @@
+"""
+Optional warm-up of a new worker process, for deployments that scale to zero and start a process when a request comes
+in.
+
+Importing the app does as little as it can: the Fauna client is built the first time it's used (see
+`LazyFaunaClient`), and the binary format libraries are imported the first time they're asked for. Left alone, the
+first request pays for all of it, and for opening a connection to Fauna. With WARM_UP=true, a background thread does
+this work as soon as the app is imported, while the server starts and the first request is on its way:
+
+- builds the Fauna client and opens WARM_UP_CONNECTIONS connections, each with a `ping` query;
+- compiles every registered projection (see `models/projections.py`);
+- imports the installed binary format libraries (see `negotiation.py`).
+
+A warm-up that fails, e.g. because Fauna can't be reached yet, is recorded in `stats` and otherwise ignored. The first
+requests then do the work as they would have without it.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from fauna.errors import FaunaException
+
+from ecommerce_app import negotiation, queries
+from ecommerce_app.config import env_bool, env_int
+from ecommerce_app.models import projections
+
+ENABLED = env_bool('WARM_UP', False)
+CONNECTIONS = env_int('WARM_UP_CONNECTIONS', 2)
+
+_stats: dict[str, Any] = {'state': 'off'}
+
+
+def _preload() -> float:
+    started = time.perf_counter()
+    projections.preload()
+    negotiation.preload()
+    return time.perf_counter() - started
+
+
+def _finish(started: float, preload: float, connections: int, errors: int) -> dict[str, Any]:
+    _stats.update(state='failed' if connections and errors == connections else 'done', connections=connections - errors,
+                  errors=errors, preloadMs=round(preload * 1000, 1),
+                  totalMs=round((time.perf_counter() - started) * 1000, 1))
+    return stats()
+
+
+def warm_up(client: Any, connections: int = CONNECTIONS) -> dict[str, Any]:
+    """
+    Build the client, open its connections and preload the app's compiled queries and codecs.
+    :param client: The shared Fauna client, usually `fauna_client.client`.
+    :param connections: How many connections to open. The pings are sent at once, so each opens its own.
+    :return: The warm-up's stats, as also returned by `stats`.
+    """
+    _stats.update(state='running')
+    started = time.perf_counter()
+    errors = 0
+    with ThreadPoolExecutor(max(1, connections)) as pool:
+        pings = [pool.submit(client.query, queries.ping()) for _ in range(connections)]
+        # Preloading only needs the CPU, so it's done while the pings wait on Fauna.
+        preload = _preload()
+        for ping in pings:
+            try:
+                ping.result()
+            except FaunaException:
+                errors += 1
+    return _finish(started, preload, connections, errors)
+
+
+def start(client: Any):
+    """Warm up in a background thread, so the server can start listening meanwhile."""
+    _stats.update(state='starting')
+    threading.Thread(target=warm_up, args=(client,), name='warm-up', daemon=True).start()
+
+
+async def awarm_up(client: Any, connections: int = CONNECTIONS) -> dict[str, Any]:
+    """The warm-up of the async app: the same, with the pings sent concurrently on its event loop."""
+    _stats.update(state='running')
+    started = time.perf_counter()
+    preload = _preload()
+    results = await asyncio.gather(*(client.query(queries.ping()) for _ in range(connections)),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, FaunaException):
+            raise result
+    errors = sum(isinstance(result, FaunaException) for result in results)
+    return _finish(started, preload, connections, errors)
+
+
+def stats() -> dict[str, Any]:
+    return dict(_stats)
@@ -0,0 +1,103 @@
+"""
+Compute the OrderStats of every customer from their orders.
+
+Checkout and order updates keep each customer's OrderStats up to date (see updateOrderStats in
+schema/functions.fsl), but orders placed before the collection existed aren't in them. Run this once after pushing
+the schema:
+
+    FAUNA_SECRET=<secret> python -m scripts.backfill_order_stats
+
+Customers are read a page at a time, and --workers of each page are backfilled at once. Each worker pages through its
+customer's orders with Order.byCustomer, adds up the stats of each page, and stores the totals. If an order of the
+customer changes status during the scan, the stored stats change too, so the totals are thrown away and the customer
+is scanned again. It's safe to run while the app takes orders, and to run again.
+"""
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, Optional
+
+from fauna.errors import FaunaException
+
+from ecommerce_app import queries
+from ecommerce_app.fauna_client import client
+
+# Scans of one customer, before giving up on them because their orders keep changing.
+MAX_ATTEMPTS = 5
+
+EMPTY = {'processing': 0, 'shipped': 0, 'delivered': 0, 'spend': 0, 'lastOrderAt': None}
+
+
+def add_stats(total: dict[str, Any], page: dict[str, Any]) -> dict[str, Any]:
+    """The stats of two sets of orders together."""
+    latest = [at for at in (total.get('lastOrderAt'), page.get('lastOrderAt')) if at is not None]
+    return {
+        'processing': total['processing'] + page['processing'],
+        'shipped': total['shipped'] + page['shipped'],
+        'delivered': total['delivered'] + page['delivered'],
+        'spend': total['spend'] + page['spend'],
+        'lastOrderAt': max(latest) if latest else None,
+    }
+
+
+def scan(customer_id: str, page_size: int) -> tuple[dict[str, Any], Optional[int]]:
+    """The stats of all the customer's orders, and the version of their stored stats when the scan started."""
+    page = client.query(queries.order_stats_page(customer_id, None, page_size)).data
+    # Fauna leaves null fields out of objects.
+    version, stats = page.get('version'), add_stats(EMPTY, page['stats'])
+    while page.get('after'):
+        page = client.query(queries.order_stats_page(customer_id, page['after'], page_size)).data
+        stats = add_stats(stats, page['stats'])
+    return stats, version
+
+
+def backfill(customer_id: str, page_size: int) -> dict[str, Any]:
+    """Scan the customer's orders and store their stats, scanning again if they changed meanwhile."""
+    for _ in range(MAX_ATTEMPTS):
+        stats, version = scan(customer_id, page_size)
+        if client.query(queries.save_order_stats(customer_id, stats, version)).data:
+            return stats
+    raise RuntimeError(f'the orders changed during each of {MAX_ATTEMPTS} scans')
+
+
+def customer_id_pages(page_size: int) -> Iterator[list[str]]:
+    next_token = None
+    while True:
+        page = client.query(queries.customer_ids_page(next_token, page_size)).data
+        yield page['data']
+        next_token = page.get('after')
+        if not next_token:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8, help='Customers backfilled at once.')
+    parser.add_argument('--page-size', type=int, default=100, help='Customers or orders read per query.')
+    args = parser.parse_args()
+
+    customers = orders = failed = 0
+
+    def run(customer_id: str) -> tuple[str, Optional[dict[str, Any]], Optional[Exception]]:
+        try:
+            return customer_id, backfill(customer_id, args.page_size), None
+        except (FaunaException, RuntimeError) as err:
+            return customer_id, None, err
+
+    with ThreadPoolExecutor(args.workers) as pool:
+        # A page of customers at a time, so the customers waiting for a worker are bounded.
+        for page in customer_id_pages(args.page_size):
+            for customer_id, stats, error in pool.map(run, page):
+                customers += 1
+                if error is not None:
+                    failed += 1
+                    print(f'customer {customer_id}: {error}')
+                else:
+                    orders += stats['processing'] + stats['shipped'] + stats['delivered']
+
+    print(f'backfilled {customers - failed} of {customers} customers, counting {orders} orders')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Check, and repair, the stored total and itemCount of orders.
+
+Order.total used to be a computed field that read every item and product. It is now stored, and kept up to date by
+the cart functions in schema/functions.fsl. The migration in schema/collections.fsl starts existing orders at 0, so
+run this once with --backfill after pushing the schema to set them from their items:
+
+    FAUNA_SECRET=<secret> python -m scripts.backfill_order_totals --backfill
+
+The backfill only sets the orders that are still at 0, and uses today's prices, since those the orders were placed
+at aren't recorded. Run it before scripts/backfill_order_stats.py, which adds up the totals.
+
+Without --backfill it checks and repairs the carts only. A cart can drift if a product's price changes while it's in
+the cart. Checkout recomputes the total, which then stays fixed, so placed orders are left alone.
+
+With --check it only reports the orders whose stored values differ from their items, and exits with status 1 if
+there are any.
+"""
+import argparse
+import sys
+
+from ecommerce_app import queries
+from ecommerce_app.fauna_client import client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help="Report the drifted orders, but don't repair them.")
+    parser.add_argument('--backfill', action='store_true',
+                        help="Set the orders of any status still at the migration's 0, instead of checking the carts.")
+    parser.add_argument('--page-size', type=int, default=100, help='Orders checked per transaction.')
+    args = parser.parse_args()
+
+    checked = drifted = 0
+    next_token = None
+    while True:
+        query = queries.reconcile_order_totals(next_token, args.page_size, fix=not args.check, backfill=args.backfill)
+        page = client.query(query).data
+        checked += page['checked']
+        for order in page['drifted']:
+            drifted += 1
+            print(f"order {order['id']}: stored {order['stored']}, items {order['expected']}")
+        next_token = page.get('after')
+        if not next_token:
+            break
+
+    action = 'found' if args.check else 'repaired'
+    print(f'checked {checked} orders, {action} {drifted} with a wrong total or item count')
+    sys.exit(1 if args.check and drifted else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from fauna.errors import ThrottlingError
+
+from ecommerce_app import admission
+from ecommerce_app.admission import AdmissionController, Rejected, priority_of
+from ecommerce_app.app import app
+from ecommerce_app.metrics import RequestMetrics
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_priority_of(self):
+        self.assertEqual(priority_of('orders.post_order_checkout', 'orders'), 'critical')
+        self.assertEqual(priority_of('products.get_products', 'products'), 'browse')
+        self.assertEqual(priority_of('customers.get_customer', 'customers'), 'standard')
+        self.assertIsNone(priority_of('products.get_product_events', 'products'))
+        self.assertIsNone(priority_of('get_metrics', None))
+
+    def test_browse_is_turned_away_first(self):
+        controller = AdmissionController(limit=4, queue_size=0)
+        # Browsing may use half the limit, checkout all of it.
+        tickets = [controller.acquire('products.get_products', 'browse') for _ in range(2)]
+        with self.assertRaises(Rejected) as rejected:
+            controller.acquire('products.get_products', 'browse')
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        tickets += [controller.acquire('orders.post_order_checkout', 'critical') for _ in range(2)]
+        for ticket in tickets:
+            controller.release(ticket)
+        self.assertEqual(controller.running, 0)
+
+    def test_waiting_requests_start_by_priority(self):
+        controller = AdmissionController(limit=1)
+        ticket = controller.acquire('customers.get_customer', 'standard')
+        started = []
+
+        def request(route, priority):
+            started.append(controller.acquire(route, priority).priority)
+
+        threads = [threading.Thread(target=request, args=('customers.get_customer', 'standard')),
+                   threading.Thread(target=request, args=('orders.post_order_checkout', 'critical'))]
+        threads[0].start()
+        while controller.waiting['standard'] == 0:
+            time.sleep(0.001)
+        threads[1].start()
+        while controller.waiting['critical'] == 0:
+            time.sleep(0.001)
+        # Both wait for the one slot. The checkout gets it first, though it came second.
+        controller.release(ticket)
+        while not started:
+            time.sleep(0.001)
+        self.assertEqual(started, ['critical'])
+        controller.release(admission.Ticket('orders.post_order_checkout', 'critical', time.monotonic()))
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(started, ['critical', 'standard'])
+
+    def test_route_limit(self):
+        controller = AdmissionController()
+        for _ in range(2):
+            controller.acquire('products.post_products_import', 'standard')
+        with self.assertRaises(Rejected) as rejected:
+            controller.acquire('products.post_products_import', 'standard')
+        self.assertEqual(rejected.exception.reason, 'route_limit')
+
+    def test_adaptive_limit(self):
+        controller = AdmissionController(limit=10, min_limit=2)
+        for _ in range(20):
+            controller.release(controller.acquire('products.get_products', 'browse'),
+                               RequestMetrics('products', '/products', queries=1, wall_ms=10))
+        self.assertGreater(controller.limit, 10)
+
+        limit = controller.limit
+        # Queries ten times slower than usual shrink the limit, once per cooldown.
+        for _ in range(5):
+            controller.release(controller.acquire('products.get_products', 'browse'),
+                               RequestMetrics('products', '/products', queries=1, wall_ms=100))
+        self.assertAlmostEqual(controller.limit, limit * admission.DECREASE, delta=0.5)
+        self.assertEqual(controller.decreases, 1)
+
+    def test_rejected_and_throttled_responses(self):
+        controller = AdmissionController(limit=4, queue_size=0)
+        with mock.patch.object(admission, 'admission', controller):
+            for _ in range(2):
+                controller.acquire('products.get_products', 'browse')
+            response = app.test_client().get('/products')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response.headers)
+
+            with mock.patch('ecommerce_app.routes.client') as mock_client:
+                mock_client.query.side_effect = ThrottlingError(429, 'limit_exceeded', 'Too many requests.')
+                response = app.test_client().get('/customers/1/orders')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response.headers)
+            self.assertEqual(controller.decreases, 1)
+            # The customer route's slot was given back when it finished.
+            self.assertEqual(controller.running, 2)
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from unittest import mock
+from unittest.mock import AsyncMock, Mock
+
+from fauna.encoding import QuerySuccess
+
+from ecommerce_app.search import ProductSearch
+
+try:
+    from ecommerce_app.asgi import app
+except ImportError:  # the async app's dependencies are optional, see requirements-async.txt
+    app = None
+
+
+@unittest.skipIf(app is None, 'requirements-async.txt is not installed')
+class TestAsgiApp(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.asgi.client')
+    def test_get_order(self, mock_client):
+        mock_response = Mock(QuerySuccess)
+        mock_response.data = {'version': [1], 'data': {'id': '123', 'status': 'cart'}}
+        mock_client.query = AsyncMock(return_value=mock_response)
+
+        async def get():
+            response = await app.test_client().get('/orders/123?fields=id,status')
+            return response.status_code, await response.get_json()
+
+        status, body = asyncio.run(get())
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {'id': '123', 'status': 'cart'})
+
+    def test_get_order_with_unknown_fields(self):
+        async def get():
+            response = await app.test_client().get('/orders/123?fields=bogus')
+            return response.status_code
+
+        self.assertEqual(asyncio.run(get()), 400)
+
+    @mock.patch('ecommerce_app.asgi.client')
+    def test_search_products(self, mock_client):
+        search = ProductSearch(lambda: [{'id': '1', 'name': 'Drone', 'description': 'Flies', 'price': 100, 'stock': 3}],
+                               refresh=0)
+
+        async def get(path):
+            response = await app.test_client().get(path)
+            return response.status_code, await response.get_json()
+
+        with mock.patch('ecommerce_app.asgi.product_search', search):
+            status, body = asyncio.run(get('/products/search?q=dro'))
+            self.assertEqual(status, 200)
+            self.assertEqual(body, {'data': [{'id': '1', 'name': 'Drone', 'price': 100, 'stock': 3}]})
+            self.assertEqual(asyncio.run(get('/products/search?q=%20'))[0], 400)
+        # Not read as a product with the id "search".
+        mock_client.query.assert_not_called()
+
+    @mock.patch('ecommerce_app.asgi.client')
+    def test_product_events_are_not_served(self, mock_client):
+        async def get():
+            response = await app.test_client().get('/products/events')
+            return response.status_code
+
+        self.assertEqual(asyncio.run(get()), 404)
+        mock_client.query.assert_not_called()
+
+    @mock.patch('ecommerce_app.asgi.client')
+    def test_catalog_import_and_export_are_not_served(self, mock_client):
+        async def statuses():
+            test_client = app.test_client()
+            export = await test_client.get('/products/export')
+            imported = await test_client.post('/products/import', data='{"name": "a"}')
+            return export.status_code, imported.status_code
+
+        self.assertEqual(asyncio.run(statuses()), (404, 404))
+        mock_client.query.assert_not_called()
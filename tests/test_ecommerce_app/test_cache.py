@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import Mock
+
+from ecommerce_app.cache import KeyValueBackend, MemoryBackend, ReadThroughCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeStore:
+    """A local stand-in for a shared key/value store."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class TestReadThroughCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_loads_once_while_fresh(self):
+        cache = ReadThroughCache('test', MemoryBackend(), ttl=10, clock=self.clock)
+        loader = Mock(return_value={'id': '1'})
+
+        self.assertEqual(cache.get_or_load('1', loader), {'id': '1'})
+        self.assertEqual(cache.get_or_load('1', loader), {'id': '1'})
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'staleHits': 0, 'evictions': 0})
+
+    def test_reloads_after_ttl(self):
+        cache = ReadThroughCache('test', MemoryBackend(), ttl=10, clock=self.clock)
+        loader = Mock(side_effect=['old', 'new'])
+
+        cache.get_or_load('1', loader)
+        self.clock.now += 11
+        self.assertEqual(cache.get_or_load('1', loader), 'new')
+
+    def test_evicts_least_recently_used(self):
+        cache = ReadThroughCache('test', MemoryBackend(max_size=2), ttl=10, clock=self.clock)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_serves_stale_while_revalidating(self):
+        cache = ReadThroughCache('test', MemoryBackend(), ttl=10, stale_ttl=5, clock=self.clock)
+        cache.set('1', 'old')
+        self.clock.now += 12
+        cache._refresh_in_background = Mock()
+
+        self.assertEqual(cache.get_or_load('1', Mock(return_value='new')), 'old')
+        cache._refresh_in_background.assert_called_once()
+        self.assertEqual(cache.stats()['staleHits'], 1)
+
+    def test_invalidate(self):
+        cache = ReadThroughCache('test', MemoryBackend(), ttl=10, clock=self.clock)
+        cache.set('1', 'value')
+        cache.invalidate('1')
+        self.assertIsNone(cache.get('1'))
+
+    def test_key_value_backend(self):
+        store = FakeStore()
+        cache = ReadThroughCache('test', KeyValueBackend(store), ttl=10, clock=self.clock)
+        cache.set('1', {'id': '1'})
+
+        other = ReadThroughCache('other', KeyValueBackend(store), ttl=10, clock=self.clock)
+        self.assertEqual(other.get('1'), {'id': '1'})
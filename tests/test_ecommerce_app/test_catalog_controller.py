@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna import Page
+from fauna.encoding import QuerySuccess
+from fauna.errors import AbortError
+
+from ecommerce_app.app import app
+
+
+def upsert_response(query, options=None):
+    """Answer an upsert_products query as Fauna would, creating every product in a known category."""
+    products = query.fragments[1].get()
+    response = Mock(QuerySuccess)
+    response.data = [{'id': product['name'], 'created': True} if product['category'] == 'electronics'
+                     else {'error': 'Category does not exist.'} for product in products]
+    return response
+
+
+class TestCatalogController(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.catalog_controller.IMPORT_BATCH_SIZE', 2)
+    @mock.patch('ecommerce_app.catalog_controller.client')
+    def test_import_ndjson(self, mock_client):
+        mock_client.query.side_effect = upsert_response
+        product = {'name': 'a', 'price': 1, 'description': 'b', 'stock': 2, 'category': 'electronics'}
+        rows = [product, {**product, 'name': 'b'}, {**product, 'name': 'c', 'category': 'books'},
+                {'name': 'd'}, {**product, 'name': 'e', 'price': 'free'}, {**product, 'name': 'f'}]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+
+        response = app.test_client().post('/products/import', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['created'], 3)
+        self.assertEqual(response.json['failed'], 4)
+        self.assertEqual(sorted(error['row'] for error in response.json['errors']), [3, 4, 5, 7])
+        # Three valid rows, two per transaction.
+        self.assertEqual(mock_client.query.call_count, 2)
+
+    @mock.patch('ecommerce_app.catalog_controller.client')
+    def test_import_csv(self, mock_client):
+        mock_client.query.side_effect = upsert_response
+        body = 'name,description,price,stock,category\na,"b, c",1,2,electronics\na,b,3,2,electronics\n'
+
+        response = app.test_client().post('/products/import', data=body, content_type='text/csv')
+        self.assertEqual(response.json['created'], 1)
+        # The first row is superseded by the second, which has the same name.
+        self.assertEqual(response.json['errors'][0]['row'], 1)
+        products = mock_client.query.call_args[0][0].fragments[1].get()
+        self.assertEqual(products, [{'name': 'a', 'description': 'b', 'price': 3, 'stock': 2, 'category': 'electronics'}])
+
+    @mock.patch('ecommerce_app.catalog_controller.IMPORT_BATCH_SIZE', 2)
+    @mock.patch('ecommerce_app.catalog_controller.client')
+    def test_import_same_name_in_two_batches(self, mock_client):
+        lock, in_flight, overlaps, written = threading.Lock(), set(), [], []
+
+        def upsert(query, options=None):
+            names = {product['name'] for product in query.fragments[1].get()}
+            with lock:
+                overlaps.extend(in_flight & names)
+                in_flight.update(names)
+            time.sleep(0.05)
+            with lock:
+                in_flight.difference_update(names)
+                written.extend(product['price'] for product in query.fragments[1].get() if product['name'] == 'a')
+            return upsert_response(query)
+
+        mock_client.query.side_effect = upsert
+        product = {'name': 'a', 'price': 1, 'description': 'b', 'stock': 2, 'category': 'electronics'}
+        rows = [product, {**product, 'name': 'b'}, {**product, 'price': 2}, {**product, 'name': 'c'}]
+        body = '\n'.join(json.dumps(row) for row in rows)
+
+        response = app.test_client().post('/products/import', data=body, content_type='application/x-ndjson')
+        self.assertEqual(response.json['created'], 4)
+        # The second batch waits for the first, so the later row is written last.
+        self.assertEqual(overlaps, [])
+        self.assertEqual(written, [1, 2])
+
+    @mock.patch('ecommerce_app.catalog_controller.client')
+    def test_import_failed_transaction(self, mock_client):
+        mock_client.query.side_effect = AbortError(400, 'abort', 'Constraint failure.')
+        product = {'name': 'a', 'price': 1, 'description': 'b', 'stock': 2, 'category': 'electronics'}
+
+        response = app.test_client().post('/products/import', data=json.dumps(product))
+        self.assertEqual(response.json['failed'], 1)
+        self.assertEqual(response.json['errors'], [{'row': 1, 'message': 'Constraint failure.'}])
+
+    @mock.patch('ecommerce_app.catalog_controller.client')
+    def test_export_csv(self, mock_client):
+        row = {'id': '1', 'name': 'a', 'description': 'b', 'price': 1, 'stock': 2, 'category': 'electronics'}
+        first, second = Mock(QuerySuccess), Mock(QuerySuccess)
+        first.data = Page(data=[row], after='abc')
+        second.data = {'data': [{**row, 'id': '2'}], 'after': None}
+        mock_client.query.side_effect = [first, second]
+
+        response = app.test_client().get('/products/export?format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.get_data(as_text=True).splitlines(),
+                         ['id,name,description,price,stock,category', '1,a,b,1,2,electronics', '2,a,b,1,2,electronics'])
+        self.assertEqual(mock_client.query.call_args[0][0].fragments[1].get(), 'abc')
+
+    def test_export_unknown_format(self):
+        response = app.test_client().get('/products/export?format=xml')
+        self.assertEqual(response.status_code, 400)
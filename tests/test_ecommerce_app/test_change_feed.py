@@ -0,0 +1,96 @@
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import QuerySuccess
+from fauna.query.models import Document, Module
+
+from ecommerce_app import change_feed
+from ecommerce_app.app import app
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+from ecommerce_app.change_feed import Broadcaster
+
+TS = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def product_event(event_type, cursor, product_id='1', stock=10, price=100):
+    product = Document(id=product_id, ts=TS, coll=Module('Product'), data={'stock': stock, 'price': price})
+    return {'type': event_type, 'data': product, 'cursor': cursor}
+
+
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        patchers = [
+            mock.patch.object(change_feed, 'broadcaster', Broadcaster(history=3)),
+            mock.patch.object(change_feed, 'snapshot', {}),
+            mock.patch.object(change_feed, 'product_cache', ReadThroughCache('products', MemoryBackend(), ttl=30)),
+            mock.patch.object(change_feed, 'order_cache', ReadThroughCache('orders', MemoryBackend(), ttl=30)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_replays_missed_messages(self):
+        broadcaster = change_feed.broadcaster
+        for cursor in ('a', 'b', 'c', 'd'):
+            broadcaster.publish(cursor, {'id': '1'})
+
+        self.assertEqual([message_id for message_id, _ in broadcaster.subscribe('b')[1]], ['c', 'd'])
+        self.assertEqual(broadcaster.subscribe()[1], [])
+        # 'a' is no longer kept, so the client may have missed messages.
+        self.assertIsNone(broadcaster.subscribe('a')[1])
+
+    def test_product_events(self):
+        change_feed.product_cache.set('1', {'version': 'v1', 'data': {}})
+        subscription, _ = change_feed.broadcaster.subscribe()
+
+        change_feed.on_product_event(product_event('add', 'a'))
+        change_feed.on_product_event(product_event('update', 'b', stock=9))
+        # Nothing the endpoint pushes changed.
+        change_feed.on_product_event(product_event('update', 'c', stock=9))
+        change_feed.on_product_event(product_event('remove', 'd', stock=9))
+
+        self.assertIsNone(change_feed.product_cache.get('1'))
+        self.assertEqual(change_feed.snapshot, {})
+        messages = [subscription.messages.get_nowait() for _ in range(subscription.messages.qsize())]
+        self.assertEqual(messages, [('a', {'id': '1', 'stock': 10, 'price': 100}), ('b', {'id': '1', 'stock': 9}),
+                                    ('d', {'id': '1', 'removed': True})])
+
+    def test_order_events(self):
+        change_feed.order_cache.set('5', {'version': 'v1', 'data': {}})
+        order = Document(id='5', ts=TS, coll=Module('Order'))
+        change_feed.on_order_event({'type': 'update', 'data': order, 'cursor': 'a'})
+        self.assertIsNone(change_feed.order_cache.get('5'))
+
+    def test_sse_messages(self):
+        broadcaster = change_feed.broadcaster
+        broadcaster.publish('a', {'id': '1', 'stock': 3})
+        broadcaster.publish('b', {'id': '2', 'stock': 4})
+        subscription, replay = broadcaster.subscribe('a')
+        messages = change_feed.sse_messages(subscription, replay, ['2'])
+
+        self.assertEqual(next(messages), 'retry: 3000\n\n')
+        self.assertEqual(next(messages), 'id: b\nevent: product\ndata: {"id": "2", "stock": 4}\n\n')
+        # The stream couldn't be resumed, so the client has to read its products again.
+        broadcaster.reset()
+        self.assertEqual(next(messages), 'event: reset\ndata: {}\n\n')
+
+    def test_endpoint_needs_the_change_feed(self):
+        response = app.test_client().get('/products/events')
+        self.assertEqual(response.status_code, 503)
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_cached_order(self, mock_client):
+        mock_client.query.return_value = Mock(QuerySuccess, data={'version': [1, 2], 'data': {'id': '5'}})
+
+        with mock.patch('ecommerce_app.order_controller.order_cache', change_feed.order_cache):
+            for _ in range(2):
+                self.assertEqual(app.test_client().get('/orders/5').json, {'id': '5'})
+            self.assertEqual(mock_client.query.call_count, 1)
+
+            # Until the change feed says it changed.
+            change_feed.on_order_event({'type': 'update', 'data': Document(id='5', ts=TS, coll=Module('Order'))})
+            app.test_client().get('/orders/5')
+            self.assertEqual(mock_client.query.call_count, 2)
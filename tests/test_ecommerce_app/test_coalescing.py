@@ -0,0 +1,81 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import QuerySuccess
+from fauna.errors import AbortError, QueryRuntimeError
+
+from ecommerce_app import coalescing, queries
+from ecommerce_app.app import app
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+from ecommerce_app.coalescing import SingleFlight
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        not_found_cache = ReadThroughCache('not_found', MemoryBackend(), ttl=5)
+        patcher = mock.patch.object(coalescing, 'not_found_cache', not_found_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def call():
+            calls.append(1)
+            release.wait(5)
+            return {'id': '1'}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do(('product', '1'), call)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Let every other thread join the call in flight before it returns.
+        while flights.stats().get('product', {}).get('collapsed', 0) < 4:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'id': '1'}] * 5)
+        self.assertEqual(flights.stats(), {'product': {'queries': 1, 'collapsed': 4}})
+
+    def test_single_flight_shares_errors(self):
+        flights = SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.do(('order', '1'), Mock(side_effect=ValueError()))
+        # The key is free again once the call is done.
+        self.assertEqual(flights.do(('order', '1'), lambda: 'ok'), 'ok')
+
+    @mock.patch('ecommerce_app.customer_controller.client')
+    @mock.patch('ecommerce_app.routes.client')
+    def test_not_found_is_cached(self, mock_client, mock_controller_client):
+        mock_client.query.side_effect = AbortError(
+            status_code=400, code='abort', message='Query aborted.', abort=queries.CUSTOMER_NOT_FOUND)
+
+        for _ in range(3):
+            response = app.test_client().get('/customers/new@example.com?key=email')
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(mock_client.query.call_count, 1)
+
+        # Creating the customer forgets that it wasn't found.
+        mock_controller_client.query.return_value = Mock(QuerySuccess, data={'id': '1'})
+        app.test_client().post('/customers', json={'name': 'New', 'email': 'new@example.com', 'address': {
+            'street': '1 Main St', 'city': 'Springfield', 'state': 'IL', 'postalCode': '62701', 'country': 'USA'}})
+        app.test_client().get('/customers/new@example.com?key=email')
+        self.assertEqual(mock_client.query.call_count, 2)
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_other_errors_are_not_cached(self, mock_client):
+        mock_client.query.side_effect = QueryRuntimeError(status_code=400, code='invalid_argument', message='Nope.')
+
+        for _ in range(2):
+            app.test_client().get('/orders/123')
+        self.assertEqual(mock_client.query.call_count, 2)
@@ -0,0 +1,65 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import QuerySuccess
+
+from ecommerce_app import routes
+from ecommerce_app.app import app
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+
+ORDER = {'id': '123', 'status': 'cart'}
+
+
+def success(data):
+    response = Mock(QuerySuccess)
+    response.data = data
+    return response
+
+
+class TestConditionalGet(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_not_modified(self, mock_client):
+        mock_client.query.side_effect = [success({'version': [1, 2], 'data': ORDER}), success([1, 2])]
+
+        response = app.test_client().get('/orders/123')
+        self.assertEqual(response.json, ORDER)
+        etag = response.headers['ETag']
+
+        # Only the timestamps are read, and the body isn't sent.
+        response = app.test_client().get('/orders/123', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(mock_client.query.call_args.args[0].template, 'order_timestamps')
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_modified(self, mock_client):
+        mock_client.query.side_effect = [success({'version': [1, 2], 'data': ORDER}), success([1, 3]),
+                                         success({'version': [1, 3], 'data': {**ORDER, 'status': 'processing'}})]
+
+        etag = app.test_client().get('/orders/123').headers['ETag']
+        response = app.test_client().get('/orders/123', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'processing')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_fields_change_the_etag(self, mock_client):
+        mock_client.query.return_value = success({'version': [1, 2], 'data': ORDER})
+
+        full = app.test_client().get('/orders/123').headers['ETag']
+        sparse = app.test_client().get('/orders/123?fields=id,status').headers['ETag']
+        self.assertNotEqual(full, sparse)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_cached_product(self, mock_client):
+        mock_client.query.return_value = success({'version': [1, 2], 'data': {'id': '1', 'name': 'Drone'}})
+
+        with mock.patch.object(routes, 'product_cache', ReadThroughCache('products', MemoryBackend(), ttl=30)):
+            etag = app.test_client().get('/products/1').headers['ETag']
+            response = app.test_client().get('/products/1', headers={'If-None-Match': etag})
+        # Answered from the cache, without a query.
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(mock_client.query.call_count, 1)
@@ -0,0 +1,74 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna import fql
+from fauna.encoding import QueryStats, QuerySuccess
+from fauna.errors import AbortError, ContendedTransactionError, ThrottlingError
+
+from ecommerce_app import metrics, queries
+from ecommerce_app.fauna_client import ClientConfig, FaunaClient
+
+
+def throttled():
+    return ThrottlingError(status_code=429, code='limit_exceeded', message='Too many requests.')
+
+
+class TestFaunaClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = FaunaClient(ClientConfig(max_attempts=3, max_contention_attempts=5, base_backoff=0,
+                                               max_backoff=0))
+        self.client._client = Mock()
+
+    def test_retries_throttling_errors(self):
+        success = Mock(QuerySuccess, stats=QueryStats({}))
+        self.client._client.query.side_effect = [throttled(), throttled(), success]
+
+        self.assertIs(self.client.query(fql('Product.all()')), success)
+        self.assertEqual(self.client._client.query.call_count, 3)
+        self.assertEqual(self.client.pool_stats.snapshot()['retries'], 2)
+
+    def test_gives_up_after_max_attempts(self):
+        self.client._client.query.side_effect = [throttled(), throttled(), throttled()]
+
+        with self.assertRaises(ThrottlingError):
+            self.client.query(fql('Product.all()'))
+        self.assertEqual(self.client._client.query.call_count, 3)
+
+    def test_retries_contended_transactions(self):
+        contended = ContendedTransactionError(status_code=409, code='conflict', message='Contended.')
+        success = Mock(QuerySuccess, stats=QueryStats({}))
+        self.client._client.query.side_effect = [contended] * 4 + [success]
+
+        with mock.patch.object(metrics, 'record_retry') as record_retry:
+            self.assertIs(self.client.query(queries.checkout('123', None)), success)
+        self.assertEqual(self.client._client.query.call_count, 5)
+        self.assertEqual([call.args[1] for call in record_retry.call_args_list], ['contention'] * 4)
+
+        self.client._client.query.side_effect = [contended] * 5
+        with self.assertRaises(ContendedTransactionError):
+            self.client.query(queries.checkout('123', None))
+
+    def test_does_not_retry_other_errors(self):
+        self.client._client.query.side_effect = AbortError(status_code=400, code='abort', message='Nope.')
+
+        with self.assertRaises(AbortError):
+            self.client.query(fql('abort("Nope.")'))
+        self.assertEqual(self.client._client.query.call_count, 1)
+
+    @mock.patch('ecommerce_app.fauna_client.time.monotonic', side_effect=[0.0, 0.0, 100.0])
+    def test_stops_retrying_when_budget_is_spent(self, _monotonic):
+        self.client._client.query.side_effect = throttled()
+
+        with self.assertRaises(ThrottlingError):
+            self.client.query(fql('Product.all()'))
+        self.assertEqual(self.client._client.query.call_count, 1)
+
+    def test_tags_queries_with_their_template(self):
+        self.client._client.query.return_value = Mock(QuerySuccess, stats=QueryStats({}))
+
+        self.client.query(queries.product('123'))
+
+        opts = self.client._client.query.call_args.args[1]
+        self.assertEqual(opts.query_tags, {'template': 'product'})
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import FaunaEncoder, QuerySuccess
+
+from ecommerce_app.app import app
+from ecommerce_app.includes import CUSTOMER_INCLUDES, InvalidIncludesError, parse_includes, parse_orders_page_size
+
+
+def fql_text(query) -> str:
+    """The FQL text of a query, without its arguments."""
+    def text(fragment):
+        if 'fql' in fragment:
+            return ''.join(part if isinstance(part, str) else text(part) for part in fragment['fql'])
+        return '?'
+    return text(FaunaEncoder.encode(query))
+
+
+class TestIncludes(unittest.TestCase):
+
+    def test_parse_includes(self):
+        self.assertIsNone(parse_includes(CUSTOMER_INCLUDES, None))
+        self.assertEqual(parse_includes(CUSTOMER_INCLUDES, 'cart, orders.items'),
+                         frozenset(('cart', 'orders', 'orders.items')))
+        for value in ('bogus', 'orders.items.product', 'cart.customer'):
+            with self.assertRaises(InvalidIncludesError):
+                parse_includes(CUSTOMER_INCLUDES, value)
+
+    def test_parse_orders_page_size(self):
+        self.assertEqual(parse_orders_page_size('3'), 3)
+        for value in ('0', '-1', '1000'):
+            with self.assertRaises(InvalidIncludesError):
+                parse_orders_page_size(value)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_customer_with_includes(self, mock_client):
+        customer = {'id': '1', 'cart': {'id': '5', 'items': []}, 'orders': {'data': [{'id': '5'}], 'after': None}}
+        mock_client.query.return_value = Mock(QuerySuccess, data=customer)
+
+        response = app.test_client().get('/customers/1?include=cart,orders&ordersPageSize=3')
+        self.assertEqual(response.json, customer)
+        self.assertIn('ETag', response.headers)
+        # One query for the customer, its cart and its orders.
+        mock_client.query.assert_called_once()
+        query = mock_client.query.call_args[0][0]
+        self.assertEqual(query.template, 'customer_with_includes')
+        text = fql_text(query)
+        self.assertIn('let order = customer?.cart', text)
+        self.assertIn('Order.byCustomer(customer).map(order => {id: order.id, status: order.status', text)
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_order_with_includes(self, mock_client):
+        mock_client.query.return_value = Mock(QuerySuccess, data={'id': '5', 'customer': {'id': '1'}})
+
+        response = app.test_client().get('/orders/5?include=customer')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('let customer = order.customer', fql_text(mock_client.query.call_args[0][0]))
+
+        response = app.test_client().get('/orders/5?include=items')
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import QueryStats, QuerySuccess
+
+from ecommerce_app import metrics
+from ecommerce_app.app import app
+from ecommerce_app.fauna_client import ClientConfig, FaunaClient
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('route',), (0.1, 1))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(('/a"b',), value)
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{route="/a\\"b",le="1"} 2',
+            'test_seconds_bucket{route="/a\\"b",le="+Inf"} 3',
+            'test_seconds_sum{route="/a\\"b"} 5.55',
+            'test_seconds_count{route="/a\\"b"} 3',
+        ])
+
+    def test_queries_are_labelled_with_route_and_template(self):
+        stats = QueryStats({'read_ops': 7, 'compute_ops': 2, 'query_time_ms': 4})
+        fauna_client = FaunaClient(ClientConfig())
+        fauna_client._client = Mock()
+        fauna_client._client.query.return_value = Mock(QuerySuccess, data={'version': [1], 'data': {'id': '123'}},
+                                                         stats=stats)
+
+        app.debug = True
+        try:
+            with mock.patch('ecommerce_app.order_controller.client', fauna_client):
+                response = app.test_client().get('/orders/123')
+        finally:
+            app.debug = False
+        self.assertEqual(response.headers['X-Fauna-Queries'], '1')
+        self.assertEqual(response.headers['X-Fauna-Read-Ops'], '7')
+        self.assertEqual(response.headers['X-Fauna-Templates'], 'order')
+
+        body = app.test_client().get('/metrics').get_data(as_text=True)
+        self.assertIn('fauna_query_read_ops_sum{blueprint="orders",route="/orders/<order_id>",template="order"} 7',
+                      body)
+        self.assertIn('fauna_queries_per_request_count{blueprint="orders",route="/orders/<order_id>"}', body)
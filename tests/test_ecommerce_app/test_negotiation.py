@@ -0,0 +1,74 @@
+import json
+import unittest
+import zlib
+from datetime import datetime, timezone
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna import Page
+from fauna.encoding import QuerySuccess
+
+from ecommerce_app.app import app
+from ecommerce_app.negotiation import zstandard
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+ORDER = {'id': '5', 'status': 'processing', 'createdAt': datetime(2024, 1, 1, tzinfo=timezone.utc)}
+PRODUCTS = [{'id': str(i), 'name': f'Product {i}', 'description': 'A product', 'price': 100 + i}
+            for i in range(100)]
+
+
+class TestNegotiation(unittest.TestCase):
+
+    def get(self, path: str, **headers):
+        with mock.patch('ecommerce_app.order_controller.client') as order_client, \
+                mock.patch('ecommerce_app.routes.client') as routes_client:
+            order_client.query.return_value = Mock(QuerySuccess, data=ORDER)
+            routes_client.query.return_value = Mock(QuerySuccess, data=Page(data=PRODUCTS, after=None))
+            return app.test_client().get(path, headers=headers)
+
+    def test_json_by_default(self):
+        response = self.get('/orders/5?include=customer', Accept='*/*')
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.json['createdAt'], 'Mon, 01 Jan 2024 00:00:00 GMT')
+        self.assertIn('Accept', response.vary)
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.get('/orders/5?include=customer', Accept='application/msgpack')
+        self.assertEqual(response.mimetype, 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.data, timestamp=3), ORDER)
+
+        response = self.get('/products', Accept='application/msgpack, application/json;q=0.5')
+        self.assertEqual(msgpack.unpackb(response.data), {'data': PRODUCTS, 'next': None})
+
+    @unittest.skipIf(cbor2 is None, 'cbor2 is not installed')
+    def test_cbor(self):
+        response = self.get('/orders/5?include=customer', Accept='application/cbor')
+        self.assertEqual(response.mimetype, 'application/cbor')
+        self.assertEqual(cbor2.loads(response.data), ORDER)
+
+    def test_gzip(self):
+        response = self.get('/products', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertEqual(json.loads(zlib.decompress(response.data, wbits=31)), {'data': PRODUCTS, 'next': None})
+        # Too small to be worth compressing.
+        response = self.get('/orders/5?include=customer', **{'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.json['id'], '5')
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        response = self.get('/products', **{'Accept-Encoding': 'gzip, zstd'})
+        self.assertEqual(response.headers['Content-Encoding'], 'zstd')
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(response.data)
+        self.assertEqual(json.loads(body), {'data': PRODUCTS, 'next': None})
@@ -0,0 +1,85 @@
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import FaunaEncoder, QuerySuccess
+from fauna.errors import AbortError
+
+from ecommerce_app import queries
+from ecommerce_app.app import app
+from scripts import backfill_order_stats
+
+SUMMARY = {'orderCount': 3, 'ordersByStatus': {'processing': 1, 'shipped': 1, 'delivered': 1},
+           'lifetimeSpend': 27000, 'lastOrderAt': None, 'orders': {'data': [], 'after': None}}
+EARLY, LATE = datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def stats(processing: int, spend: int, last_order_at: datetime) -> dict:
+    return {'processing': processing, 'shipped': 0, 'delivered': 0, 'spend': spend, 'lastOrderAt': last_order_at}
+
+
+class TestOrderStats(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_get_order_summary(self, mock_client):
+        mock_client.query.return_value = Mock(QuerySuccess, data=SUMMARY)
+
+        response = app.test_client().get('/customers/101/orders/summary?ordersPageSize=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['lifetimeSpend'], 27000)
+        query = mock_client.query.call_args.args[0]
+        self.assertEqual(query.template, 'customer_order_summary')
+        self.assertIn('customer!.orderStats', str(FaunaEncoder.encode(query)))
+
+        # The same summary again is Not Modified.
+        etag = response.headers['ETag']
+        response = app.test_client().get('/customers/101/orders/summary?ordersPageSize=3',
+                                         headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_get_order_summary_of_missing_customer(self, mock_client):
+        mock_client.query.side_effect = AbortError(
+            status_code=400, code='abort', message='Query aborted.', abort=queries.CUSTOMER_NOT_FOUND)
+
+        response = app.test_client().get('/customers/404/orders/summary')
+        self.assertEqual(response.status_code, 404)
+
+    def test_status_changes_update_the_stats(self):
+        query = queries.update_order('1', 'shipped', None)
+        self.assertIn('updateOrderStats(updated, previousStatus)', str(FaunaEncoder.encode(query)))
+
+    def test_add_stats(self):
+        total = backfill_order_stats.add_stats(stats(1, 100, LATE), stats(2, 50, EARLY))
+        self.assertEqual(total, stats(3, 150, LATE))
+        self.assertEqual(backfill_order_stats.add_stats(stats(0, 0, None), stats(1, 10, EARLY))['lastOrderAt'], EARLY)
+
+    @mock.patch('scripts.backfill_order_stats.client')
+    def test_backfill_scans_every_page(self, mock_client):
+        mock_client.query.side_effect = [
+            Mock(QuerySuccess, data={'stats': stats(1, 100, LATE), 'version': 7, 'after': 'token'}),
+            Mock(QuerySuccess, data={'stats': stats(2, 50, EARLY)}),
+            Mock(QuerySuccess, data=True),
+        ]
+
+        self.assertEqual(backfill_order_stats.backfill('101', page_size=2), stats(3, 150, LATE))
+        save = mock_client.query.call_args.args[0]
+        self.assertEqual(save.template, 'save_order_stats')
+
+    @mock.patch('scripts.backfill_order_stats.client')
+    def test_backfill_scans_again_if_the_orders_changed(self, mock_client):
+        mock_client.query.side_effect = [
+            Mock(QuerySuccess, data={'stats': stats(1, 100, EARLY), 'version': 7}),
+            # An order was checked out during the scan, so the stats changed.
+            Mock(QuerySuccess, data=False),
+            Mock(QuerySuccess, data={'stats': stats(2, 150, LATE), 'version': 8}),
+            Mock(QuerySuccess, data=True),
+        ]
+
+        self.assertEqual(backfill_order_stats.backfill('101', page_size=100), stats(2, 150, LATE))
+        self.assertEqual(mock_client.query.call_count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
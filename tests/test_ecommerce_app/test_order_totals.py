@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna.encoding import FaunaEncoder, QuerySuccess
+
+from ecommerce_app import queries
+from scripts import backfill_order_totals
+
+
+def fql_text(query) -> str:
+    return str(FaunaEncoder.encode(query))
+
+
+class TestOrderTotals(unittest.TestCase):
+
+    def test_placed_orders_are_left_alone(self):
+        # A processing order's total is fixed at checkout, so only carts are compared with today's prices.
+        query = fql_text(queries.reconcile_order_totals(None, 100, fix=True))
+        self.assertIn('Order.all().where(.status == "cart")', query)
+        self.assertNotIn('.itemCount == 0', query)
+
+    def test_backfill_only_sets_orders_at_zero(self):
+        query = fql_text(queries.reconcile_order_totals(None, 100, fix=True, backfill=True))
+        self.assertIn('Order.all().where(.itemCount == 0 && .total == 0)', query)
+        self.assertNotIn('.status == "cart"', query)
+
+    @mock.patch('scripts.backfill_order_totals.client')
+    def test_check_reports_drifted_carts(self, mock_client):
+        mock_client.query.side_effect = [
+            Mock(QuerySuccess, data={'checked': 2, 'drifted': [], 'after': 'token'}),
+            Mock(QuerySuccess, data={'checked': 1, 'drifted': [
+                {'id': '1', 'stored': {'total': 100, 'itemCount': 1}, 'expected': {'total': 120, 'itemCount': 1}}]}),
+        ]
+
+        with mock.patch('sys.argv', ['backfill_order_totals', '--check']), mock.patch('builtins.print'):
+            with self.assertRaises(SystemExit) as exit_:
+                backfill_order_totals.main()
+        self.assertEqual(exit_.exception.code, 1)
+        self.assertEqual(mock_client.query.call_count, 2)
+        first = fql_text(mock_client.query.call_args_list[0].args[0])
+        self.assertIn('.status == "cart"', first)
+
+
+if __name__ == '__main__':
+    unittest.main()
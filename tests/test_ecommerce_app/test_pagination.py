@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna import Page
+from fauna.encoding import QuerySuccess
+
+from ecommerce_app import pagination
+from ecommerce_app.app import app
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
+
+
+def page(data, after, first=False):
+    response = Mock(QuerySuccess)
+    response.data = Page(data=data, after=after) if first else {'data': data, 'after': after}
+    return response
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(pagination, 'page_cache', ReadThroughCache('pages', MemoryBackend(), ttl=30))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_pages(self, mock_client):
+        mock_client.query.side_effect = [page([{'id': '1'}], 'a', first=True), page([{'id': '2'}], 'b'),
+                                         page([{'id': '3'}], None)]
+
+        response = app.test_client().get('/customers/999/orders?pages=5')
+        self.assertEqual(response.json, {'data': [{'id': '1'}, {'id': '2'}, {'id': '3'}], 'next': None})
+        # Stops at the last page.
+        self.assertEqual(mock_client.query.call_count, 3)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_prefetch(self, mock_client):
+        mock_client.query.side_effect = [page([{'id': '1'}], 'a', first=True), page([{'id': '2'}], None)]
+
+        response = app.test_client().get('/products?fields=id&prefetch=true')
+        self.assertEqual(response.json['next'], 'a')
+        key = pagination.cache_key('a', frozenset({'id'}))
+        pagination.page_cache.get(key).result()
+        self.assertEqual(mock_client.query.call_count, 2)
+
+        # The next page is served from the prefetch, without another query.
+        response = app.test_client().get('/products?fields=id&nextToken=a')
+        self.assertEqual(response.json, {'data': [{'id': '2'}], 'next': None})
+        self.assertEqual(mock_client.query.call_count, 2)
+        self.assertIsNone(pagination.page_cache.get(key))
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_prefetch_is_kept_by_fields(self, mock_client):
+        mock_client.query.side_effect = [page([{'id': '1'}], 'a', first=True), page([{'id': '2'}], None),
+                                         page([{'id': '2', 'name': 'Drone'}], None)]
+
+        app.test_client().get('/products?fields=id&prefetch=true')
+        pagination.page_cache.get(pagination.cache_key('a', frozenset({'id'}))).result()
+
+        # Without fields the whole product is asked for, so the sparse prefetched page isn't used.
+        response = app.test_client().get('/products?nextToken=a')
+        self.assertEqual(response.json['data'], [{'id': '2', 'name': 'Drone'}])
+        self.assertEqual(mock_client.query.call_count, 3)
+
+    def test_invalid_pages(self):
+        for pages in ('0', 'all', '1000'):
+            response = app.test_client().get(f'/products?pages={pages}')
+            self.assertEqual(response.status_code, 400)
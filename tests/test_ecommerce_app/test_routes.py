@@ -5,9 +5,11 @@ from unittest.mock import Mock
 
 import flask
 from fauna import Page
-from fauna.encoding import QuerySuccess
+from fauna.encoding import FaunaEncoder, QuerySuccess
+from fauna.errors import QueryRuntimeError
 
 from ecommerce_app.app import app
+from ecommerce_app.cache import MemoryBackend, ReadThroughCache
 from ecommerce_app.models.category import Category
 from ecommerce_app.models.product import Product
 from ecommerce_app.routes import get_products
@@ -30,3 +32,111 @@ class TestProductController(unittest.TestCase):
             self.assertTrue(b"abcdef" in response.data)
             self.assertEqual(status, 200)
 
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_get_products_with_fields(self, mock_client):
+
+        mock_response = Mock(QuerySuccess)
+        mock_response.data = Page(data=[{'id': '1234', 'price': 1}], after=None)
+        mock_client.query.return_value = mock_response
+        with app.test_request_context('/products?fields=id,price'):
+
+            response, status = get_products()
+            self.assertEqual(status, 200)
+            self.assertEqual(response.json['data'], [{'id': '1234', 'price': 1}])
+            query = str(mock_client.query.call_args[0][0].fragments[-2].get())
+            self.assertEqual(query, '{id: product.id, price: product.price}')
+
+    def test_get_products_with_unknown_fields(self):
+        response = app.test_client().get('/products?fields=id,bogus')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bogus', response.json['message'])
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_get_products_by_price(self, mock_client):
+        mock_response = Mock(QuerySuccess)
+        mock_response.data = Page(data=[{'id': '1234', 'price': 150}], after=None)
+        mock_client.query.return_value = mock_response
+
+        response = app.test_client().get('/products?sort=price&minPrice=100&maxPrice=200&fields=id,price')
+        self.assertEqual(response.status_code, 200)
+        query = mock_client.query.call_args[0][0]
+        self.assertEqual(query.template, 'products_by_price')
+        # A range read of the covered index, projected to index values only.
+        products = query.fragments[0].get()
+        self.assertIn('Product.sortedByPriceLowToHigh(', str(products.fragments[0].get()))
+        self.assertEqual(products.fragments[1].get(), {'from': 100, 'to': 200})
+        self.assertEqual(str(query.fragments[-2].get()), '{id: product.id, price: product.price}')
+
+    def test_get_products_by_price_invalid(self):
+        for query in ('sort=name', 'minPrice=-1', 'minPrice=300&maxPrice=200'):
+            response = app.test_client().get(f'/products?{query}')
+            self.assertEqual(response.status_code, 400)
+        # The category isn't an index value.
+        response = app.test_client().get('/products?sort=price&fields=id,category')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('ecommerce_app.routes.client')
+    def test_get_missing_product(self, mock_client):
+        mock_client.query.side_effect = QueryRuntimeError(
+            status_code=400, code='document_not_found', message='Collection `Product` does not contain document.')
+
+        response = app.test_client().get('/products/missing-product')
+        self.assertEqual(response.status_code, 404)
+        # The read is non-null asserted, so Fauna answers document_not_found rather than null.
+        self.assertIn(')!', str(FaunaEncoder.encode(mock_client.query.call_args.args[0])))
+
+
+class TestCustomerCartItems(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.customer_controller.client')
+    def test_post_cart_items(self, mock_client):
+
+        mock_response = Mock(QuerySuccess)
+        mock_response.data = {'cart': {'id': '123', 'status': 'cart'},
+                              'errors': [{'productName': 'missing', 'error': 'Product does not exist.'}]}
+        mock_client.query.return_value = mock_response
+        items = [{'productName': 'a', 'quantity': 1}, {'productName': 'missing', 'quantity': 1},
+                 {'productName': 'a', 'quantity': 3}]
+
+        response = app.test_client().post('/customers/999/cart/items', json={'items': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, mock_response.data)
+        # One query for the whole batch, with the last quantity for a repeated product.
+        mock_client.query.assert_called_once()
+        sent = mock_client.query.call_args[0][0].fragments[3].get()
+        self.assertEqual(sent, [{'productName': 'missing', 'quantity': 1}, {'productName': 'a', 'quantity': 3}])
+
+    @mock.patch('ecommerce_app.customer_controller.client')
+    def test_post_cart_items_invalid(self, mock_client):
+        response = app.test_client().post('/customers/999/cart/items', json={'items': [{'productName': 'a'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('item 0', response.json['message'])
+        response = app.test_client().post('/customers/999/cart/items', json={'items': []})
+        self.assertEqual(response.status_code, 400)
+        response = app.test_client().post('/customers/999/cart/items',
+                                          json={'items': [{'productName': 'a', 'quantity': 1},
+                                                          {'productName': 'b', 'quantity': True}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('item 1', response.json['message'])
+        mock_client.query.assert_not_called()
+
+
+class TestOrderCheckout(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.order_controller.client')
+    def test_checkout(self, mock_client):
+        order = {'id': '5', 'status': 'processing', 'items': [{'product': {'id': '1'}, 'quantity': 2}]}
+        mock_client.query.return_value = Mock(QuerySuccess, data=order)
+        product_cache = ReadThroughCache('products', MemoryBackend(), ttl=30)
+        product_cache.set('1', {'version': 'v1', 'data': {'id': '1', 'stock': 10}})
+
+        with mock.patch('ecommerce_app.order_controller.product_cache', product_cache):
+            response = app.test_client().post('/orders/5/checkout', json={'payment': {'type': 'card'}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, order)
+        query = mock_client.query.call_args[0][0]
+        self.assertEqual(query.template, 'checkout')
+        self.assertEqual([query.fragments[1].get(), query.fragments[3].get()], ['5', {'type': 'card'}])
+        # The stock it took is read again.
+        self.assertIsNone(product_cache.get('1'))
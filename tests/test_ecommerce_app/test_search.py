@@ -0,0 +1,132 @@
+import threading
+import unittest
+from unittest import mock
+from unittest.mock import Mock
+
+from fauna import Page
+from fauna.encoding import QuerySuccess
+
+from ecommerce_app.app import app
+from ecommerce_app.search import InvalidSearchError, ProductSearch, SearchIndex, load_products, parse_search
+
+PRODUCTS = [
+    {'id': '1', 'name': 'Drone', 'description': 'Flies with a camera', 'price': 9000, 'stock': 0},
+    {'id': '2', 'name': 'Camera', 'description': 'Takes pictures', 'price': 5000, 'stock': 3},
+    {'id': '3', 'name': 'Camera drone mount', 'description': 'Holds a camera', 'price': 1500, 'stock': 8},
+    {'id': '4', 'name': 'Cardboard box', 'description': 'For shipping', 'price': 100, 'stock': 50},
+]
+
+
+def ids(results) -> list:
+    return [result['id'] for result in results]
+
+
+def found(index: SearchIndex, query: str, limit: int = 10) -> list:
+    return [index.result(slot)['id'] for slot in index.search(query, limit)]
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def test_ranking(self):
+        index = SearchIndex(PRODUCTS)
+        # A name that starts with the query, then a whole word of a name, then a word of a description.
+        self.assertEqual(found(index, 'camera'), ['2', '3', '1'])
+        self.assertEqual(found(index, 'ca'), ['2', '4', '3', '1'])
+        self.assertEqual(found(index, 'ca', 2), ['2', '4'])
+        # Every word has to match.
+        self.assertEqual(found(index, 'dro ca'), ['3', '1'])
+        self.assertEqual(found(index, 'drone shipping'), [])
+        # One letter is too short a prefix to search for, so it's left out.
+        self.assertEqual(found(index, 'c'), [])
+        self.assertEqual(found(index, 'dro c'), found(index, 'dro'))
+
+    def test_writes(self):
+        index = SearchIndex(PRODUCTS)
+        index.upsert({**PRODUCTS[1], 'stock': 7})
+        self.assertEqual(index.result(index.search('camera', 1)[0]),
+                         {'id': '2', 'name': 'Camera', 'price': 5000, 'stock': 7})
+        # A price or stock change doesn't move the product to a new slot.
+        self.assertEqual(index.removed, 0)
+
+        index.upsert({**PRODUCTS[1], 'name': 'Zoom lens'})
+        self.assertEqual(found(index, 'zoom'), ['2'])
+        self.assertEqual(index.added, ['lens', 'zoom'])
+        with mock.patch('ecommerce_app.search.MAX_ADDED_WORDS', 2):
+            index.upsert({'id': '5', 'name': 'Tripod', 'description': None})
+        # Merged into the sorted vocabulary once there are too many.
+        self.assertEqual(index.added, [])
+        self.assertEqual(found(index, 'tri'), ['5'])
+        self.assertEqual(found(index, 'zo'), ['2'])
+        self.assertNotIn('2', found(index, 'camera'))
+        index.remove('4')
+        self.assertEqual(found(index, 'cardboard'), [])
+        self.assertEqual(len(index), 4)
+
+
+class TestProductSearch(unittest.TestCase):
+
+    def test_loads_once_and_applies_writes(self):
+        load = Mock(return_value=PRODUCTS)
+        search = ProductSearch(load, refresh=0)
+        search.upsert({'id': '5', 'name': 'Ignored', 'description': None})
+        self.assertEqual(ids(search.search('camera', 10)), ['2', '3', '1'])
+        # Written before the index was loaded, so it's in the snapshot or not at all.
+        self.assertEqual(search.search('ignored', 10), [])
+
+        # A cached result still has the latest stock.
+        search.upsert({**PRODUCTS[1], 'stock': 1})
+        self.assertEqual(search.search('camera', 10)[0]['stock'], 1)
+        search.upsert({'id': '5', 'name': 'Camera bag', 'description': None, 'price': 10, 'stock': 1})
+        self.assertEqual(ids(search.search('camera', 10)), ['2', '5', '3', '1'])
+        load.assert_called_once()
+
+    def test_writes_are_not_blocked_by_a_search(self):
+        search = ProductSearch(Mock(return_value=PRODUCTS), refresh=0)
+        search.search('camera', 10)
+        scanning, release = threading.Event(), threading.Event()
+        scan = search.index.search
+
+        def slow_search(query, limit):
+            scanning.set()
+            release.wait(5)
+            return scan(query, limit)
+
+        results = []
+        with mock.patch.object(search.index, 'search', slow_search):
+            thread = threading.Thread(target=lambda: results.append(search.search('dro', 10)))
+            thread.start()
+            scanning.wait(5)
+            # Applied while the search is still scanning.
+            writer = threading.Thread(target=search.upsert, args=(
+                {'id': '5', 'name': 'Drone battery', 'description': None, 'price': 10, 'stock': 1},))
+            writer.start()
+            writer.join(1)
+            self.assertFalse(writer.is_alive())
+            release.set()
+            thread.join()
+        self.assertTrue(results)
+        # The scan overlapped the write, so its result isn't cached.
+        self.assertEqual(ids(search.search('dro', 10)), ['1', '5', '3'])
+
+    def test_parse_search(self):
+        self.assertEqual(parse_search('dro', None), ('dro', 10))
+        self.assertEqual(parse_search('dro', '5'), ('dro', 5))
+        self.assertEqual(parse_search('a dro', None), ('a dro', 10))
+        for query, limit in ((None, None), (' ', None), ('a', None), ('a b', None), ('dro', '0'), ('dro', '51'),
+                             ('dro', 'x')):
+            with self.assertRaises(InvalidSearchError):
+                parse_search(query, limit)
+
+    @mock.patch('ecommerce_app.search.client')
+    def test_route(self, mock_client):
+        # The snapshot is read a page at a time.
+        mock_client.query.side_effect = [Mock(QuerySuccess, data=Page(data=PRODUCTS[:2], after='next')),
+                                         Mock(QuerySuccess, data=Page(data=PRODUCTS[2:], after=None))]
+        with mock.patch('ecommerce_app.routes.product_search', ProductSearch(load_products, refresh=0)):
+            response = app.test_client().get('/products/search?q=Camera%20dr&limit=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ids(response.json['data']), ['3', '1'])
+        self.assertEqual(mock_client.query.call_count, 2)
+
+        response = app.test_client().get('/products/search?q=')
+        self.assertEqual(response.status_code, 400)
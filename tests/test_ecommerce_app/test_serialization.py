@@ -0,0 +1,24 @@
+import json
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from ecommerce_app.serialization import page_chunks
+
+
+class TestSerialization(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.serialization.ROWS_PER_CHUNK', 2)
+    def test_page_chunks(self):
+        data = [{'id': str(i)} for i in range(5)]
+        chunks = list(page_chunks(data, 'abc'))
+        # The envelope, three chunks of rows, and the end of the envelope.
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), {'data': data, 'next': 'abc'})
+
+    def test_empty_page(self):
+        self.assertEqual(b''.join(page_chunks([], None)), b'{"data":[],"next":null}\n')
+
+    def test_dates_match_jsonify(self):
+        body = b''.join(page_chunks([{'createdAt': datetime(2024, 1, 1, tzinfo=timezone.utc)}], None))
+        self.assertEqual(json.loads(body)['data'][0]['createdAt'], 'Mon, 01 Jan 2024 00:00:00 GMT')
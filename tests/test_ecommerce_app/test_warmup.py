@@ -0,0 +1,78 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import AsyncMock, Mock
+
+from fauna.errors import NetworkError
+
+from ecommerce_app import warmup
+from ecommerce_app.fauna_client import LazyFaunaClient
+
+
+class TestLazyFaunaClient(unittest.TestCase):
+
+    def test_built_on_first_use(self):
+        built = Mock()
+        client = LazyFaunaClient(lambda: built)
+        self.assertFalse(client.built)
+
+        client.query('query')
+        self.assertTrue(client.built)
+        built.query.assert_called_once_with('query', None)
+        self.assertIs(client.pool_stats, built.pool_stats)
+
+    def test_built_once_by_concurrent_callers(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.05)
+            return Mock()
+
+        client = LazyFaunaClient(build)
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(client.get())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(len({id(built) for built in clients}), 1)
+
+
+class TestWarmUp(unittest.TestCase):
+
+    @mock.patch('ecommerce_app.warmup.negotiation.preload')
+    @mock.patch('ecommerce_app.warmup.projections.preload')
+    def test_opens_connections_and_preloads(self, preload_projections, preload_codecs):
+        client = Mock()
+        stats = warmup.warm_up(client, connections=3)
+
+        self.assertEqual(client.query.call_count, 3)
+        self.assertEqual({call.args[0].template for call in client.query.call_args_list}, {'ping'})
+        preload_projections.assert_called_once_with()
+        preload_codecs.assert_called_once_with()
+        self.assertEqual(stats['state'], 'done')
+        self.assertEqual(stats['connections'], 3)
+
+    def test_failed_pings_are_recorded(self):
+        client = Mock()
+        client.query.side_effect = NetworkError('unreachable')
+        stats = warmup.warm_up(client, connections=2)
+
+        self.assertEqual(stats['state'], 'failed')
+        self.assertEqual(stats['errors'], 2)
+
+    def test_async_warm_up(self):
+        client = Mock()
+        client.query = AsyncMock(side_effect=[0, NetworkError('unreachable')])
+        stats = asyncio.run(warmup.awarm_up(client, connections=2))
+
+        self.assertEqual(stats['state'], 'done')
+        self.assertEqual((stats['connections'], stats['errors']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()